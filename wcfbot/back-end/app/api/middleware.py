@@ -0,0 +1,92 @@
+"""
+ASGI middleware enforcing request body limits while the body is still streaming in
+"""
+import json
+from typing import Dict
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """
+    Rejects request bodies above a per-path-prefix limit with 413.
+
+    A declared Content-Length over the limit is refused before any of the body is
+    read. Otherwise the received bytes are counted chunk by chunk and the request
+    is cut off as soon as it passes the limit, instead of after Starlette has
+    buffered the whole multipart body.
+    """
+
+    def __init__(self, app: ASGIApp, limits: Dict[str, int]):
+        self.app = app
+        # Longest prefix first so the most specific limit wins
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit_for(self, path: str):
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    @staticmethod
+    async def _reject(send: Send, limit: int) -> None:
+        body = json.dumps({"detail": f"Request body is too large. Maximum size is {limit // (1024 * 1024)}MB."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self._limit_for(scope["path"])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await self._reject(send, limit)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise RequestTooLarge()
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            if exceeded:
+                # The app turned the aborted read into an error response; replace it
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send, limit)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except RequestTooLarge:
+            if not response_started:
+                await self._reject(send, limit)
@@ -7,12 +7,17 @@ class UserRequest(BaseModel):
                          example="mambo wewe nani?", 
                          description="The message sent by the user to the chatbot."       
                          )
+    session_id: Optional[str] = Field("default",
+                         example="4f9c2a1e-wcf-session",
+                         description="Identifier of the conversation this message belongs to. Memory is kept per session."
+                         )
     @classmethod
     def as_form(
         cls,
-        message: str = Form(...)
+        message: str = Form(...),
+        session_id: Optional[str] = Form("default")
     ) -> "UserRequest":
-        return cls(message=message)
+        return cls(message=message, session_id=session_id or "default")
     
 class AssistantMessage(BaseModel):
     role: str
@@ -29,4 +34,7 @@ class UserRequestTTS(BaseModel):
 
 
 class TextToSpeechRequest(BaseModel):
-    text: str
\ No newline at end of file
+    text: str
+    pipelined: Optional[bool] = Field(None,
+                         description="Synthesize sentence by sentence and stream in order. Defaults to on for long texts."
+                         )
\ No newline at end of file
@@ -1,9 +1,26 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Request
+from fastapi.responses import JSONResponse, FileResponse, Response
+import asyncio
+import io
 import logging
+import os
+import time
+from contextlib import aclosing
 from app.api.models.user_request import TextToSpeechRequest
+from typing import Optional
+import json
 import httpx
-import os
+from app.utils.http_client import upstream
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+from app.utils.uploads import SpooledUpload, spool_upload, MAX_AUDIO_BYTES
+from app.utils.ndjson import dumps_line
+from app.utils.cancellation import generation_sizes, record_cancelled
+from app.api.streaming import CancellableStreamingResponse
+from app.utils.audio_normalize import MAX_NORMALIZE_BYTES, NORMALIZE_ENABLED, is_wav, normalize_for_upload
+from app.utils.audio_cache import audio_cache, audio_key, AUDIO_CACHE_ENABLED
+from app.utils.speech import split_sentences, should_pipeline, synthesize, synthesize_in_order, tee_to_cache
+from app.utils.transcription import MAX_SEGMENT_S, UnsupportedAudio, decode_wav, transcribe_long, wav_duration
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,60 +32,108 @@ logger = logging.getLogger("uvicorn")
 logger.info("Running On Audio Routers....")
 
 
-TTS_API_URL = os.getenv("TTS_API_URL")
-voice = os.getenv("VOICE")
-tts_model =os.getenv("TTS_MODEL")
-max_tokens = int(os.getenv("TTS_MAX_TOKEN"))
-temperature = float(os.getenv("TTS_TEMP"))
-top_p = float(os.getenv("TTS_TOP_P"))
-repetition_penalty = float(os.getenv("REP_PENALTY"))
-SPEECH_TO_TEXT_API_URL = os.getenv("STT_API_URL")
-
-@audio_router.post("/v1/audio/text-to-speech", tags=['Audio'])
-async def text_to_speech(req: TextToSpeechRequest):
+def cached_audio_response(path: str, key: str, request: Request) -> Response:
     """
-    Streams audio from TTS API directly to client
+    Serve cached audio from disk. FileResponse answers Range requests (so players
+    can seek) and hands the file to the server without copying when it supports
+    the pathsend extension; the ETag is the content key, so it never goes stale.
     """
-    payload = {
-        "text": req.text,
-        "voice": voice,
-        "model": tts_model,
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "top_p": top_p,
-        "repetition_penalty": repetition_penalty
-    }
+    etag = f'"{key}"'
     headers = {
-        "Authorization": f"Bearer {os.getenv('PAWA_AI_API_KEY')}"
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "X-Audio-Cache-Key": key,
+        "X-Audio-Cache": "hit",
     }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="audio/mpeg", headers=headers)
+
+
+async def time_to_first_byte(chunks, mode: str, started: float):
+    """Pass audio through, recording the time from request to first audio byte"""
+    first = True
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            if first:
+                metrics.observe(f"tts.ttfb_ms.{mode}", (time.perf_counter() - started) * 1000)
+                first = False
+            yield chunk
+
+
+async def pipelined_audio(text: str, settings):
+    async with aclosing(synthesize_in_order(split_sentences(text), settings)) as segments:
+        async for _, _, chunk in segments:
+            yield chunk
+
+
+@audio_router.post("/v1/audio/text-to-speech", tags=['Audio'])
+async def text_to_speech(req: TextToSpeechRequest, request: Request):
+    """
+    Streams audio from TTS API directly to client. Audio for text synthesized
+    before with the same settings is served from the TTS cache; a first
+    synthesis is written to the cache while it streams.
+
+    Long texts (or `pipelined: true`) are split at sentence boundaries and the
+    sentences synthesized a few at a time, streamed back in order, so audio
+    starts after the first sentence instead of after the whole text.
+    """
+    started = time.perf_counter()
+    settings = get_settings()
+    key = audio_key(req.text, settings.tts)
+    if AUDIO_CACHE_ENABLED:
+        cached = await asyncio.to_thread(audio_cache.lookup, key)
+        if cached is not None:
+            metrics.observe("tts.ttfb_ms.cached", (time.perf_counter() - started) * 1000)
+            return cached_audio_response(cached, key, request)
+
+    mode = "pipelined" if should_pipeline(req.text, req.pipelined) else "single"
+    source = pipelined_audio(req.text, settings) if mode == "pipelined" else synthesize(req.text, settings)
 
     async def audio_stream():
+        streamed = 0
         try:
-            async with httpx.AsyncClient(timeout=60) as client:
-                async with client.stream("POST", TTS_API_URL, json=payload, headers=headers) as response:
-                    if response.status_code != 200:
-                        body = await response.aread()
-                        raise HTTPException(
-                            status_code=response.status_code,
-                            detail=f"TTS service error: {response.status_code} - {body.decode()}"
-                        )
-                    async for chunk in response.aiter_bytes():
-                        yield chunk
+            async with aclosing(time_to_first_byte(tee_to_cache(key, source), mode, started)) as chunks:
+                async for chunk in chunks:
+                    streamed += len(chunk)
+                    yield chunk
+            generation_sizes.completed("tts", streamed, len(req.text))
         except httpx.TimeoutException:
             raise HTTPException(status_code=408, detail="TTS service timeout")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+        except (GeneratorExit, asyncio.CancelledError):
+            # The client went away; closing the chain above stops the synthesis
+            record_cancelled("tts", "bytes", streamed, len(req.text))
+            raise
 
-    return StreamingResponse(
+    return CancellableStreamingResponse(
         audio_stream(),
         media_type="audio/mpeg",
         headers={
             "Cache-Control": "no-cache",
-            "Connection": "keep-alive"
+            "Connection": "keep-alive",
+            "X-Audio-Cache-Key": key,
+            "X-Audio-Cache": "miss",
+            "X-TTS-Mode": mode
         }
     )
 
 
+@audio_router.get("/v1/audio/text-to-speech/{audio_key}", tags=['Audio'])
+async def get_cached_speech(audio_key: str, request: Request):
+    """
+    Cached audio by the key returned in the X-Audio-Cache-Key header, with ETag
+    and Range support for seeking players
+    """
+    if len(audio_key) != 64 or any(c not in "0123456789abcdef" for c in audio_key):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    path = await asyncio.to_thread(audio_cache.lookup, audio_key)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return cached_audio_response(path, audio_key, request)
+
+
 @audio_router.post("/v1/audio/speech-to-text", tags=['Audio'])
 async def speech_to_text(
 
@@ -77,31 +142,67 @@ async def speech_to_text(
     language: str = Form(...),
     temp: float = Form(...),
     resp_format: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    long_audio: Optional[bool] = Form(None),
+    stream: bool = Form(False)
 ):
-    
+    """
+    Transcribe an audio file. WAV uploads are first normalized to 16 kHz mono
+    with the silence at both ends trimmed. WAV recordings longer than one
+    segment (or any WAV with long_audio=true) are split at silences and the
+    segments transcribed concurrently; with stream=true the per-segment
+    results are streamed as NDJSON in order, followed by the stitched transcript.
+    """
+    spooled = await spool_upload(file, MAX_AUDIO_BYTES)
+    filename, body, content_type = spooled.filename, spooled.body(), spooled.content_type
+    headers = {}
+    normalized = None
+    if NORMALIZE_ENABLED and await should_normalize(spooled):
+        data = body if isinstance(body, bytes) else await asyncio.to_thread(body.read)
+        normalized = await normalize_for_upload(data)
+        if normalized is None and not isinstance(body, bytes):
+            body = spooled.body()
+    if normalized is not None:
+        body, report = normalized
+        filename = f"{os.path.splitext(filename or 'audio')[0]}.wav"
+        content_type = "audio/wav"
+        headers = normalization_headers(report)
+        spooled.close()
+
+    if long_audio is not False:
+        source = io.BytesIO(body) if isinstance(body, bytes) else body
+        duration = await asyncio.to_thread(wav_duration, source)
+        if duration is not None and (long_audio or duration > MAX_SEGMENT_S):
+            return await long_speech_to_text(spooled, source, filename, {
+                "model": model,
+                "language": language,
+                "prompt": prompt,
+                "temperature": str(temp),
+                "response_format": resp_format,
+            }, stream, headers)
+
     form_data = {
         "model": (None, model),
         "language": (None, language),
         "prompt": (None, prompt),
         "temperature": (None, str(temp)),
         "response_format": (None, resp_format),
-        "file": (file.filename, await file.read(), file.content_type)
+        "file": (filename, body, content_type)
     }
     
-    headers = {
-        "Authorization": f"Bearer {os.getenv('PAWA_AI_API_KEY')}"
+    settings = get_settings()
+    auth_headers = {
+        "Authorization": f"Bearer {settings.api_key}"
     }
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                SPEECH_TO_TEXT_API_URL,
-                files=form_data,
-                timeout=60,
-                headers=headers
-            )
-            resp.raise_for_status()
-            return JSONResponse(content=resp.json())
+        resp = await upstream.post(
+            settings.stt_url,
+            files=form_data,
+            headers=auth_headers,
+            timeout=upstream.audio_timeout
+        )
+        resp.raise_for_status()
+        return JSONResponse(content=resp.json(), headers=headers)
 
     except httpx.HTTPStatusError as e:
         return JSONResponse(
@@ -120,4 +221,63 @@ async def speech_to_text(
                 "details": str(ex)
             }
         )
+    finally:
+        spooled.close()
+
+
+async def should_normalize(spooled: SpooledUpload) -> bool:
+    """
+    Only WAV uploads up to Max_Input_MB are read into memory for normalization;
+    anything else is sent on from its spool untouched
+    """
+    if spooled.size > MAX_NORMALIZE_BYTES:
+        metrics.incr("stt.normalize.skipped_too_large")
+        return False
+    if not await asyncio.to_thread(is_wav, spooled.file):
+        metrics.incr("stt.normalize.skipped_not_wav")
+        return False
+    return True
 
+
+def normalization_headers(report: dict) -> dict:
+    return {
+        "X-Audio-Bytes-In": str(report["bytes_in"]),
+        "X-Audio-Bytes-Out": str(report["bytes_out"]),
+        "X-Audio-Normalize-Ms": str(report["normalize_ms"]),
+        "X-Audio-Upload-Saved-Ms": str(report["upload_saved_ms"]),
+    }
+
+
+async def long_speech_to_text(spooled, source, filename: Optional[str], form: dict, stream: bool, headers: dict):
+    try:
+        audio = await asyncio.to_thread(decode_wav, source)
+    except UnsupportedAudio as e:
+        spooled.close()
+        return JSONResponse(status_code=415, content={"error": "Unsupported audio for long-audio mode", "details": str(e)})
+    filename = filename or "audio"
+    spooled.close()
+
+    results = transcribe_long(audio, form, filename)
+    if stream:
+        async def ndjson():
+            async for result in results:
+                yield dumps_line(result)
+        return CancellableStreamingResponse(ndjson(), media_type="application/x-ndjson", headers=headers)
+
+    segments = []
+    async for result in results:
+        if result["type"] == "partial":
+            segments.append({key: value for key, value in result.items() if key != "type"})
+        else:
+            final = result
+    if final["errors"] and len(final["errors"]) == len(segments):
+        return JSONResponse(
+            status_code=502,
+            content={"error": "STT service returned an error", "details": final["errors"]}
+        )
+    return JSONResponse(content={
+        "text": final["text"],
+        "duration": final["duration"],
+        "segments": segments,
+        "errors": final["errors"]
+    }, headers=headers)
@@ -86,10 +86,13 @@
 from fastapi import APIRouter
 import logging
 from app.api.models.user_request import UserRequest, UserResponse
-from fastapi import HTTPException, status, Depends
-from app.engine import pawa_chat_non_streaming, pawa_chat_streaming
-from fastapi.responses import StreamingResponse
-from typing import List, Optional
+from fastapi import HTTPException, status, Depends, Request
+from app.engine import pawa_chat_non_streaming, pawa_chat_streaming_with_progress, pawa_chat_to_speech
+from app.utils.uploads import SpooledUpload, spool_uploads, close_uploads, MAX_FILE_BYTES
+from app.api.streaming import CancellableStreamingResponse
+from app.utils.resumable_stream import Generation, generations, parse_event_id, sse_stream
+from starlette.background import BackgroundTask
+from typing import AsyncIterator, List, Optional
 from fastapi import File, UploadFile
 from dotenv import load_dotenv
 load_dotenv(override=True)
@@ -98,70 +101,172 @@ chat_router = r = APIRouter()
 logger = logging.getLogger("uvicorn")
 logger.info("Running On Chat Routers....")
 
+SUPPORTED_CONTENT_TYPES = ["application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "text/plain", "audio/mp3", "audio/mpeg", "audio/wav", "audio/wave", "audio/x-wav", "audio/x-pn-wav", "image/png", "image/jpg", "image/jpeg"]
+
+async def validate_and_spool_files(files: Optional[List[UploadFile]]) -> Optional[List[SpooledUpload]]:
+    """
+    Check the number and types of the attachments, then copy each of them into a
+    spooled temporary file, rejecting any file over the size limit while it is read.
+    """
+    if not files:
+        return None
+
+    if len(files) > 3:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You can only upload up to 3 files."
+        )
+        
+    for file in files:
+        if file.content_type not in SUPPORTED_CONTENT_TYPES:
+            raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unsupported file type: {file.content_type} for file {file.filename}. Supported types are: pdf, docx, txt, mp3, wav, png, jpg, jpeg."
+                )
+        
+        if file.size is not None and file.size > MAX_FILE_BYTES:
+            raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"File {file.filename} is too large. Maximum size is {MAX_FILE_BYTES // (1024 * 1024)}MB."
+                    )
+
+    return await spool_uploads(files, MAX_FILE_BYTES)
+
 @r.post("/", summary="Generate text from user with Pawa AI", tags=["Chat"])
 async def create_chat_request_non_stream(
           request: UserRequest = Depends(UserRequest.as_form),  
           files: Optional[List[UploadFile]] = File(None) 
     ):
     
+    spooled_files = None
     try:
-        if files:
-            if len(files) > 3:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="You can only upload up to 3 files."
-                )
-                
-            for file in files:
-                if file.content_type not in ["application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "text/plain", "audio/mp3", "audio/mpeg", "audio/wav", "audio/wave", "audio/x-wav", "audio/x-pn-wav", "image/png", "image/jpg", "image/jpeg"]:
-                    raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f"Unsupported file type: {file.content_type} for file {file.filename}. Supported types are: pdf, docx, txt, mp3, wav, png, jpg, jpeg."
-                        )
-                
-            if file.size > 5 * 1024 * 1024:
-                raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f"File {file.filename} is too large. Maximum size is 5MB."
-                        )
-                
-        response = await pawa_chat_non_streaming(request, files=files)        
+        spooled_files = await validate_and_spool_files(files)
+        response = await pawa_chat_non_streaming(request, files=spooled_files)        
         assistance_message= response["data"]["request"][0]["message"]
         return UserResponse(message=assistance_message)
+    except HTTPException as e:
+        if e.status_code in (status.HTTP_400_BAD_REQUEST, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE):
+            raise
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occured in non stream chat") from e
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An error occured in non stream chat") from e
+    finally:
+        close_uploads(spooled_files)
+
+def wants_event_stream(http_request: Request) -> bool:
+    return "text/event-stream" in http_request.headers.get("accept", "")
+
+def event_stream_response(generation: Generation, after: int = -1, background: Optional[BackgroundTask] = None) -> CancellableStreamingResponse:
+    return CancellableStreamingResponse(
+        sse_stream(generation, after),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Stream-Id": generation.id
+        },
+        background=background
+    )
+
+async def closing_uploads(stream: AsyncIterator[str], files: Optional[List[SpooledUpload]]) -> AsyncIterator[str]:
+    """`stream`, closing the uploads it reads once it is over, whoever is still listening"""
+    try:
+        async for line in stream:
+            yield line
+    finally:
+        await stream.aclose()
+        close_uploads(files)
 
 @r.post("/stream", summary="Generate streaming text from user with Pawa AI", tags=["Chats"])
 async def create_chat_request_stream(
+          http_request: Request,
           request: UserRequest = Depends(UserRequest.as_form),  
           files: Optional[List[UploadFile]] = File(None) 
     ): 
+    """
+    Streams the answer as NDJSON lines, or as server-sent events when the client
+    accepts text/event-stream. Every event carries an id; re-sending the request
+    with that id in Last-Event-ID continues the same generation from there
+    instead of starting a new one, for as long as the stream is buffered.
+
+    The stream opens before attachments are extracted; progress lines (SSE
+    `progress` events) report each step until the answer follows.
+    """
+    sse = wants_event_stream(http_request)
+    if sse and http_request.headers.get("last-event-id"):
+        resumed = generations.resume(http_request.headers["last-event-id"])
+        if resumed is not None:
+            return event_stream_response(*resumed)
+
+    spooled_files = None
     try:
-        if files:
-            if len(files) > 3:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="You can only upload up to 3 files."
-                )
-                
-            for file in files:
-                if file.content_type not in ["application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "text/plain", "audio/mp3", "audio/mpeg", "audio/wav", "audio/wave", "audio/x-wav", "audio/x-pn-wav", "image/png", "image/jpg", "image/jpeg"]:
-                    raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f"Unsupported file type: {file.content_type} for file {file.filename}. Supported types are: pdf, docx, txt, mp3, wav, png, jpg, jpeg."
-                        )
-                    
-            if file.size > 5 * 1024 * 1024:
-                raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f"File {file.filename} is too large. Maximum size is 5MB."
-                        )
-            
-        stream = await pawa_chat_streaming(request, files=files)
-        return StreamingResponse(stream, media_type="text/event-stream")
+        spooled_files = await validate_and_spool_files(files)
+        # Extraction reads the uploads inside the stream, which closes them when it ends
+        stream = closing_uploads(pawa_chat_streaming_with_progress(request, files=spooled_files), spooled_files)
+        if sse:
+            return event_stream_response(generations.start(stream))
+        return CancellableStreamingResponse(stream, media_type="application/x-ndjson")
+    except HTTPException as e:
+        close_uploads(spooled_files)
+        if e.status_code in (status.HTTP_400_BAD_REQUEST, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while processing your request."
+        ) from e
     except Exception as e:
+        close_uploads(spooled_files)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while processing your request."
         ) from e
 
+@r.get("/stream/{stream_id}", summary="Resume a streamed answer", tags=["Chats"])
+async def resume_chat_stream(stream_id: str, http_request: Request):
+    """
+    Server-sent events of a stream started with POST /stream, from the event
+    after Last-Event-ID, or from the start without it. EventSource clients
+    reconnect here on their own.
+    """
+    generation = generations.get(stream_id)
+    if generation is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found or expired.")
+    after = -1
+    parsed = parse_event_id(http_request.headers.get("last-event-id", ""))
+    if parsed is not None and parsed[0] == stream_id:
+        after = parsed[1]
+    return event_stream_response(generation, after)
+
+@r.post("/speech", summary="Stream the chat answer as text and speech with Pawa AI", tags=["Chats"])
+async def create_chat_speech_stream(
+          request: UserRequest = Depends(UserRequest.as_form),  
+          files: Optional[List[UploadFile]] = File(None) 
+    ): 
+    """
+    NDJSON stream of text deltas and base64 audio frames for the same answer.
+    Speech for each sentence starts as soon as the sentence is complete, while
+    the rest of the answer is still being generated.
+    """
+    spooled_files = None
+    try:
+        spooled_files = await validate_and_spool_files(files)
+        stream = await pawa_chat_to_speech(request, files=spooled_files)
+        return CancellableStreamingResponse(
+            stream,
+            media_type="application/x-ndjson",
+            background=BackgroundTask(close_uploads, spooled_files)
+        )
+    except HTTPException as e:
+        close_uploads(spooled_files)
+        if e.status_code in (status.HTTP_400_BAD_REQUEST, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while processing your request."
+        ) from e
+    except Exception as e:
+        close_uploads(spooled_files)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while processing your request."
+        ) from e
@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+import logging
+from app.utils.metrics import metrics
+from app.engine.agent import recent_timelines
+from app.utils.single_flight import in_flight
+
+metrics_router = APIRouter()
+logger = logging.getLogger("uvicorn")
+logger.info("Running On Metrics Routers....")
+
+
+@metrics_router.get("/", summary="In-process performance counters", tags=["Metrics"])
+async def get_metrics():
+    return metrics.snapshot()
+
+
+@metrics_router.get("/agent", summary="Per-round timelines of recent chat requests", tags=["Metrics"])
+async def get_agent_timelines():
+    return [run.timeline() for run in recent_timelines]
+
+
+@metrics_router.get("/single_flight", summary="Coalescing of identical in-flight chat requests", tags=["Metrics"])
+async def get_single_flight():
+    return in_flight.stats()
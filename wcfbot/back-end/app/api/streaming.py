@@ -0,0 +1,51 @@
+"""
+Streaming responses that stop generating as soon as the client goes away
+"""
+import anyio
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from app.utils.metrics import metrics
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that listens for the client disconnecting for the whole
+    response, whatever ASGI version the server speaks, not only when a write
+    fails. On disconnect the body is cancelled where it is waiting and then
+    closed, so the generators under it release their upstream connections at
+    once instead of reading the upstream response to the end.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        disconnected = False
+
+        async def stream() -> None:
+            nonlocal disconnected
+            try:
+                await self.stream_response(send)
+            except OSError:
+                disconnected = True
+            task_group.cancel_scope.cancel()
+
+        async def listen() -> None:
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected = True
+                    break
+            task_group.cancel_scope.cancel()
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(stream)
+                await listen()
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            if disconnected:
+                metrics.incr("http.stream_disconnects")
+
+        if self.background is not None:
+            await self.background()
@@ -1,254 +1,252 @@
 from fastapi import HTTPException, status
 from app.api.models.user_request import UserRequest
 from app.utils.format_message import msg_to_pawa_chat
-import yaml
 import httpx
-import os
 import json
-from typing import AsyncGenerator, List, Optional
-from fastapi import UploadFile
-from app.utils.format_memory import format_message
-from app.utils.tool_excuter import handle_tool_calls
+import asyncio
+import base64
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncGenerator, List, Optional, Tuple
+from app.utils.uploads import SpooledUpload
+from app.utils.memory_writer import memory_writer
+from app.engine.agent import AgentRun, agent_complete, agent_stream, estimate_tokens
+from app.utils.cancellation import generation_sizes, record_cancelled, should_persist_partial
+from app.utils.metrics import metrics
+from app.utils.ndjson import COALESCE_ENABLED, coalesce, dumps_line, loads
+from app.utils.progress import Progress, ProgressLine, progress_line, report
+from app.utils.single_flight import SINGLE_FLIGHT_ENABLED, Flight, in_flight
+from app.utils.settings import get_settings
+from app.utils.speech import SentenceAccumulator, synthesize_in_order
+from app.utils.answer_cache import (
+    ANSWER_CACHE_ENABLED,
+    CachedAnswer,
+    answer_cache,
+    answer_key,
+    is_cacheable,
+    settings_fingerprint,
+)
+from app.utils.semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticMatch, semantic_cache
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
-with open("app/engine/config.yaml", "r") as file:
-    config = yaml.safe_load(file)
 
-BASE_UL = config["Chat"]["Base_URL"]
-ENDPOINT = config["Chat"]["Endpoint"]
-url = f"{BASE_UL}{ENDPOINT}"
-MEMORY_PATH = "app/engine/memory.json"
+@dataclass
+class AnswerTicket:
+    """Where the answer to a cacheable request goes once it is complete"""
+    message: str
+    key: Optional[str] = None
+    namespace: Optional[str] = None
+    lookup: Optional["asyncio.Task[Optional[SemanticMatch]]"] = None
 
 
-async def inference_pawa_chat_stream(complete_message: dict, request: UserRequest) -> AsyncGenerator[str, None]:
-    try:
-        async with httpx.AsyncClient(timeout=300) as client:
-            async with client.stream(
-                "POST",
-                url=url,
-                json=complete_message,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {os.getenv('PAWA_AI_API_KEY')}"
+async def lookup_answer(complete_message: dict, request: UserRequest, has_files: bool) -> Tuple[Optional[CachedAnswer], Optional[AnswerTicket]]:
+    """
+    Look the request up in the exact-match cache, then in the semantic cache.
+    Returns the cached answer on a hit, otherwise a ticket for storing the new
+    answer, or (None, None) when the request is not eligible for caching.
+    """
+    if not is_cacheable(complete_message, has_files):
+        return None, None
+
+    chat = get_settings().chat
+    fingerprint = settings_fingerprint(chat)
+    ticket = AnswerTicket(message=request.message)
+    if ANSWER_CACHE_ENABLED:
+        ticket.key = answer_key(request.message, chat)
+        cached = answer_cache.get(ticket.key)
+        if cached is not None:
+            return cached, None
+
+    if SEMANTIC_CACHE_ENABLED:
+        ticket.namespace = semantic_cache.namespace_for(chat.kb_reference_id, fingerprint)
+        ticket.lookup = semantic_cache.start_lookup(ticket.namespace, request.message)
+        try:
+            match = await asyncio.wait_for(asyncio.shield(ticket.lookup), semantic_cache.lookup_timeout)
+        except asyncio.TimeoutError:
+            # Generate without it; the lookup finishes in the background and the answer is stored with it
+            metrics.incr("semantic_cache.lookup_timeouts")
+        else:
+            if match is None:
+                ticket.lookup = None
+            elif match.answer is not None:
+                if ticket.key is not None:
+                    answer_cache.put(ticket.key, match.answer.content, list(match.answer.chunks))
+                return match.answer, None
+
+    if ticket.key is None and ticket.lookup is None:
+        return None, None
+    return None, ticket
+
+
+async def remember_answer(ticket: Optional[AnswerTicket], content: str, chunks: Optional[List[str]] = None) -> None:
+    if ticket is None:
+        return
+    if ticket.key is not None:
+        answer_cache.put(ticket.key, content, chunks)
+    if ticket.lookup is not None:
+        await semantic_cache.remember(ticket.namespace, ticket.message, ticket.lookup, content, chunks)
+
+
+def assistant_chunk(content: str) -> str:
+    """One NDJSON line of the streaming chat response"""
+    return dumps_line({
+        "message": {
+            "role": "assistant",
+            "content": content
+        }
+    })
+
+
+async def replay_cached_answer(answer: CachedAnswer, request: UserRequest) -> AsyncGenerator[str, None]:
+    """Stream a cached answer in the same chunks the upstream produced"""
+    for content in answer.chunks:
+        yield assistant_chunk(content)
+    memory_writer.enqueue(request.session_id, request.message, answer.content)
+
+
+def cached_response_json(answer: CachedAnswer) -> dict:
+    """A cached answer in the shape of a non-streaming Pawa AI chat response"""
+    return {
+        "data": {
+            "request": [
+                {
+                    "finish_reason": "stop",
+                    "message": {
+                        "role": "assistant",
+                        "content": answer.content
+                    }
                 }
-            ) as response:
-
-                if response.status_code != 200:
-                    body = await response.aread()
-                    raise HTTPException(
-                        status_code=response.status_code,
-                        detail=body.decode() or "Streaming failed"
-                    )
-                
-                complete_response_message = ""
-                tool_calls = []
-                
-                async for line in response.aiter_lines():
-                    if line.strip():
-                        try:
-                            data = json.loads(line.strip())
-                            
-                            # Handle different response structures
-                            if 'data' not in data:
-                                print(f"Unexpected response structure: {data}")
-                                continue
-                                
-                            if not data['data'].get('request'):
-                                print(f"No request data: {data}")
-                                continue
-                                
-                            finish_reason = data['data']['request'][0]['finish_reason']
-                            
-                            if finish_reason == "tool_calls":
-                                # Handle tool calls
-                                tool_calls = data['data']['request'][0]['message'].get('tool_calls', [])
-                                if tool_calls:
-                                    print(f"Processing tool calls: {tool_calls}")
-                                    
-                                    # Execute tools and make follow-up request
-                                    updated_message = await handle_tool_calls(tool_calls, complete_message)
-                                    
-                                    # Make a new streaming request with tool results
-                                    async with client.stream(
-                                        "POST",
-                                        url=url,
-                                        json=updated_message,
-                                        headers={
-                                            "Content-Type": "application/json",
-                                            "Authorization": f"Bearer {os.getenv('PAWA_AI_API_KEY')}"
-                                        }
-                                    ) as tool_response:
-                                        async for tool_line in tool_response.aiter_lines():
-                                            if tool_line.strip():
-                                                try:
-                                                    tool_data = json.loads(tool_line.strip())
-                                                    
-                                                    # Check if tool_response has expected structure
-                                                    if 'data' not in tool_data:
-                                                        print(f"Tool response missing data: {tool_data}")
-                                                        continue
-                                                        
-                                                    if not tool_data['data'].get('request'):
-                                                        print(f"Tool response missing request: {tool_data}")
-                                                        continue
-                                                    
-                                                    if tool_data['data']['request'][0]['finish_reason'] != "tool_calls":
-                                                        content = tool_data['data']['request'][0]['message']['content']
-                                                        complete_response_message += content
-                                                        yield json.dumps({
-                                                            "message": {
-                                                                "role": "assistant",
-                                                                "content": content
-                                                            }
-                                                        }) + "\n"
-                                                except json.JSONDecodeError as e:
-                                                    print(f"JSON decode error in tool response: {e}")
-                                                    continue
-                                                except KeyError as e:
-                                                    print(f"KeyError in tool response: {e}, data: {tool_data}")
-                                                    continue
-                                continue
-                            else:
-                                content = data['data']['request'][0]['message']['content']
-                                complete_response_message += content
-                                yield json.dumps({
-                                    "message": {
-                                        "role": "assistant",
-                                        "content": content
-                                    }
-                                }) + "\n"
-                        except json.JSONDecodeError as e:
-                            print(f"JSON decode error: {e}, line: {line}")
-                            continue
-                        except KeyError as e:
-                            print(f"KeyError: {e}, data: {data}")
-                            continue
-                        except Exception as e:
-                            print(f"Unexpected error: {e}, data: {data}")
-                            continue
-                
-                # Save to memory
-                from_assistant = complete_response_message
-                from_user = request.message
-                user_entry = format_message("user", from_user)
-                assistant_entry = format_message("assistant", from_assistant)
-                
-                try:
-                    if os.path.exists(MEMORY_PATH):
-                        with open(MEMORY_PATH, "r", encoding="utf-8") as f:
-                            memory_data = json.load(f)
-                    else:
-                        memory_data = []
-                except Exception:
-                    memory_data = []
-                
-                memory_data.extend([user_entry, assistant_entry])
-                
-                with open(MEMORY_PATH, "w", encoding="utf-8") as f:
-                    json.dump(memory_data, f, ensure_ascii=False, indent=2)
+            ]
+        },
+        "cached": True
+    }
 
-    except httpx.RequestError:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Failed to connect to the Pawa AI backend."
-        )
 
-async def inference_pawa_chat_non_stream(complete_message: dict, request: UserRequest) -> dict:
+async def generate_answer(complete_message: dict, run: AgentRun, ticket: Optional[AnswerTicket] = None) -> AsyncGenerator[str, None]:
+    """Content deltas of the answer, independent of any session; cached once complete"""
+    complete_response_message = ""
     try:
-        async with httpx.AsyncClient(timeout=300) as client:
-            response = await client.post(
-                url=url,
-                json=complete_message,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {os.getenv('PAWA_AI_API_KEY')}"
-                }
-            )
+        chunks = []
+        deltas = agent_stream(complete_message, run)
+        if COALESCE_ENABLED:
+            # Fewer, larger frames: one write per window instead of one per token
+            deltas = coalesce(deltas)
+        # Closing the deltas closes the upstream stream under them right away
+        async with aclosing(deltas):
+            async for content in deltas:
+                complete_response_message += content
+                chunks.append(content)
+                yield content
+
+        generation_sizes.completed("chat", run.tokens or estimate_tokens(complete_response_message))
+        # Tool results can change between calls, so never cache those answers
+        if run.tool_rounds == 0 and run.stop_reason == "stop":
+            await remember_answer(ticket, complete_response_message, chunks)
+
     except httpx.RequestError:
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail="Failed to connect to the Pawa AI backend."
         )
+    except (GeneratorExit, asyncio.CancelledError):
+        # Nobody is listening any more
+        record_cancelled("chat", "tokens", estimate_tokens(complete_response_message))
+        run.finish("client_disconnect")
+        raise
+
+def remember_partial_answer(request: UserRequest, content: str) -> bool:
+    """Save the part of an answer the client received before it went away, if it is long enough"""
+    persisted = should_persist_partial(content)
+    if persisted:
+        memory_writer.enqueue(request.session_id, request.message, content)
+    metrics.incr(f"chat.cancelled.partial_memory_{'persisted' if persisted else 'skipped'}")
+    return persisted
 
+async def inference_pawa_chat_stream(
+    complete_message: dict,
+    request: UserRequest,
+    ticket: Optional[AnswerTicket] = None,
+    progress: Optional[Progress] = None
+) -> AsyncGenerator[str, None]:
+    run = AgentRun(progress=progress)
+    complete_response_message = ""
     try:
-        response_json = response.json()
-    except ValueError:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Invalid JSON returned from Pawa AI"
-        )
+        async with aclosing(generate_answer(complete_message, run, ticket)) as deltas:
+            async for content in deltas:
+                complete_response_message += content
+                yield assistant_chunk(content)
 
-    if response.status_code != 200:
-        raise HTTPException(
-            status_code=response.status_code,
-            detail=response_json.get("detail", "An error occurred")
-        )
-    
-    # Check if response contains tool calls
-    finish_reason = response_json['data']['request'][0]['finish_reason']
-    
-    if finish_reason == "tool_calls":
-        tool_calls = response_json['data']['request'][0]['message'].get('tool_calls', [])
-        if tool_calls:
-            print(f"Processing tool calls: {tool_calls}")
-            
-            # Execute tools and make follow-up request
-            updated_message = await handle_tool_calls(tool_calls, complete_message)
-            print(f"Updated message with tools: {json.dumps(updated_message, indent=2)}")
-            
-            # Make another request with tool results
-            try:
-                async with httpx.AsyncClient(timeout=300) as client:
-                    tool_response = await client.post(
-                        url=url,
-                        json=updated_message,
-                        headers={
-                            "Content-Type": "application/json",
-                            "Authorization": f"Bearer {os.getenv('PAWA_AI_API_KEY')}"
-                        }
-                    )
-                tool_response_json = tool_response.json()
-                
-                if tool_response.status_code == 200:
-                    response_json = tool_response_json  # Use the tool response as final response
-                else:
-                    print(f"Tool response error: {tool_response_json}")
-                    
-            except Exception as e:
-                print(f"Error in tool follow-up request: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail=f"Failed to process tool calls: {str(e)}"
-                )
-    
-    from_assistant = response_json['data']['request'][0]['message']['content']
-    from_user = request.message
+        # Save to memory
+        memory_writer.enqueue(request.session_id, request.message, complete_response_message)
+    except (GeneratorExit, asyncio.CancelledError):
+        # The client went away mid-answer
+        run.partial_memory = remember_partial_answer(request, complete_response_message)
+        raise
 
-    user_entry = format_message("user", from_user)
-    assistant_entry = format_message("assistant", from_assistant)
-    
+def coalescing_key(complete_message: dict, request: UserRequest, has_files: bool) -> Optional[str]:
+    """Identical in-flight requests share a generation under the key their answers are cached by"""
+    if not SINGLE_FLIGHT_ENABLED or not is_cacheable(complete_message, has_files):
+        return None
+    return answer_key(request.message, get_settings().chat)
+
+def flight_answer(complete_message: dict, ticket: Optional[AnswerTicket], flight: Flight) -> AsyncGenerator[str, None]:
+    """The answer of a coalesced request, with its progress published to every subscriber"""
+    run = AgentRun(progress=lambda stage, **detail: flight.publish(progress_line(stage, **detail)))
+    return generate_answer(complete_message, run, ticket)
+
+async def follow_flight(flight: Flight, request: UserRequest, progress: Optional[Progress] = None) -> AsyncGenerator[str, None]:
+    """
+    One subscriber's stream of a coalesced answer, releasing the subscription
+    reserved by `in_flight.join` or `in_flight.lead` when it ends. Each
+    subscriber saves the answer to its own session's memory; progress lines
+    are only passed on to callers that asked for progress.
+    """
+    complete_response_message = ""
     try:
-        if os.path.exists(MEMORY_PATH):
-            with open(MEMORY_PATH, "r", encoding="utf-8") as f:
-                memory_data = json.load(f)
-        else:
-            memory_data = []
-    except Exception:
-        memory_data = []
+        async with aclosing(flight.subscribe()) as items:
+            async for item in items:
+                if isinstance(item, ProgressLine):
+                    if progress is not None:
+                        yield item
+                    continue
+                complete_response_message += item
+                yield assistant_chunk(item)
+        memory_writer.enqueue(request.session_id, request.message, complete_response_message)
+    except (GeneratorExit, asyncio.CancelledError):
+        remember_partial_answer(request, complete_response_message)
+        raise
+    finally:
+        flight.release()
 
-    memory_data.extend([user_entry, assistant_entry])
+async def inference_pawa_chat_non_stream(complete_message: dict, request: UserRequest, ticket: Optional[AnswerTicket] = None) -> dict:
+    run = AgentRun()
+    try:
+        response_json = await agent_complete(complete_message, run)
+    except httpx.RequestError:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to connect to the Pawa AI backend."
+        )
 
-    with open(MEMORY_PATH, "w", encoding="utf-8") as f:
-        json.dump(memory_data, f, ensure_ascii=False, indent=2)
+    from_assistant = response_json['data']['request'][0]['message']['content']
+    memory_writer.enqueue(request.session_id, request.message, from_assistant)
+    if run.tool_rounds == 0 and run.stop_reason == "stop":
+        await remember_answer(ticket, from_assistant)
+    response_json["timeline"] = run.timeline()
     
     return response_json
 
-async def pawa_chat_non_streaming(request: UserRequest, files: Optional[List[UploadFile]] = None) -> dict:
+async def pawa_chat_non_streaming(request: UserRequest, files: Optional[List[SpooledUpload]] = None) -> dict:
     try:
         complete_message = await msg_to_pawa_chat(request, files, is_streaming=False)
         # print("Request payload:", json.dumps(complete_message, indent=2))
-        response = await inference_pawa_chat_non_stream(complete_message, request)
+        cached, ticket = await lookup_answer(complete_message, request, bool(files))
+        if cached is not None:
+            memory_writer.enqueue(request.session_id, request.message, cached.content)
+            return cached_response_json(cached)
+        response = await inference_pawa_chat_non_stream(complete_message, request, ticket)
         return response
     except Exception as e:
         print(f"Error in pawa_chat_non_streaming: {e}")
@@ -257,13 +255,139 @@ async def pawa_chat_non_streaming(request: UserRequest, files: Optional[List[Upl
             detail="An error occurred while processing a non streaming request"
         ) from e
 
-async def pawa_chat_streaming(request: UserRequest, files: Optional[List[UploadFile]] = None):
+async def pawa_chat_streaming(request: UserRequest, files: Optional[List[SpooledUpload]] = None, progress: Optional[Progress] = None):
     try:
-        complete_message = await msg_to_pawa_chat(request, files, is_streaming=True)
+        complete_message = await msg_to_pawa_chat(request, files, is_streaming=True, progress=progress)
         # print("Streaming request payload:", json.dumps(complete_message, indent=2))
-        return inference_pawa_chat_stream(complete_message, request) 
+        key = coalescing_key(complete_message, request, bool(files))
+        flight = in_flight.join(key) if key is not None else None
+        if flight is not None:
+            report(progress, "joined_in_flight")
+            return follow_flight(flight, request, progress)
+        cached, ticket = await lookup_answer(complete_message, request, bool(files))
+        if cached is not None:
+            return replay_cached_answer(cached, request)
+        if key is not None:
+            # Identical requests arriving from now on attach to this generation
+            flight = in_flight.lead(key, lambda flight: flight_answer(complete_message, ticket, flight))
+            return follow_flight(flight, request, progress)
+        return inference_pawa_chat_stream(complete_message, request, ticket, progress)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail="An error occurred while processing a streaming request"
         ) from e
+
+async def pawa_chat_streaming_with_progress(request: UserRequest, files: Optional[List[SpooledUpload]] = None) -> AsyncGenerator[str, None]:
+    """
+    The streaming answer, opened before the request is assembled: progress
+    lines ({"type": "progress", "stage": ...}) report file extraction, memory,
+    the knowledge base and tool calls until the answer lines follow. Errors
+    after the stream has started arrive as a {"type": "error"} line.
+    """
+    started = time.perf_counter()
+    lines: asyncio.Queue = asyncio.Queue()
+
+    def progress(stage: str, **detail) -> None:
+        lines.put_nowait(progress_line(stage, **detail))
+
+    async def produce() -> None:
+        try:
+            stream = await pawa_chat_streaming(request, files, progress)
+            metrics.observe("chat.stream.assembly_ms", (time.perf_counter() - started) * 1000)
+            async with aclosing(stream):
+                async for line in stream:
+                    lines.put_nowait(line)
+        except HTTPException as e:
+            lines.put_nowait(dumps_line({"type": "error", "status_code": e.status_code, "detail": e.detail}))
+        except Exception as e:
+            print(f"Error in pawa_chat_streaming_with_progress: {e}")
+            lines.put_nowait(dumps_line({"type": "error", "status_code": 500, "detail": "An error occurred while processing a streaming request"}))
+        finally:
+            lines.put_nowait(None)
+
+    progress("accepted")
+    producer = asyncio.create_task(produce())
+    first_content = True
+    try:
+        while (line := await lines.get()) is not None:
+            if first_content and not isinstance(line, ProgressLine):
+                first_content = False
+                metrics.observe("chat.stream.first_content_ms", (time.perf_counter() - started) * 1000)
+            yield line
+    finally:
+        # Cancelling the producer closes the upstream stream under it; waiting
+        # for it keeps the uploads open until extraction has let go of them
+        producer.cancel()
+        await asyncio.wait({producer})
+
+async def pawa_chat_to_speech(request: UserRequest, files: Optional[List[SpooledUpload]] = None):
+    """
+    Stream the chat answer as NDJSON text deltas and speak it at the same time:
+    completed sentences go to the TTS pipeline while generation continues, and
+    their audio is interleaved as base64 frames, in sentence order.
+
+        {"type": "text", "content": "..."}
+        {"type": "audio", "segment": 0, "text": "...", "data": "<base64 mp3>"}
+        {"type": "done", "segments": 3}
+    """
+    text_stream = await pawa_chat_streaming(request, files)
+    settings = get_settings()
+
+    async def events() -> AsyncGenerator[str, None]:
+        output: asyncio.Queue = asyncio.Queue()
+        sentences: asyncio.Queue = asyncio.Queue()
+        accumulator = SentenceAccumulator()
+
+        async def read_text() -> None:
+            try:
+                async for line in text_stream:
+                    content = loads(line)["message"]["content"]
+                    if not content:
+                        continue
+                    output.put_nowait({"type": "text", "content": content})
+                    for sentence in accumulator.feed(content):
+                        sentences.put_nowait(sentence)
+                for sentence in accumulator.flush():
+                    sentences.put_nowait(sentence)
+            finally:
+                sentences.put_nowait(None)
+
+        async def sentence_source():
+            while (sentence := await sentences.get()) is not None:
+                yield sentence
+
+        async def speak() -> int:
+            spoken = set()
+            async for index, text, chunk in synthesize_in_order(sentence_source(), settings):
+                spoken.add(index)
+                output.put_nowait({
+                    "type": "audio",
+                    "segment": index,
+                    "text": text,
+                    "data": base64.b64encode(chunk).decode("ascii")
+                })
+            return len(spoken)
+
+        async def run() -> None:
+            reader = asyncio.create_task(read_text())
+            try:
+                segments = await speak()
+                await reader
+                output.put_nowait({"type": "done", "segments": segments})
+            except Exception as e:
+                print(f"Error in chat to speech: {e}")
+                output.put_nowait({"type": "error", "detail": str(e)})
+            finally:
+                # Stops the upstream chat stream too if the client went away
+                reader.cancel()
+                output.put_nowait(None)
+
+        runner = asyncio.create_task(run())
+        try:
+            while (event := await output.get()) is not None:
+                yield dumps_line(event)
+        finally:
+            runner.cancel()
+
+    return events()
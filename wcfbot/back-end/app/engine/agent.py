@@ -0,0 +1,331 @@
+"""
+Multi-round tool loop over the chat API: the model is called, the tools it asks
+for are run, and it is called again with their results until it answers, the
+round limit is reached or the latency or token budget is spent
+"""
+import asyncio
+import contextlib
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, List, Optional
+from fastapi import HTTPException
+from app.utils.http_client import upstream
+from app.utils.metrics import metrics
+from app.utils.ndjson import NDJSONDecoder
+from app.utils.progress import Progress, report
+from app.utils.settings import get_settings
+from app.utils.tool_excuter import handle_tool_calls
+
+AGENT_CONFIG = get_settings().config.get("Agent_Loop", {})
+
+MAX_TOOL_ROUNDS = AGENT_CONFIG.get("Max_Tool_Rounds", 4)
+MAX_TOTAL_SECONDS = AGENT_CONFIG.get("Max_Total_Seconds", 120)
+MAX_TOTAL_TOKENS = AGENT_CONFIG.get("Max_Total_Tokens", 16000)
+BUDGET_MESSAGE = AGENT_CONFIG.get(
+    "Budget_Message",
+    "Samahani, sikuweza kukamilisha jibu kwa wakati. Tafadhali jaribu tena. / "
+    "Sorry, I could not complete the answer in time. Please try again."
+)
+
+# Runs of the most recent requests, newest last, for their timelines
+recent_timelines: deque = deque(maxlen=AGENT_CONFIG.get("Keep_Timelines", 100))
+
+
+@dataclass
+class RoundRecord:
+    round: int
+    model_ms: float = 0.0
+    tool_ms: float = 0.0
+    tokens: int = 0
+    finish_reason: Optional[str] = None
+    tool_calls: List[str] = field(default_factory=list)
+    # Tool calls requested by the model in this round, not part of the timeline
+    pending_tool_calls: list = field(default_factory=list, repr=False)
+
+
+@dataclass
+class AgentRun:
+    """Budgets and per-round timeline of one chat request"""
+    max_tool_rounds: int = MAX_TOOL_ROUNDS
+    max_seconds: float = MAX_TOTAL_SECONDS
+    max_tokens: int = MAX_TOTAL_TOKENS
+    started: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+    rounds: List[RoundRecord] = field(default_factory=list)
+    tokens: int = 0
+    stop_reason: Optional[str] = None
+    # Set when the client went away: whether the partial answer went to memory
+    partial_memory: Optional[bool] = None
+    # Told when a model round starts and when tools are called
+    progress: Optional[Progress] = field(default=None, repr=False)
+
+    @property
+    def tool_rounds(self) -> int:
+        return sum(1 for record in self.rounds if record.tool_calls)
+
+    def remaining(self) -> float:
+        return self.max_seconds - (time.monotonic() - self.started)
+
+    def tools_allowed(self) -> bool:
+        return self.tool_rounds < self.max_tool_rounds and self.tokens < self.max_tokens
+
+    def start_round(self) -> RoundRecord:
+        record = RoundRecord(round=len(self.rounds))
+        self.rounds.append(record)
+        return record
+
+    def finish(self, reason: str) -> None:
+        if self.stop_reason is not None:
+            return
+        self.stop_reason = reason
+        self.finished = time.monotonic()
+        total_ms = (self.finished - self.started) * 1000
+        metrics.observe("agent.rounds", len(self.rounds))
+        metrics.observe("agent.total_ms", total_ms)
+        metrics.observe("agent.model_ms", sum(record.model_ms for record in self.rounds))
+        metrics.observe("agent.tool_ms", sum(record.tool_ms for record in self.rounds))
+        metrics.incr(f"agent.stop.{reason}")
+        recent_timelines.append(self)
+
+    def timeline(self) -> dict:
+        return {
+            "total_ms": round(((self.finished or time.monotonic()) - self.started) * 1000, 1),
+            "tokens": self.tokens,
+            "stop_reason": self.stop_reason,
+            **({"partial_memory": self.partial_memory} if self.partial_memory is not None else {}),
+            "rounds": [
+                {
+                    "round": record.round,
+                    "model_ms": round(record.model_ms, 1),
+                    "tool_ms": round(record.tool_ms, 1),
+                    "tokens": record.tokens,
+                    "finish_reason": record.finish_reason,
+                    "tool_calls": record.tool_calls,
+                }
+                for record in self.rounds
+            ],
+        }
+
+
+def _choice(data: dict) -> Optional[dict]:
+    """First choice of a Pawa AI chat response or stream line, or None if it has another shape"""
+    requests = (data.get("data") or {}).get("request") if isinstance(data, dict) else None
+    return requests[0] if requests else None
+
+
+def _usage_tokens(data: dict) -> Optional[int]:
+    """Total tokens reported by the upstream, wherever the envelope puts them"""
+    for holder in (data, data.get("data") or {}, _choice(data) or {}):
+        usage = holder.get("usage") if isinstance(holder, dict) else None
+        if isinstance(usage, dict):
+            total = usage.get("total_tokens")
+            if total is None:
+                total = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+            return int(total)
+    return None
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token, used when the upstream reports no usage
+    return (len(text) + 3) // 4
+
+
+def _round_payload(complete_message: dict, run: AgentRun) -> dict:
+    if run.tools_allowed():
+        return complete_message
+    # Out of rounds or tokens: the model has to answer with what it has
+    return {**complete_message, "tool_choice": "none"}
+
+
+def _report_round(payload: dict, record: RoundRecord, run: AgentRun) -> None:
+    if record.round == 0 and "knowledgeBase" in payload:
+        report(run.progress, "querying_knowledge_base")
+    else:
+        report(run.progress, "generating", round=record.round)
+
+
+def _headers() -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {get_settings().api_key}"
+    }
+
+
+async def _run_tools(tool_calls: list, complete_message: dict, record: RoundRecord, run: AgentRun) -> bool:
+    """Run one round of tool calls within the remaining budget; False when the budget ran out"""
+    record.tool_calls = [call.get("function", {}).get("name") for call in tool_calls]
+    for name in record.tool_calls:
+        report(run.progress, "calling_tool", tool=name)
+    started = time.monotonic()
+    try:
+        async with asyncio.timeout(max(run.remaining(), 0)):
+            await handle_tool_calls(tool_calls, complete_message)
+        return True
+    except TimeoutError:
+        return False
+    finally:
+        record.tool_ms = (time.monotonic() - started) * 1000
+
+
+async def _stream_round(url: str, payload: dict, record: RoundRecord, run: AgentRun) -> AsyncIterator[str]:
+    """
+    Content of one streamed round; its tool calls are left on `record`. The
+    remaining latency budget bounds every wait on the upstream but not the time
+    spent by the consumer between lines. Raises TimeoutError when it runs out.
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        response = await asyncio.wait_for(
+            stack.enter_async_context(upstream.stream("POST", url, json=payload, headers=_headers())),
+            timeout=max(run.remaining(), 0)
+        )
+        if response.status_code != 200:
+            body = await response.aread()
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=body.decode() or "Streaming failed"
+            )
+        decoder = NDJSONDecoder("chat")
+        chunks = response.aiter_bytes()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(chunks), timeout=max(run.remaining(), 0))
+            except StopAsyncIteration:
+                chunk = None
+            for data in decoder.feed(chunk) if chunk is not None else decoder.flush():
+                for content in _apply_line(data, record):
+                    yield content
+            if chunk is None:
+                return
+
+
+def _apply_line(data: Any, record: RoundRecord) -> List[str]:
+    """Record the finish reason, usage and tool calls of one stream line; its content, if any"""
+    choice = _choice(data)
+    if choice is None:
+        metrics.incr("agent.unexpected_lines")
+        return []
+    usage = _usage_tokens(data)
+    if usage is not None:
+        record.tokens = usage
+    record.finish_reason = choice.get("finish_reason") or record.finish_reason
+    message = choice.get("message") or {}
+    if choice.get("finish_reason") == "tool_calls":
+        record.pending_tool_calls = message.get("tool_calls") or []
+    content = message.get("content")
+    return [content] if content else []
+
+
+async def agent_stream(complete_message: dict, run: AgentRun) -> AsyncIterator[str]:
+    """
+    Stream the assistant's content across every round. Each round's stream is
+    closed before the tools run, so the next round goes out on the same pooled
+    connection. `complete_message` grows with the tool calls and results.
+    """
+    url = get_settings().chat.url
+    produced = False
+    while True:
+        payload = _round_payload(complete_message, run)
+        record = run.start_round()
+        _report_round(payload, record, run)
+        text, stop_reason = "", None
+        started = time.monotonic()
+        try:
+            async with contextlib.aclosing(_stream_round(url, payload, record, run)) as contents:
+                async for content in contents:
+                    text += content
+                    produced = True
+                    yield content
+        except TimeoutError:
+            stop_reason = "latency_budget"
+        except (GeneratorExit, asyncio.CancelledError):
+            stop_reason = "client_disconnect"
+            raise
+        except Exception:
+            stop_reason = "error"
+            raise
+        finally:
+            record.model_ms = (time.monotonic() - started) * 1000
+            if not record.tokens:
+                record.tokens = estimate_tokens(text)
+            run.tokens += record.tokens
+            if stop_reason in ("error", "client_disconnect"):
+                run.finish(stop_reason)
+
+        tool_calls = record.pending_tool_calls
+        if stop_reason is None and not tool_calls:
+            run.finish(record.finish_reason or "stop")
+            return
+        if stop_reason is None and payload is not complete_message:
+            # Asked for tools although they were switched off
+            stop_reason = "tool_rounds" if run.tool_rounds >= run.max_tool_rounds else "token_budget"
+        if stop_reason is None:
+            print(f"Processing tool calls: {tool_calls}")
+            if await _run_tools(tool_calls, complete_message, record, run):
+                continue
+            stop_reason = "latency_budget"
+        run.finish(stop_reason)
+        if not produced:
+            yield BUDGET_MESSAGE
+        return
+
+
+def _with_content(response_json: dict, content: str) -> dict:
+    choice = _choice(response_json)
+    if choice is not None:
+        choice.setdefault("message", {})["content"] = content
+        choice["finish_reason"] = "stop"
+    return response_json
+
+
+async def agent_complete(complete_message: dict, run: AgentRun) -> dict:
+    """Non-streaming counterpart of `agent_stream`; returns the last round's response"""
+    url = get_settings().chat.url
+    response_json: dict = {"data": {"request": [{"finish_reason": "stop", "message": {"role": "assistant", "content": ""}}]}}
+    while True:
+        payload = _round_payload(complete_message, run)
+        record = run.start_round()
+        _report_round(payload, record, run)
+        started = time.monotonic()
+        try:
+            async with asyncio.timeout(max(run.remaining(), 0)):
+                response = await upstream.post(url, json=payload, headers=_headers())
+        except TimeoutError:
+            record.model_ms = (time.monotonic() - started) * 1000
+            run.finish("latency_budget")
+            return _with_content(response_json, BUDGET_MESSAGE)
+        except Exception:
+            run.finish("error")
+            raise
+        record.model_ms = (time.monotonic() - started) * 1000
+
+        try:
+            response_json = response.json()
+        except ValueError:
+            run.finish("error")
+            raise HTTPException(status_code=502, detail="Invalid JSON returned from Pawa AI")
+        if response.status_code != 200:
+            run.finish("error")
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response_json.get("detail", "An error occurred")
+            )
+
+        choice = _choice(response_json) or {}
+        message = choice.get("message") or {}
+        record.finish_reason = choice.get("finish_reason")
+        usage = _usage_tokens(response_json)
+        record.tokens = usage if usage is not None else estimate_tokens(message.get("content") or "")
+        run.tokens += record.tokens
+
+        tool_calls = (message.get("tool_calls") or []) if record.finish_reason == "tool_calls" else []
+        if not tool_calls:
+            run.finish(record.finish_reason or "stop")
+            return response_json
+        if payload is not complete_message:
+            run.finish("tool_rounds" if run.tool_rounds >= run.max_tool_rounds else "token_budget")
+            return _with_content(response_json, message.get("content") or BUDGET_MESSAGE)
+        print(f"Processing tool calls: {tool_calls}")
+        if not await _run_tools(tool_calls, complete_message, record, run):
+            run.finish("latency_budget")
+            return _with_content(response_json, BUDGET_MESSAGE)
@@ -0,0 +1,115 @@
+"""
+Exact-match cache of assistant answers for repeated, context-free questions
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from app.utils.metrics import metrics
+from app.utils.settings import ChatSettings, get_settings
+
+ANSWER_CACHE_CONFIG = get_settings().config.get("Answer_Cache", {})
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = " \t\n.?!,;:"
+
+
+def normalize_message(message: str) -> str:
+    """Unicode-normalized, case-folded message with collapsed whitespace and no trailing punctuation"""
+    message = unicodedata.normalize("NFKC", message).casefold()
+    return _WHITESPACE.sub(" ", message).strip(_TRAILING_PUNCTUATION)
+
+
+def settings_fingerprint(chat: ChatSettings) -> str:
+    """
+    SHA-256 over every setting that changes the answer to a given message:
+    model, knowledge base, system prompt, sampling parameters and tools.
+    """
+    parts = {
+        "model": chat.model,
+        "kb_reference_id": chat.kb_reference_id,
+        "is_must_use_kb": chat.is_must_use_kb,
+        "system_prompt": hashlib.sha256(chat.system_prompt.encode("utf-8")).hexdigest(),
+        "temperature": chat.temperature,
+        "top_p": chat.top_p,
+        "max_tokens": chat.max_tokens,
+        "frequency_penalty": chat.frequency_penalty,
+        "presence_penalty": chat.presence_penalty,
+        "seed": chat.seed,
+        "tool_choice": chat.tool_choice,
+        "tools": chat.tools,
+    }
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=dict)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def answer_key(message: str, chat: ChatSettings) -> str:
+    """SHA-256 of the normalized message and the settings fingerprint"""
+    encoded = f"{settings_fingerprint(chat)}\0{normalize_message(message)}"
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class CachedAnswer:
+    content: str
+    # Content deltas as they were streamed, so a replay emits the same chunks
+    chunks: Tuple[str, ...]
+
+
+class AnswerCache:
+    """
+    In-memory LRU of answers keyed by `answer_key`, each kept for `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, CachedAnswer]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[CachedAnswer]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and time.monotonic() - cached[0] > self.ttl:
+                del self._entries[key]
+                cached = None
+            if cached is None:
+                metrics.incr("answer_cache.misses")
+                return None
+            self._entries.move_to_end(key)
+        metrics.incr("answer_cache.hits")
+        return cached[1]
+
+    def put(self, key: str, content: str, chunks: Optional[List[str]] = None) -> None:
+        if not content.strip():
+            return
+        answer = CachedAnswer(content=content, chunks=tuple(chunks) if chunks else (content,))
+        with self._lock:
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.incr("answer_cache.evictions")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+ANSWER_CACHE_ENABLED = ANSWER_CACHE_CONFIG.get("Enabled", True)
+
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_CONFIG.get("Max_Entries", 1024),
+    ttl=ANSWER_CACHE_CONFIG.get("TTL_Seconds", 3600),
+)
+
+
+def is_cacheable(complete_message: dict, has_files: bool) -> bool:
+    """Answers that depend on uploaded files or memory context are never cached"""
+    return not has_files and not complete_message.get("memoryChat")
+
@@ -0,0 +1,168 @@
+"""
+Content-addressed disk cache of synthesized speech
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from app.utils.metrics import metrics
+from app.utils.settings import TTSSettings, get_settings
+
+AUDIO_CACHE_CONFIG = get_settings().config.get("TTS_Cache", {})
+
+
+def audio_key(text: str, tts: TTSSettings) -> str:
+    """SHA-256 over the text and every synthesis setting that changes the audio"""
+    parts = {
+        "text": text,
+        "voice": tts.voice,
+        "model": tts.model,
+        "max_tokens": tts.max_tokens,
+        "temperature": tts.temperature,
+        "top_p": tts.top_p,
+        "repetition_penalty": tts.repetition_penalty,
+    }
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    One audio file per key under `directory`, evicted least recently used first
+    once the total size passes `max_bytes`. The index of sizes is loaded lazily
+    from the directory, oldest modification time first.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024, extension: str = ".mp3"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._lock = threading.Lock()
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._bytes = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}{self.extension}")
+
+    def _load_index(self) -> None:
+        if self._index is not None:
+            return
+        found = []
+        if os.path.isdir(self.directory):
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".part"):
+                        # Left behind by a synthesis interrupted by a restart
+                        try:
+                            os.remove(os.path.join(root, name))
+                        except OSError:
+                            pass
+                    elif name.endswith(self.extension):
+                        stat = os.stat(os.path.join(root, name))
+                        found.append((stat.st_mtime, name[:-len(self.extension)], stat.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(found))
+        self._bytes = sum(self._index.values())
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the cached audio for `key`, marking it recently used, or None"""
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                metrics.incr("tts.cache.misses")
+                return None
+            path = self.path(key)
+            if not os.path.exists(path):
+                self._bytes -= self._index.pop(key)
+                metrics.incr("tts.cache.misses")
+                return None
+            self._index.move_to_end(key)
+        metrics.incr("tts.cache.hits")
+        return path
+
+    def _commit(self, key: str, part_path: str) -> None:
+        path = self.path(key)
+        size = os.path.getsize(part_path)
+        os.replace(part_path, path)
+        with self._lock:
+            self._load_index()
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                old_key, old_size = self._index.popitem(last=False)
+                self._bytes -= old_size
+                metrics.incr("tts.cache.evictions")
+                try:
+                    os.remove(self.path(old_key))
+                except OSError:
+                    pass
+
+    def writer(self, key: str, buffer_bytes: int = 256 * 1024) -> "AudioCacheWriter":
+        return AudioCacheWriter(self, key, buffer_bytes)
+
+
+class AudioCacheWriter:
+    """
+    Tee target for an audio stream: chunks are buffered and appended to a
+    temporary file in a worker thread, which becomes the cache entry only when
+    `commit()` is called after the stream completed; `abort()` discards it.
+    """
+
+    def __init__(self, cache: AudioCache, key: str, buffer_bytes: int):
+        self.cache = cache
+        self.key = key
+        self.buffer_bytes = buffer_bytes
+        self.part_path = f"{cache.path(key)}.{uuid.uuid4().hex}.part"
+        self._buffer = bytearray()
+        self._file = None
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.part_path), exist_ok=True)
+        self._file = open(self.part_path, "wb")
+
+    def _flush(self, data: bytes) -> None:
+        if self._file is None:
+            self._open()
+        self._file.write(data)
+
+    async def write(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        if len(self._buffer) >= self.buffer_bytes:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            await asyncio.to_thread(self._flush, data)
+
+    def _finish(self, data: bytes) -> None:
+        self._flush(data)
+        self._file.close()
+        self.cache._commit(self.key, self.part_path)
+
+    async def commit(self) -> None:
+        data, self._buffer = bytes(self._buffer), bytearray()
+        try:
+            await asyncio.to_thread(self._finish, data)
+        except OSError as e:
+            print(f"Error writing TTS cache entry {self.key}: {e}")
+            self.abort()
+
+    def abort(self) -> None:
+        """Drop the partial file; safe to call from a finally block or after commit failed"""
+        self._buffer = bytearray()
+        if self._file is not None:
+            self._file.close()
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+
+AUDIO_CACHE_ENABLED = AUDIO_CACHE_CONFIG.get("Enabled", True)
+AUDIO_CACHE_WRITE_BUFFER = int(AUDIO_CACHE_CONFIG.get("Write_Buffer_KB", 256) * 1024)
+
+audio_cache = AudioCache(
+    AUDIO_CACHE_CONFIG.get("Directory", "app/engine/tts_cache"),
+    max_bytes=int(AUDIO_CACHE_CONFIG.get("Max_MB", 1024) * 1024 * 1024),
+)
@@ -0,0 +1,128 @@
+"""
+WAV normalization before speech-to-text upload: mono, 16 kHz, trimmed and
+re-encoded as 16-bit PCM, computed in a process pool
+"""
+import asyncio
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Optional, Tuple
+import numpy as np
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+from app.utils.transcription import PCMAudio, UnsupportedAudio, decode_wav, encode_wav, frame_energy_db
+
+NORMALIZE_CONFIG = get_settings().config.get("STT_Normalize", {})
+
+NORMALIZE_ENABLED = NORMALIZE_CONFIG.get("Enabled", True)
+TARGET_RATE = NORMALIZE_CONFIG.get("Sample_Rate", 16000)
+TRIM_DB = NORMALIZE_CONFIG.get("Trim_DB_Below_Peak", 40)
+TRIM_PAD_MS = NORMALIZE_CONFIG.get("Trim_Pad_MS", 200)
+WORKERS = NORMALIZE_CONFIG.get("Workers", 2)
+# Uploads are copied into the worker process, so their size is capped
+MAX_NORMALIZE_BYTES = int(NORMALIZE_CONFIG.get("Max_Input_MB", 10) * 1024 * 1024)
+# Used to estimate the upload time saved by the smaller file
+UPLINK_MBPS = NORMALIZE_CONFIG.get("Uplink_Mbps", 20)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def resample(samples: np.ndarray, rate: int, target_rate: int) -> np.ndarray:
+    """
+    Band-limited resampling of a mono signal by truncating (or zero-padding)
+    its spectrum, which also removes everything above the new Nyquist frequency
+    """
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    count = max(1, int(round(len(samples) * target_rate / rate)))
+    spectrum = np.fft.rfft(samples)
+    bins = count // 2 + 1
+    if len(spectrum) >= bins:
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - len(spectrum), dtype=spectrum.dtype)])
+    return (np.fft.irfft(spectrum, count) * (count / len(samples))).astype(np.float32)
+
+
+def trim_silence(audio: PCMAudio, db_below_peak: float = TRIM_DB, pad_ms: int = TRIM_PAD_MS, frame_ms: int = 20) -> PCMAudio:
+    """Drop leading and trailing frames quieter than `db_below_peak` under the loudest, keeping `pad_ms`"""
+    energy = frame_energy_db(audio, frame_ms)
+    if len(energy) == 0:
+        return audio
+    loud = np.flatnonzero(energy >= energy.max() - db_below_peak)
+    frame = int(audio.sample_rate * frame_ms / 1000)
+    pad = int(audio.sample_rate * pad_ms / 1000)
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(audio.samples), (loud[-1] + 1) * frame + pad)
+    return PCMAudio(audio.samples[start:end], audio.sample_rate)
+
+
+def is_wav(source: BinaryIO) -> bool:
+    """Whether `source` starts with a RIFF/WAVE header; its position is left at the start"""
+    source.seek(0)
+    header = source.read(12)
+    source.seek(0)
+    return len(header) == 12 and header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+
+
+def normalize_wav(data: bytes, target_rate: int = TARGET_RATE) -> Tuple[bytes, dict]:
+    """
+    Worker: decode WAV bytes, downmix to mono, resample to `target_rate`, trim
+    silence at both ends and re-encode as 16-bit PCM WAV. Raises
+    UnsupportedAudio for anything that is not PCM WAV.
+    """
+    started = time.perf_counter()
+    audio = decode_wav(io.BytesIO(data))
+    mono = audio.samples.mean(axis=1) if audio.samples.shape[1] > 1 else audio.samples[:, 0]
+    mono = resample(mono, audio.sample_rate, target_rate)
+    trimmed = trim_silence(PCMAudio(mono[:, None], target_rate))
+    encoded = encode_wav(trimmed.samples, target_rate)
+    return encoded, {
+        "bytes_in": len(data),
+        "bytes_out": len(encoded),
+        "channels_in": audio.samples.shape[1],
+        "sample_rate_in": audio.sample_rate,
+        "duration_in": round(audio.duration, 3),
+        "duration_out": round(trimmed.duration, 3),
+        "normalize_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS)
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def normalize_for_upload(data: bytes) -> Optional[Tuple[bytes, dict]]:
+    """
+    Normalized WAV and a report, or None when the audio is not PCM WAV or the
+    result would not be smaller. Runs in the process pool, off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        encoded, report = await loop.run_in_executor(_get_pool(), normalize_wav, data)
+    except UnsupportedAudio:
+        return None
+    except Exception as e:
+        # A broken worker must not fail the transcription; upload the original
+        print(f"Error normalizing audio: {e}")
+        return None
+    if len(encoded) >= len(data):
+        return None
+
+    saved = report["bytes_in"] - report["bytes_out"]
+    report["upload_saved_ms"] = round(saved * 8 / (UPLINK_MBPS * 1_000_000) * 1000 - report["normalize_ms"], 1)
+    metrics.incr("stt.normalize.bytes_in", report["bytes_in"])
+    metrics.incr("stt.normalize.bytes_out", report["bytes_out"])
+    metrics.observe("stt.normalize.ms", report["normalize_ms"])
+    metrics.observe("stt.normalize.upload_saved_ms", report["upload_saved_ms"])
+    return encoded, report
@@ -0,0 +1,55 @@
+"""
+Accounting for generations cancelled because the client went away: how many,
+how much output was not generated, and whether a partial answer was kept
+"""
+import threading
+from typing import Dict, Tuple
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+
+CANCELLATION_CONFIG = get_settings().config.get("Cancellation", {})
+
+PERSIST_PARTIAL_MEMORY = CANCELLATION_CONFIG.get("Persist_Partial_Memory", True)
+MIN_PARTIAL_CHARS = CANCELLATION_CONFIG.get("Min_Partial_Chars", 40)
+
+
+class GenerationSizes:
+    """
+    Running size of completed generations of each kind, per unit of input
+    (1 for chat answers, characters of text for speech), used to estimate
+    what a cancelled generation would still have produced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Tuple[float, float]] = {}
+
+    def completed(self, kind: str, output: float, input_units: float = 1) -> None:
+        with self._lock:
+            total_output, total_input = self._totals.get(kind, (0.0, 0.0))
+            self._totals[kind] = (total_output + output, total_input + input_units)
+
+    def expected(self, kind: str, input_units: float = 1) -> float:
+        with self._lock:
+            total_output, total_input = self._totals.get(kind, (0.0, 0.0))
+        return total_output / total_input * input_units if total_input else 0.0
+
+
+generation_sizes = GenerationSizes()
+
+
+def record_cancelled(kind: str, unit: str, produced: float, input_units: float = 1) -> float:
+    """
+    Count a cancelled generation of `kind` that had produced `produced` units
+    so far; returns and records the estimate of the units it no longer has to
+    produce.
+    """
+    saved = max(0.0, generation_sizes.expected(kind, input_units) - produced)
+    metrics.incr(f"{kind}.cancelled")
+    metrics.incr(f"{kind}.cancelled.{unit}_produced", produced)
+    metrics.incr(f"{kind}.cancelled.{unit}_saved", saved)
+    return saved
+
+
+def should_persist_partial(content: str) -> bool:
+    return PERSIST_PARTIAL_MEMORY and len(content.strip()) >= MIN_PARTIAL_CHARS
@@ -0,0 +1,230 @@
+"""
+Token-budgeted memory window with a rolling summary of older turns
+"""
+import asyncio
+import json
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from app.utils.conversation_store import (
+    ConversationStore,
+    MEMORY_CONFIG,
+    Turn,
+    conversation_store,
+    turns_to_memory,
+)
+from app.utils.format_memory import format_message
+from app.utils.metrics import metrics
+
+logger = logging.getLogger("uvicorn")
+
+BUDGET_CONFIG = MEMORY_CONFIG.get("Budget", {})
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+# The summary goes into memoryChat as a user/assistant turn, like every other entry
+SUMMARY_QUESTION = "Tulizungumza nini awali?"
+SUMMARY_PREFIX = "Muhtasari wa mazungumzo ya awali:\n"
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token), good enough for budgeting"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def turn_tokens(turn: Turn) -> int:
+    return estimate_tokens(turn.user) + estimate_tokens(turn.assistant) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def payload_bytes(memory: List[Dict]) -> int:
+    return len(json.dumps(memory, ensure_ascii=False).encode("utf-8"))
+
+
+def _gist(text: str, max_chars: int) -> str:
+    """First sentence of `text`, clipped to `max_chars`"""
+    text = " ".join(text.split())
+    first = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(first) > max_chars:
+        first = first[:max_chars].rstrip() + "..."
+    return first
+
+
+@dataclass
+class RollingSummary:
+    """Summary lines, each with the id of the turn it covers, up to turn `upto_id`"""
+    upto_id: int
+    lines: List[Tuple[int, str]]
+
+    @property
+    def text(self) -> str:
+        return "\n".join(line for _, line in self.lines)
+
+    def dumps(self) -> str:
+        return json.dumps(self.lines, ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, upto_id: int, text: str) -> "RollingSummary":
+        try:
+            lines = [(int(turn_id), line) for turn_id, line in json.loads(text)]
+        except (ValueError, TypeError):
+            # Stored as plain text before lines kept their turn ids
+            lines = [(upto_id, line) for line in text.split("\n") if line]
+        return cls(upto_id, lines)
+
+
+class ContextBudgeter:
+    """
+    Keeps the most recent turns of a session that fit in `max_tokens` and folds
+    everything older into a compact extractive summary.
+
+    The summary is cached per session together with the id of the last turn it
+    covers, so each request only folds the few turns that have just slid out of
+    the window instead of rebuilding it from the whole history.
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        max_tokens: int = 1500,
+        summary_tokens: int = 300,
+        gist_chars: int = 160,
+        cache_size: int = 1024,
+        enabled: bool = True,
+    ):
+        self.store = store
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.gist_chars = gist_chars
+        self.cache_size = cache_size
+        self.enabled = enabled
+        self._summaries: "OrderedDict[str, RollingSummary]" = OrderedDict()
+
+    def select_window(self, turns: List[Turn]) -> Tuple[List[Turn], List[Turn]]:
+        """Split turns into (kept, dropped), keeping the newest ones that fit the budget"""
+        used = 0
+        cut = len(turns)
+        for index in range(len(turns) - 1, -1, -1):
+            cost = turn_tokens(turns[index])
+            if used + cost > self.max_tokens:
+                break
+            used += cost
+            cut = index
+        return turns[cut:], turns[:cut]
+
+    async def _load_summary(self, session_id: str) -> RollingSummary:
+        summary = self._summaries.get(session_id)
+        if summary is None:
+            row = await asyncio.to_thread(self.store.load_summary, session_id)
+            summary = RollingSummary.loads(*row) if row else RollingSummary(0, [])
+            self._summaries[session_id] = summary
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+        else:
+            self._summaries.move_to_end(session_id)
+        return summary
+
+    def _fold(self, summary: RollingSummary, turns: List[Turn]) -> RollingSummary:
+        lines = list(summary.lines)
+        for turn in turns:
+            lines.append((
+                turn.id,
+                f"Mtumiaji: {_gist(turn.user, self.gist_chars)} | "
+                f"Msaidizi: {_gist(turn.assistant, self.gist_chars)}"
+            ))
+        while lines and estimate_tokens("\n".join(line for _, line in lines)) > self.summary_tokens:
+            lines.pop(0)
+        return RollingSummary(max(turn.id for turn in turns), lines)
+
+    def _store_summary(self, session_id: str, summary: RollingSummary) -> None:
+        self._summaries[session_id] = summary
+        asyncio.get_running_loop().run_in_executor(
+            None, self.store.save_summary, session_id, summary.upto_id, summary.dumps()
+        )
+
+    async def _refresh_summary(self, session_id: str, kept: List[Turn], turns: List[Turn]) -> RollingSummary:
+        summary = await self._load_summary(session_id)
+
+        # Everything stored before the first kept turn belongs in the summary
+        if kept and kept[0].id is not None:
+            boundary = kept[0].id
+        else:
+            stored_ids = [turn.id for turn in turns if turn.id is not None]
+            if not stored_ids:
+                return summary
+            boundary = max(stored_ids) + 1
+
+        if boundary - 1 < summary.upto_id:
+            # The window grew back over folded turns; they are sent verbatim again
+            lines = [(turn_id, line) for turn_id, line in summary.lines if turn_id < boundary]
+            summary = RollingSummary(boundary - 1, lines)
+            self._store_summary(session_id, summary)
+            return summary
+        if boundary - 1 == summary.upto_id:
+            return summary
+
+        # Only the newest turns can survive the summary budget, so bound the read
+        fold_limit = max(1, self.summary_tokens * CHARS_PER_TOKEN // self.gist_chars + 1)
+        to_fold = await asyncio.to_thread(
+            self.store.turns_between, session_id, summary.upto_id, boundary, fold_limit
+        )
+        if not to_fold:
+            return summary
+
+        summary = self._fold(summary, to_fold)
+        self._store_summary(session_id, summary)
+        return summary
+
+    def _fit_relevant(self, relevant: List[Turn], kept: List[Turn]) -> List[Turn]:
+        """Relevant older turns that still fit in the budget left over by the kept window"""
+        remaining = self.max_tokens - sum(turn_tokens(turn) for turn in kept)
+        fitted = []
+        for turn in relevant:
+            cost = turn_tokens(turn)
+            if cost <= remaining:
+                fitted.append(turn)
+                remaining -= cost
+        return fitted
+
+    async def build(self, session_id: str, turns: List[Turn], relevant: Optional[List[Turn]] = None) -> List[Dict]:
+        """
+        Return the `memoryChat` entries for a session, within the token budget.
+
+        `turns` is the recent, contiguous tail of the conversation; `relevant` are
+        older turns picked by retrieval, placed between the summary and the tail.
+        """
+        relevant = relevant or []
+        full_memory = turns_to_memory(relevant + turns)
+        if not self.enabled:
+            return full_memory
+
+        kept, _ = self.select_window(turns)
+        summary = await self._refresh_summary(session_id, kept, turns)
+        relevant = self._fit_relevant(relevant, kept)
+
+        memory = []
+        if summary.lines:
+            memory.append(format_message("user", SUMMARY_QUESTION))
+            memory.append(format_message("assistant", SUMMARY_PREFIX + summary.text))
+        memory.extend(turns_to_memory(relevant + kept))
+
+        before, after = payload_bytes(full_memory), payload_bytes(memory)
+        metrics.observe("memory.payload_bytes.before", before)
+        metrics.observe("memory.payload_bytes.after", after)
+        logger.info(
+            f"memoryChat for session {session_id}: {len(turns)} -> {len(relevant) + len(kept)} turns, "
+            f"{before} -> {after} bytes"
+        )
+        return memory
+
+
+context_budgeter = ContextBudgeter(
+    conversation_store,
+    max_tokens=BUDGET_CONFIG.get("Max_Tokens", 1500),
+    summary_tokens=BUDGET_CONFIG.get("Summary_Tokens", 300),
+    gist_chars=BUDGET_CONFIG.get("Gist_Chars", 160),
+    cache_size=BUDGET_CONFIG.get("Summary_Cache_Size", 1024),
+    enabled=BUDGET_CONFIG.get("Enabled", True),
+)
@@ -0,0 +1,163 @@
+"""
+Per-session conversation history backed by SQLite in WAL mode
+"""
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.utils.format_memory import format_message
+from app.utils.settings import get_settings
+
+MEMORY_CONFIG = get_settings().config.get("Memory", {})
+DEFAULT_SESSION_ID = "default"
+
+
+@dataclass
+class Turn:
+    id: Optional[int]
+    session_id: str
+    user: str
+    assistant: str
+    created_at: float
+
+
+def turns_to_memory(turns: Iterable[Turn]) -> List[Dict]:
+    """Flatten turns into the user/assistant entries expected by `memoryChat`"""
+    memory = []
+    for turn in turns:
+        memory.append(format_message("user", turn.user))
+        memory.append(format_message("assistant", turn.assistant))
+    return memory
+
+
+class ConversationStore:
+    """
+    Stores one row per user/assistant turn, indexed by (session_id, id), so an
+    append is a single INSERT and a history read only touches the last N turns
+    of one session instead of the whole file.
+
+    Reads go through a connection of their own: in WAL mode they see the last
+    committed state without waiting for a write that is committing or syncing.
+    """
+
+    def __init__(self, path: str, synchronous: str = "NORMAL"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                user TEXT NOT NULL,
+                assistant TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_turns_session ON turns (session_id, id)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS summaries (
+                session_id TEXT PRIMARY KEY,
+                upto_id INTEGER NOT NULL,
+                text TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+        if path == ":memory:":
+            # Every connection to ":memory:" is a separate database
+            self._reader, self._read_lock = self._conn, self._lock
+        else:
+            self._reader = sqlite3.connect(path, check_same_thread=False)
+            self._read_lock = threading.Lock()
+
+    def append_turn(self, session_id: str, user: str, assistant: str) -> int:
+        """Append one turn to a session and return its row id"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (session_id, user, assistant, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, user, assistant, time.time()),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def append_turns(self, turns: Iterable[Tuple[str, str, str, float]]) -> None:
+        """Append a batch of (session_id, user, assistant, created_at) turns in one transaction"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO turns (session_id, user, assistant, created_at) VALUES (?, ?, ?, ?)",
+                list(turns),
+            )
+            self._conn.commit()
+
+    def recent_turns(self, session_id: str, limit: int) -> List[Turn]:
+        """Return the last `limit` turns of a session, oldest first"""
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT id, session_id, user, assistant, created_at FROM turns "
+                "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [Turn(*row) for row in reversed(rows)]
+
+    def turns_between(self, session_id: str, after_id: int, before_id: int, limit: int = -1) -> List[Turn]:
+        """Return the newest `limit` turns of a session with after_id < id < before_id, oldest first"""
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT id, session_id, user, assistant, created_at FROM turns "
+                "WHERE session_id = ? AND id > ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, after_id, before_id, limit),
+            ).fetchall()
+        return [Turn(*row) for row in reversed(rows)]
+
+    def load_summary(self, session_id: str) -> Optional[Tuple[int, str]]:
+        """Return (upto_id, text) of the rolling summary of a session, if any"""
+        with self._read_lock:
+            return self._reader.execute(
+                "SELECT upto_id, text FROM summaries WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+
+    def save_summary(self, session_id: str, upto_id: int, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO summaries (session_id, upto_id, text) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET upto_id = excluded.upto_id, text = excluded.text",
+                (session_id, upto_id, text),
+            )
+            self._conn.commit()
+
+    def recent_memory(self, session_id: str, limit: int) -> List[Dict]:
+        """Return the last `limit` turns of a session in the Pawa `memoryChat` format"""
+        return turns_to_memory(self.recent_turns(session_id, limit))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+        if self._reader is not self._conn:
+            with self._read_lock:
+                self._reader.close()
+
+
+HISTORY_TURNS = MEMORY_CONFIG.get("History_Turns", 10)
+# Fsync policy, mapped onto SQLite's synchronous pragma:
+# "full" fsyncs every flushed batch, "normal" only at WAL checkpoints, "off" leaves it to the OS
+FSYNC_POLICIES = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}
+
+conversation_store = ConversationStore(
+    MEMORY_CONFIG.get("Path", "app/engine/memory.db"),
+    synchronous=FSYNC_POLICIES[MEMORY_CONFIG.get("Fsync", "normal").lower()],
+)
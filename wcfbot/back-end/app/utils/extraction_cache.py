@@ -0,0 +1,153 @@
+"""
+Content-addressed cache of document extraction results
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+
+CACHE_CONFIG = get_settings().config["Extraction"].get("Cache", {})
+
+
+def extraction_key(content_sha256: str, content_type: Optional[str]) -> str:
+    """SHA-256 of the file's SHA-256 hex digest plus its content type"""
+    digest = hashlib.sha256(content_sha256.encode("ascii"))
+    digest.update(b"\0" + (content_type or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Two-tier cache of extracted documents keyed by `extraction_key`.
+
+    The memory tier is a small LRU. The disk tier keeps one JSON file per key,
+    expires entries after `ttl` seconds and evicts the least recently used ones
+    once the directory grows past `disk_max_bytes`. Disk access always runs in a
+    worker thread.
+    """
+
+    def __init__(self, directory: str, memory_entries: int = 256, disk_max_bytes: int = 512 * 1024 * 1024, ttl: float = 7 * 24 * 3600):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._disk_lock = threading.Lock()
+        # key -> (size, last access); loaded lazily from the directory
+        self._disk_index: Optional[Dict[str, Tuple[int, float]]] = None
+        self._disk_bytes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _load_disk_index(self) -> None:
+        if self._disk_index is not None:
+            return
+        self._disk_index = {}
+        self._disk_bytes = 0
+        if not os.path.isdir(self.directory):
+            return
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                self._disk_index[name[:-5]] = (stat.st_size, stat.st_mtime)
+                self._disk_bytes += stat.st_size
+
+    def _remove_disk(self, key: str) -> None:
+        size, _ = self._disk_index.pop(key, (0, 0))
+        self._disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _get_disk(self, key: str) -> Optional[Dict]:
+        with self._disk_lock:
+            self._load_disk_index()
+            if key not in self._disk_index:
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove_disk(key)
+                return None
+            if time.time() - entry["stored_at"] > self.ttl:
+                self._remove_disk(key)
+                return None
+            size, _ = self._disk_index[key]
+            self._disk_index[key] = (size, time.time())
+            return entry
+
+    def _put_disk(self, key: str, entry: Dict) -> None:
+        path = self._path(key)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        with self._disk_lock:
+            self._load_disk_index()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            if key in self._disk_index:
+                self._disk_bytes -= self._disk_index[key][0]
+            self._disk_index[key] = (len(data), time.time())
+            self._disk_bytes += len(data)
+
+            if self._disk_bytes > self.disk_max_bytes:
+                for old_key, _ in sorted(self._disk_index.items(), key=lambda item: item[1][1]):
+                    if self._disk_bytes <= self.disk_max_bytes or old_key == key:
+                        break
+                    self._remove_disk(old_key)
+
+    def _remember(self, key: str, entry: Dict) -> None:
+        self._memory[key] = (entry["stored_at"], entry["doc"])
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str, size: int = 0) -> Optional[Dict]:
+        """Cached extraction for `key`, or None. `size` is the upload size a hit saves"""
+        cached = self._memory.get(key)
+        if cached is not None and time.time() - cached[0] <= self.ttl:
+            self._memory.move_to_end(key)
+            doc = cached[1]
+        else:
+            if cached is not None:
+                del self._memory[key]
+            entry = await asyncio.to_thread(self._get_disk, key)
+            if entry is None:
+                metrics.incr("extraction.cache.misses")
+                return None
+            self._remember(key, entry)
+            doc = entry["doc"]
+
+        metrics.incr("extraction.cache.hits")
+        metrics.incr("extraction.cache.bytes_saved", size)
+        return dict(doc)
+
+    async def put(self, key: str, doc: Dict) -> None:
+        entry = {"stored_at": time.time(), "doc": doc}
+        self._remember(key, entry)
+        try:
+            await asyncio.to_thread(self._put_disk, key, entry)
+        except OSError as e:
+            print(f"Error writing extraction cache entry {key}: {e}")
+
+
+EXTRACTION_CACHE_ENABLED = CACHE_CONFIG.get("Enabled", True)
+
+extraction_cache = ExtractionCache(
+    CACHE_CONFIG.get("Directory", "app/engine/extraction_cache"),
+    memory_entries=CACHE_CONFIG.get("Memory_Entries", 256),
+    disk_max_bytes=int(CACHE_CONFIG.get("Disk_Max_MB", 512) * 1024 * 1024),
+    ttl=CACHE_CONFIG.get("TTL_Seconds", 7 * 24 * 3600),
+)
@@ -1,121 +1,167 @@
+import asyncio
+import time
 import httpx
-from fastapi import UploadFile, HTTPException, status
-from typing import List, Optional
-import yaml
-import os
-from dotenv import load_dotenv
-load_dotenv(override=True)
+from fastapi import HTTPException, status
+from typing import IO, List, Optional, Union
+from app.utils.http_client import upstream
+from app.utils.settings import get_settings
+from app.utils.extraction_cache import extraction_cache, extraction_key, EXTRACTION_CACHE_ENABLED
+from app.utils.metrics import metrics
+from app.utils.progress import Progress, report
+from app.utils.uploads import SpooledUpload
 
-with open("app/engine/config.yaml", "r") as file:
-    config = yaml.safe_load(file)
+EXTRACTION_CONFIG = get_settings().config["Extraction"]
+MAX_CONCURRENCY = EXTRACTION_CONFIG.get("Max_Concurrency", 4)
+PER_FILE_TIMEOUT = EXTRACTION_CONFIG.get("Per_File_Timeout", 120)
 
-BASE_UL = config["Extraction"]["Base_URL"]
-ENDPOINT = config["Extraction"]["Endpoint"]
-EXTRACTION_URL = f"{BASE_UL}{ENDPOINT}"
+_extraction_slots = asyncio.Semaphore(MAX_CONCURRENCY)
 
-async def send_files_to_extraction_server(files: List[UploadFile]) -> Optional[dict]:
-    """
-    Send files to extraction server and return extracted content
-    
-    Args:
-        files: List of uploaded files
-        
-    Returns:
-        dict: Extraction response or None if no files
-    """
-    if not files:
-        return None
-    
-    multipart_files = []
-    
-    try:
-        for file in files:
-            # Validate file before processing
-            if not file.filename:
-                continue
-                
-            # Check file size
-            content = await file.read()
-            if len(content) == 0:
-                print(f"Warning: File {file.filename} is empty")
-                continue
-                
-            print(f"Processing file: {file.filename}, size: {len(content)} bytes, type: {file.content_type}")
-            
-            multipart_files.append(
-                ("files", (file.filename, content, file.content_type))
-            )
-            
-            # Reset file pointer for potential re-reading
-            await file.seek(0)
-            
-    except Exception as e:
-        print(f"Error processing files: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to process uploaded files: {str(e)}"
-        )
 
-    if not multipart_files:
-        print("No valid files to process")
-        return None
+class ExtractionError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
 
+
+async def _post_file(filename: str, content: Union[bytes, IO[bytes]], content_type: Optional[str]) -> dict:
+    """
+    Send a single file to the extraction server and return its extracted document.
+    `content` may be a file object, which httpx streams instead of loading it.
+    """
+    settings = get_settings()
     try:
-        print(f"Sending {len(multipart_files)} files to extraction server: {EXTRACTION_URL}")
-        
-        async with httpx.AsyncClient(timeout=300) as client:
-            response = await client.post(
-                EXTRACTION_URL,
-                files=multipart_files,
-                headers={
-                    "accept": "application/json",
-                    # Add API key if required
-                    **({"Authorization": f"Bearer {os.getenv('EXTRACTION_API_KEY')}"} 
-                       if os.getenv('EXTRACTION_API_KEY') else {})
-                }
-            )
-            
-        print(f"Extraction server response status: {response.status_code}")
-        
-    except httpx.RequestError as e:
-        print(f"Request error to extraction server: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"Failed to connect to the extraction server: {str(e)}"
+        response = await upstream.post(
+            settings.extraction_url,
+            files=[("files", (filename, content, content_type))],
+            headers={
+                "accept": "application/json",
+                # Add API key if required
+                **({"Authorization": f"Bearer {settings.extraction_api_key}"} 
+                   if settings.extraction_api_key else {})
+            }
         )
     except httpx.TimeoutException:
-        print("Extraction request timed out")
-        raise HTTPException(
-            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-            detail="Extraction server request timed out"
-        )
+        raise ExtractionError(status.HTTP_504_GATEWAY_TIMEOUT, "Extraction server request timed out")
+    except httpx.RequestError as e:
+        raise ExtractionError(status.HTTP_502_BAD_GATEWAY, f"Failed to connect to the extraction server: {str(e)}")
 
     try:
         response_json = response.json()
-        print(f"Extraction response: {response_json}")
-        
-    except ValueError as e:
-        print(f"JSON decode error: {e}")
-        print(f"Raw response: {response.text}")
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Invalid JSON returned from the extraction server."
-        )
+    except ValueError:
+        print(f"Raw extraction response for {filename}: {response.text}")
+        raise ExtractionError(status.HTTP_502_BAD_GATEWAY, "Invalid JSON returned from the extraction server.")
 
     if response.status_code != 200:
-        error_detail = response_json.get("detail", "An error occurred during file extraction.")
-        print(f"Extraction server error: {error_detail}")
-        raise HTTPException(
-            status_code=response.status_code,
-            detail=error_detail
+        raise ExtractionError(
+            response.status_code,
+            response_json.get("detail", "An error occurred during file extraction.")
         )
 
-    # Validate response structure
-    if not response_json.get("data"):
-        print("Warning: No data in extraction response")
+    documents = response_json.get("data") or []
+    if not documents:
+        raise ExtractionError(status.HTTP_502_BAD_GATEWAY, "No data in extraction response")
+    return documents[0]
+
+
+async def _extract_file(file: SpooledUpload, progress: Optional[Progress] = None) -> Optional[dict]:
+    """
+    Extract one upload, from the cache when possible. Returns None for files that
+    are skipped, otherwise a result with either `doc` or `error`, plus timing.
+    """
+    if not file.filename:
         return None
+
+    if file.size == 0:
+        print(f"Warning: File {file.filename} is empty")
+        return None
+
+    started = time.perf_counter()
+    print(f"Processing file: {file.filename}, size: {file.size} bytes, type: {file.content_type}")
+    report(progress, "extracting_file", file=file.filename)
+    result = {"filename": file.filename, "size": file.size, "cached": False}
+
+    key = extraction_key(file.sha256, file.content_type)
+    cached = await extraction_cache.get(key, file.size) if EXTRACTION_CACHE_ENABLED else None
+    if cached is not None:
+        cached["filename"] = file.filename
+        result.update(doc=cached, cached=True)
+    else:
+        try:
+            async with _extraction_slots:
+                doc = await asyncio.wait_for(
+                    _post_file(file.filename, file.body(), file.content_type),
+                    timeout=PER_FILE_TIMEOUT
+                )
+            doc.setdefault("filename", file.filename)
+            result["doc"] = doc
+            if EXTRACTION_CACHE_ENABLED and doc.get("content", "").strip():
+                await extraction_cache.put(key, doc)
+        except asyncio.TimeoutError:
+            result.update(error="Extraction timed out", status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+        except ExtractionError as e:
+            result.update(error=e.detail, status_code=e.status_code)
+
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    metrics.observe("extraction.file_ms", result["elapsed_ms"])
+    if "error" in result:
+        metrics.incr("extraction.file_errors")
+        print(f"Extraction failed for {file.filename}: {result['error']}")
+        report(progress, "extraction_failed", file=file.filename, detail=result["error"])
+    else:
+        print(f"Extracted {file.filename} in {result['elapsed_ms']} ms (cached: {result['cached']})")
+        report(progress, "extracted_file", file=file.filename, cached=result["cached"], elapsed_ms=result["elapsed_ms"])
+    return result
+
+
+async def send_files_to_extraction_server(files: List[SpooledUpload], progress: Optional[Progress] = None) -> Optional[dict]:
+    """
+    Send files to extraction server and return extracted content.
+    Each file is extracted by its own request, at most Extraction.Max_Concurrency
+    at a time and each within Extraction.Per_File_Timeout seconds. Files whose
+    bytes were extracted before are served from the extraction cache.
+    
+    Args:
+        files: List of spooled uploads
+        progress: Optional callback told when each file starts and finishes
         
-    return response_json
+    Returns:
+        dict: `data` with the documents that were extracted, in upload order,
+        `errors` for the files that failed and per-file `timings`, or None if
+        there was nothing to extract
+    """
+    if not files:
+        return None
+
+    results = [
+        result for result in await asyncio.gather(*(_extract_file(file, progress) for file in files))
+        if result is not None
+    ]
+    if not results:
+        print("No valid files to process")
+        return None
+
+    documents = [result["doc"] for result in results if "doc" in result]
+    errors = [
+        {"filename": result["filename"], "detail": result["error"]}
+        for result in results if "error" in result
+    ]
+    if not documents:
+        failed = next(result for result in results if "error" in result)
+        raise HTTPException(status_code=failed["status_code"], detail=failed["error"])
+
+    return {
+        "data": documents,
+        "errors": errors,
+        "timings": [
+            {
+                "filename": result["filename"],
+                "elapsed_ms": result.get("elapsed_ms"),
+                "cached": result.get("cached", False),
+            }
+            for result in results
+        ],
+    }
 
 async def validate_extracted_content(extraction_result: dict) -> bool:
     """
@@ -1,60 +1,67 @@
+import asyncio
 from app.api.models.user_request import UserRequest
-import os
 from typing import List, Optional
-from fastapi import UploadFile
+from app.utils.uploads import SpooledUpload
 from app.utils.files_extraction import send_files_to_extraction_server
-import yaml
+from app.utils.conversation_store import HISTORY_TURNS
+from app.utils.memory_writer import memory_writer
+from app.utils.context_budget import context_budgeter
+from app.utils.memory_retrieval import memory_retriever, RETRIEVAL_ENABLED, RECENT_TURNS
+from app.utils.progress import Progress, report
+from app.utils.settings import get_settings, thaw
 from dotenv import load_dotenv
 load_dotenv(override=True)
-    
-MEMORY_PATH = "app/engine/memory.json"
-CONFIG = "app/engine/config.yaml"
+
 
 def load_tools_from_config():
-    """Load tools configuration from config.yaml"""
+    """Tools exposed to the model, prebuilt from config.yaml when settings are loaded"""
+    return thaw(get_settings().chat.tools)
+
+async def _none() -> None:
+    return None
+
+async def load_memory(text: UserRequest, progress: Optional[Progress] = None) -> list:
+    """Recent and relevant turns of the session, within the context budget"""
+    report(progress, "loading_memory")
     try:
-        with open(CONFIG, "r") as file:
-            config = yaml.safe_load(file)
-            tools = config.get("Tools", [])
-            built_in_tools = config.get("BUILT_IN_TOOLS", [])
-            
-            # Convert built-in tools to proper format
-            formatted_tools = []
-            for tool in tools:
-                formatted_tools.append(tool)
-            
-            # Add built-in pawa tools
-            for built_in_tool in built_in_tools:
-                formatted_tools.append({
-                    "type": "pawa_tool",
-                    "pawa_tool": built_in_tool["name"]
-                })
-            
-            return formatted_tools
+        if RETRIEVAL_ENABLED:
+            turns = await memory_writer.recent_turns(text.session_id, RECENT_TURNS)
+            relevant = await memory_retriever.search(text.session_id, text.message, exclude_last=len(turns))
+        else:
+            turns = await memory_writer.recent_turns(text.session_id, HISTORY_TURNS)
+            relevant = []
+        memory_data = await context_budgeter.build(text.session_id, turns, relevant)
     except Exception as e:
-        print(f"Error loading tools from config: {e}")
-        return []
+        print(f"Error loading memory: {e}")
+        memory_data = []
+    report(progress, "memory_loaded", turns=len(memory_data))
+    return memory_data
 
 async def msg_to_pawa_chat(
     text: UserRequest,
-    files: Optional[List[UploadFile]] = None,
-    is_streaming: bool = False
+    files: Optional[List[SpooledUpload]] = None,
+    is_streaming: bool = False,
+    progress: Optional[Progress] = None
 ) -> dict:
     """
     Converts a UserRequest message to the format required by the Pawa AI chat API.
     
     Args:
         text (UserRequest): The user request containing the message.
-        files (Optional[List[UploadFile]]): Optional list of files to extract content from.
+        files (Optional[List[SpooledUpload]]): Optional list of files to extract content from.
         is_streaming (bool): Whether the request is for streaming or not.
+        progress (Optional[Progress]): Optional callback told about each assembly step.
         
     Returns:
         dict: The formatted message ready for the Pawa AI chat API.
     """
-    
-    extraction_result_ = None
-    if files:
-        extraction_result_ = await send_files_to_extraction_server(files)
+    settings = get_settings()
+
+    # Extraction and memory are independent of each other, so they run side by side
+    extraction_result_, memory_data = await asyncio.gather(
+        send_files_to_extraction_server(files, progress) if files else _none(),
+        load_memory(text, progress) if settings.chat.memory_enabled else _none(),
+    )
     
     user_message = text.message
     if extraction_result_ is not None:
@@ -76,70 +83,24 @@ async def msg_to_pawa_chat(
                 )
                 user_message = prepended_info + user_message
     
-    # Load memory if enabled
-    memory_data = []
-    if os.getenv("IS_MEMORY_ENABLED", "False").lower() == "true":
-        if os.path.exists(MEMORY_PATH):
-            try:
-                with open(MEMORY_PATH, "r", encoding="utf-8") as file:
-                    memory_data = yaml.safe_load(file) or []
-            except Exception as e:
-                print(f"Error loading memory: {e}")
-                memory_data = []
-    
-    # Load tools from config
-    tools = load_tools_from_config()
-    
-    # Base message structure
-    message_structure = {
-        "model": os.getenv("CHAT_MODEL"),
-        "messages": [
-            {
-                "role": "system",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": os.getenv(
-                            "PAWA_SYSTEM_PROMPT",
-                           
-                        ).replace("\\n", "\n")
-                    }
-                ]
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": user_message
-                    }
-                ]
-            }
-        ],
-        "stream": is_streaming,
-        "temperature": float(os.getenv("TEMPERATURE", 0.1)),
-        "top_p": float(os.getenv("TOP_P", 0.95)),
-        "tool_choice": os.getenv("TOOL_CHOICE", "auto"),
-        "max_tokens": int(os.getenv("MAX_TOKENS", 4096)),
-        "frequency_penalty": float(os.getenv("FREQUENCY_PENALTY", 0.3)),
-        "presence_penalty": float(os.getenv("PRESENCE_PENALTY", 0.3)),
-        "seed": int(os.getenv("SEED", 2024))
-    }
-    
-    # Add tools if available
-    if tools:
-        message_structure["tools"] = tools
-    
-    # Add knowledge base if configured
-    if os.getenv("KB_REFERENCE_ID") is not None:
-        message_structure["knowledgeBase"] = {
-            "kbReferenceId": os.getenv("KB_REFERENCE_ID"),
-            **({"isMust": os.getenv("IS_MUST_USE_KB").lower() == "true"} 
-               if os.getenv("IS_MUST_USE_KB") is not None else {})
+    # A mutable copy of the frozen request template, plus the per-request parts
+    message_structure = thaw(settings.chat.template)
+    message_structure["messages"] = [
+        thaw(settings.chat.system_message),
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": user_message
+                }
+            ]
         }
+    ]
+    message_structure["stream"] = is_streaming
     
     # Add memory chat if enabled and available
-    if memory_data and os.getenv("IS_MEMORY_ENABLED", "False").lower() == "true":
+    if memory_data:
         message_structure["memoryChat"] = memory_data
     
     return message_structure
@@ -0,0 +1,94 @@
+"""
+Shared, pooled HTTP clients for the Pawa AI upstream services
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional
+from urllib.parse import urlsplit
+import httpx
+from app.utils.settings import get_settings
+
+HTTP_CONFIG = get_settings().config.get("HTTP_Client", {})
+
+
+class UpstreamClients:
+    """
+    Keeps one keep-alive connection pool per upstream host (scheme + host + port)
+    so chat, extraction, TTS and STT calls reuse established TCP/TLS connections
+    instead of handshaking on every request.
+    """
+
+    def __init__(self, settings: dict):
+        pool = settings.get("Pool", {})
+        timeouts = settings.get("Timeouts", {})
+
+        self.http2 = bool(settings.get("HTTP2", False))
+        self.limits = httpx.Limits(
+            max_connections=pool.get("Max_Connections", 100),
+            max_keepalive_connections=pool.get("Max_Keepalive_Connections", 20),
+            keepalive_expiry=pool.get("Keepalive_Expiry", 30),
+        )
+        self.timeout = httpx.Timeout(
+            connect=timeouts.get("Connect", 10),
+            read=timeouts.get("Read", 300),
+            write=timeouts.get("Write", 60),
+            pool=timeouts.get("Pool", 10),
+        )
+        self.first_byte_timeout = timeouts.get("First_Byte", 60)
+        self.audio_timeout = httpx.Timeout(timeouts.get("Audio", 60))
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        """Return the pooled client for the host of `url`, creating it on first use"""
+        origin = self._origin(url)
+        client = self._clients.get(origin)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+            self._clients[origin] = client
+        return client
+
+    def start(self, urls: Iterable[Optional[str]]) -> None:
+        """Create the pools for the known upstream hosts up front"""
+        for url in urls:
+            if url:
+                self.get(url)
+
+    async def aclose(self) -> None:
+        """Close every pool, releasing all kept-alive connections"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.get(url).post(url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Like `httpx.AsyncClient.stream`, but gives up if the upstream has not sent
+        its response headers within the configured first-byte timeout.
+        """
+        client = self.get(url)
+        request = client.build_request(method, url, **kwargs)
+        try:
+            async with asyncio.timeout(self.first_byte_timeout):
+                response = await client.send(request, stream=True)
+        except TimeoutError:
+            raise httpx.ReadTimeout("Upstream did not respond before the first-byte timeout", request=request)
+
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+
+upstream = UpstreamClients(HTTP_CONFIG)
@@ -0,0 +1,194 @@
+"""
+Relevance-based retrieval of past turns from a conversation's history
+"""
+import asyncio
+import re
+import zlib
+from collections import OrderedDict
+from typing import Dict, List
+import numpy as np
+from app.utils.conversation_store import (
+    ConversationStore,
+    MEMORY_CONFIG,
+    Turn,
+    conversation_store,
+)
+from app.utils.memory_writer import MemoryWriter, memory_writer
+
+RETRIEVAL_CONFIG = MEMORY_CONFIG.get("Retrieval", {})
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class HashedNgramVectorizer:
+    """
+    Maps text to an L2-normalised hashed bag of word unigrams, word bigrams and
+    character trigrams. Character trigrams keep Swahili inflections of the same
+    stem (e.g. "fidia", "kufidiwa") close to each other.
+    """
+
+    def __init__(self, dim: int = 2048):
+        self.dim = dim
+
+    def features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        features = list(words)
+        features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.features(text):
+            vector[zlib.crc32(feature.encode("utf-8")) % self.dim] += 1.0
+        np.log1p(vector, out=vector)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class SessionIndex:
+    """
+    Growable matrix of turn vectors for one session, in chronological order.
+
+    The matrix is stored column-major: a query only has a few dozen non-zero
+    features, so scoring reads just those columns, each of them contiguous,
+    and stays sub-millisecond even for very long histories.
+    """
+
+    def __init__(self, dim: int, max_turns: int):
+        self.max_turns = max_turns
+        self.turns: List[Turn] = []
+        self.matrix = np.zeros((16, dim), dtype=np.float32, order="F")
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def add(self, turn: Turn, vector: np.ndarray) -> None:
+        if len(self.turns) >= self.max_turns:
+            # Drop the oldest half in one go rather than shifting on every append
+            keep = self.max_turns // 2
+            count = len(self.turns)
+            self.matrix[:keep] = self.matrix[count - keep:count]
+            self.turns = self.turns[count - keep:]
+        if len(self.turns) == len(self.matrix):
+            grown = np.zeros((len(self.matrix) * 2, self.matrix.shape[1]), dtype=np.float32, order="F")
+            grown[:len(self.matrix)] = self.matrix
+            self.matrix = grown
+        self.matrix[len(self.turns)] = vector
+        self.turns.append(turn)
+
+    def search(self, query: np.ndarray, top_k: int, exclude_last: int, min_score: float) -> List[Turn]:
+        """Top-k turns by cosine similarity, skipping the newest `exclude_last`, oldest first"""
+        candidates = len(self.turns) - exclude_last
+        if candidates <= 0 or top_k <= 0:
+            return []
+        features = np.flatnonzero(query)
+        scores = self.matrix[:candidates, features] @ query[features]
+        k = min(top_k, candidates)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = [int(i) for i in best if scores[i] >= min_score]
+        return [self.turns[i] for i in sorted(best)]
+
+
+class MemoryRetriever:
+    """
+    Keeps a hashed n-gram index per active session, built from the store on first
+    use and updated incrementally as new turns are enqueued, and returns the past
+    turns most relevant to the incoming message.
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        writer: MemoryWriter,
+        dim: int = 2048,
+        top_k: int = 3,
+        min_score: float = 0.2,
+        max_turns: int = 5000,
+        max_sessions: int = 256,
+    ):
+        self.store = store
+        self.writer = writer
+        self.vectorizer = HashedNgramVectorizer(dim)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._indexes: "OrderedDict[str, SessionIndex]" = OrderedDict()
+        # Sessions whose index is being built, and the turns enqueued meanwhile
+        self._building: Dict[str, "asyncio.Task[SessionIndex]"] = {}
+        self._arrived: Dict[str, List[Turn]] = {}
+
+    @staticmethod
+    def _turn_text(turn: Turn) -> str:
+        return f"{turn.user}\n{turn.assistant}"
+
+    def on_turn(self, turn: Turn) -> None:
+        """Writer listener: index a freshly enqueued turn if its session is loaded or loading"""
+        index = self._indexes.get(turn.session_id)
+        if index is not None:
+            index.add(turn, self.vectorizer.transform(self._turn_text(turn)))
+        elif turn.session_id in self._arrived:
+            self._arrived[turn.session_id].append(turn)
+
+    def _build(self, session_id: str, pending: List[Turn]) -> SessionIndex:
+        index = SessionIndex(self.vectorizer.dim, self.max_turns)
+        # Turns enqueued but not flushed yet are not in the store
+        stored = self.store.recent_turns(session_id, self.max_turns)
+        for turn in self.writer.merge_pending(stored, pending):
+            index.add(turn, self.vectorizer.transform(self._turn_text(turn)))
+        return index
+
+    async def _index(self, session_id: str) -> SessionIndex:
+        index = self._indexes.get(session_id)
+        if index is not None:
+            self._indexes.move_to_end(session_id)
+            return index
+
+        building = self._building.get(session_id)
+        if building is None:
+            building = asyncio.create_task(self._load(session_id))
+            self._building[session_id] = building
+            building.add_done_callback(lambda _: self._building.pop(session_id, None))
+        return await asyncio.shield(building)
+
+    async def _load(self, session_id: str) -> SessionIndex:
+        # Collect turns enqueued while the store is read, before taking the pending ones
+        arrived = self._arrived[session_id] = []
+        try:
+            pending = self.writer.pending_turns(session_id)
+            index = await asyncio.to_thread(self._build, session_id, pending)
+        finally:
+            del self._arrived[session_id]
+        # A turn may also have been flushed and read with the stored ones
+        for turn in self.writer.merge_pending(index.turns, arrived)[len(index.turns):]:
+            index.add(turn, self.vectorizer.transform(self._turn_text(turn)))
+        self._indexes[session_id] = index
+        while len(self._indexes) > self.max_sessions:
+            self._indexes.popitem(last=False)
+        return index
+
+    async def search(self, session_id: str, message: str, exclude_last: int) -> List[Turn]:
+        """Past turns most relevant to `message`, excluding the newest `exclude_last` turns"""
+        index = await self._index(session_id)
+        query = self.vectorizer.transform(message)
+        return index.search(query, self.top_k, exclude_last, self.min_score)
+
+
+RETRIEVAL_ENABLED = RETRIEVAL_CONFIG.get("Enabled", True)
+RECENT_TURNS = RETRIEVAL_CONFIG.get("Recent_Turns", 4)
+
+memory_retriever = MemoryRetriever(
+    conversation_store,
+    memory_writer,
+    dim=RETRIEVAL_CONFIG.get("Dimensions", 2048),
+    top_k=RETRIEVAL_CONFIG.get("Top_K", 3),
+    min_score=RETRIEVAL_CONFIG.get("Min_Score", 0.2),
+    max_turns=RETRIEVAL_CONFIG.get("Max_Turns_Per_Session", 5000),
+    max_sessions=RETRIEVAL_CONFIG.get("Max_Sessions", 256),
+)
+memory_writer.add_listener(memory_retriever.on_turn)
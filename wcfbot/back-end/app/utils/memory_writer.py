@@ -0,0 +1,138 @@
+"""
+Write-behind persistence of conversation turns, kept off the event loop
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from app.utils.conversation_store import (
+    ConversationStore,
+    MEMORY_CONFIG,
+    Turn,
+    conversation_store,
+    turns_to_memory,
+)
+
+logger = logging.getLogger("uvicorn")
+
+WRITER_CONFIG = MEMORY_CONFIG.get("Write_Behind", {})
+
+
+class MemoryWriter:
+    """
+    Buffers finished turns in memory and flushes them to the conversation store
+    in batches from a background task. The actual SQLite write runs in a worker
+    thread, so a chat response never waits on disk.
+
+    Turns that are buffered but not yet flushed are still visible through
+    `recent_turns`, so a follow-up message in the same session sees them. A
+    turn is stored with the timestamp it was enqueued at, which tells a
+    buffered turn apart from the same turn once its batch is committed.
+    """
+
+    def __init__(self, store: ConversationStore, flush_interval: float = 0.5, batch_size: int = 100):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer: Deque[Tuple[str, str, str, float]] = deque()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[Turn], None]] = []
+
+    def add_listener(self, listener: Callable[[Turn], None]) -> None:
+        """Register a callback invoked with every enqueued turn"""
+        self._listeners.append(listener)
+
+    def enqueue(self, session_id: str, user: str, assistant: str) -> None:
+        """Queue a finished turn for persistence; never blocks"""
+        created_at = time.time()
+        self._buffer.append((session_id, user, assistant, created_at))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+        turn = Turn(None, session_id, user, assistant, created_at)
+        for listener in self._listeners:
+            try:
+                listener(turn)
+            except Exception as e:
+                logger.error(f"Memory listener failed: {e}")
+
+    def pending_turns(self, session_id: str) -> List[Turn]:
+        return [
+            Turn(None, sid, user, assistant, created_at)
+            for sid, user, assistant, created_at in list(self._buffer)
+            if sid == session_id
+        ]
+
+    @staticmethod
+    def merge_pending(stored: List[Turn], pending: List[Turn]) -> List[Turn]:
+        """
+        Stored turns followed by the pending ones that are not among them. Take
+        `pending` before reading `stored`, so a batch committed in between is
+        seen exactly once.
+        """
+        committed = {(turn.created_at, turn.user) for turn in stored}
+        return stored + [turn for turn in pending if (turn.created_at, turn.user) not in committed]
+
+    async def recent_turns(self, session_id: str, limit: int) -> List[Turn]:
+        """Last `limit` turns of a session, including those not yet flushed"""
+        if limit <= 0:
+            return []
+        pending = self.pending_turns(session_id)
+        stored = await asyncio.to_thread(self.store.recent_turns, session_id, limit)
+        return self.merge_pending(stored, pending)[-limit:]
+
+    async def recent_memory(self, session_id: str, limit: int) -> List[Dict]:
+        return turns_to_memory(await self.recent_turns(session_id, limit))
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still buffered and stop the background task"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while self._buffer:
+                if not await self._flush_batch():
+                    break
+
+            if self._closing:
+                if self._buffer:
+                    logger.error(f"Dropping {len(self._buffer)} unsaved memory turns on shutdown")
+                return
+
+    async def _flush_batch(self) -> bool:
+        batch = list(self._buffer)[:self.batch_size]
+        try:
+            await asyncio.to_thread(self.store.append_turns, batch)
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} memory turns: {e}")
+            return False
+
+        for _ in batch:
+            self._buffer.popleft()
+        return True
+
+
+memory_writer = MemoryWriter(
+    conversation_store,
+    flush_interval=WRITER_CONFIG.get("Flush_Interval", 0.5),
+    batch_size=WRITER_CONFIG.get("Batch_Size", 100),
+)
@@ -0,0 +1,52 @@
+"""
+In-process counters and timing observations for the chat and audio pipelines
+"""
+import threading
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """Thread-safe counters plus count/sum/min/max/last summaries of observed values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._observations: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            stats = self._observations.get(name)
+            if stats is None:
+                self._observations[name] = {
+                    "count": 1,
+                    "sum": value,
+                    "min": value,
+                    "max": value,
+                    "last": value,
+                }
+                return
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+            stats["last"] = value
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            observations = {
+                name: {**stats, "avg": stats["sum"] / stats["count"]}
+                for name, stats in self._observations.items()
+            }
+            return {"counters": dict(self._counters), "observations": observations}
+
+
+metrics = Metrics()
@@ -0,0 +1,170 @@
+"""
+NDJSON streams: a fast JSON codec, an incremental decoder for upstream byte
+streams and a coalescing stage that merges small text deltas into fewer frames
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterable, AsyncIterator, List, Optional, Union
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+
+STREAM_CONFIG = get_settings().config.get("Streaming", {})
+
+COALESCE_ENABLED = STREAM_CONFIG.get("Coalesce", True)
+COALESCE_WINDOW_MS = STREAM_CONFIG.get("Coalesce_Window_MS", 25)
+COALESCE_MAX_BYTES = STREAM_CONFIG.get("Coalesce_Max_Bytes", 512)
+
+try:
+    # Optional: several times faster than the standard library on small documents
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+    def dumps_line(obj: Any) -> str:
+        """`obj` as one NDJSON line, non-ASCII characters kept as they are"""
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE).decode("utf-8")
+else:
+    JSONDecodeError = json.JSONDecodeError
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def dumps_line(obj: Any) -> str:
+        """`obj` as one NDJSON line, non-ASCII characters kept as they are"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class NDJSONDecoder:
+    """
+    Incremental NDJSON decoder: feed it network chunks of any size and it
+    returns the complete objects in them, keeping a partial trailing line until
+    the rest arrives. Malformed lines are counted and skipped; only the first
+    one of a stream is logged.
+    """
+
+    def __init__(self, name: str = "upstream"):
+        self.name = name
+        self.malformed = 0
+        self._partial = b""
+
+    def _decode(self, line: bytes, objects: List[Any]) -> None:
+        line = line.strip()
+        if not line:
+            return
+        try:
+            objects.append(loads(line))
+        except (JSONDecodeError, ValueError) as e:
+            self.malformed += 1
+            metrics.incr(f"ndjson.{self.name}.malformed")
+            if self.malformed == 1:
+                print(f"Skipping malformed NDJSON from {self.name}: {e}, line: {line[:200]!r}")
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        objects: List[Any] = []
+        if not chunk:
+            return objects
+        data = self._partial + chunk
+        end = data.rfind(b"\n")
+        if end < 0:
+            self._partial = data
+            return objects
+        self._partial = data[end + 1:]
+        for line in data[:end].split(b"\n"):
+            self._decode(line, objects)
+        return objects
+
+    def flush(self) -> List[Any]:
+        """Objects in the last line of a stream that did not end with a newline"""
+        objects: List[Any] = []
+        partial, self._partial = self._partial, b""
+        self._decode(partial, objects)
+        return objects
+
+
+async def iter_ndjson(chunks: AsyncIterable[bytes], name: str = "upstream") -> AsyncIterator[Any]:
+    decoder = NDJSONDecoder(name)
+    async for chunk in chunks:
+        for obj in decoder.feed(chunk):
+            yield obj
+    for obj in decoder.flush():
+        yield obj
+
+
+async def coalesce(
+    deltas: AsyncIterable[str],
+    window_ms: float = COALESCE_WINDOW_MS,
+    max_bytes: int = COALESCE_MAX_BYTES,
+    first_immediately: bool = True,
+) -> AsyncIterator[str]:
+    """
+    Merge text deltas that arrive within `window_ms` of the first buffered one,
+    or until `max_bytes`, into a single delta. The very first delta goes out at
+    once so the time to first token is unchanged. A slow upstream never holds
+    buffered text back longer than the window.
+
+    The source is read by one task of its own. Closing the coalesced stream
+    cancels that task and waits until the source has been closed.
+    """
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    received: asyncio.Queue = asyncio.Queue()
+
+    async def read() -> None:
+        iterator = deltas.__aiter__()
+        try:
+            async for delta in iterator:
+                received.put_nowait((delta, None))
+            received.put_nowait((None, None))
+        except Exception as e:
+            received.put_nowait((None, e))
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    reader = asyncio.create_task(read())
+    buffer: List[str] = []
+    size = 0
+    deadline: Optional[float] = None
+    emitted = not first_immediately
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                delta, error = await asyncio.wait_for(received.get(), timeout)
+            except TimeoutError:
+                delta, error = "", None
+            else:
+                if error is not None:
+                    raise error
+                if delta is None:
+                    break
+                if not emitted:
+                    emitted = True
+                    yield delta
+                    continue
+                if not buffer:
+                    deadline = loop.time() + window
+                buffer.append(delta)
+                size += len(delta)
+                if size < max_bytes:
+                    continue
+            if buffer:
+                metrics.incr("ndjson.coalesced_deltas", len(buffer))
+                metrics.incr("ndjson.frames")
+                yield "".join(buffer)
+            buffer, size, deadline = [], 0, None
+        if buffer:
+            metrics.incr("ndjson.coalesced_deltas", len(buffer))
+            metrics.incr("ndjson.frames")
+            yield "".join(buffer)
+    finally:
+        # The source finishes unwinding before the coalesced stream counts as closed
+        reader.cancel()
+        await asyncio.wait({reader})
@@ -0,0 +1,22 @@
+"""
+Progress events streamed to the client while a chat request is assembled and
+answered
+"""
+from typing import Callable, Optional
+from app.utils.ndjson import dumps_line
+
+# Called with the stage name and its details, e.g. progress("extracting_file", file="a.pdf")
+Progress = Callable[..., None]
+
+
+class ProgressLine(str):
+    """An NDJSON line that reports progress rather than answer content"""
+
+
+def progress_line(stage: str, **detail) -> ProgressLine:
+    return ProgressLine(dumps_line({"type": "progress", "stage": stage, **detail}))
+
+
+def report(progress: Optional[Progress], stage: str, **detail) -> None:
+    if progress is not None:
+        progress(stage, **detail)
@@ -0,0 +1,168 @@
+"""
+Resumable server-sent event streams: each generation runs independently of
+its HTTP response and keeps its recent events in a ring buffer, so a client
+that reconnects with Last-Event-ID continues where it left off
+"""
+import asyncio
+import time
+import uuid
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterable, AsyncIterator, Deque, Dict, Optional, Tuple
+from app.utils.metrics import metrics
+from app.utils.ndjson import dumps_line
+from app.utils.progress import ProgressLine
+from app.utils.settings import get_settings
+
+RESUME_CONFIG = get_settings().config.get("Resumable_Streams", {})
+
+BUFFER_EVENTS = RESUME_CONFIG.get("Buffer_Events", 1024)
+TTL_SECONDS = RESUME_CONFIG.get("TTL_Seconds", 120)
+# How long a generation keeps running with nobody reading it before it is cancelled
+ORPHAN_GRACE_SECONDS = RESUME_CONFIG.get("Orphan_Grace_Seconds", 20)
+RETRY_MS = RESUME_CONFIG.get("Retry_MS", 2000)
+
+
+class StreamGone(Exception):
+    """The generation expired, or the events after the client's position were already dropped"""
+
+
+def event_id(generation_id: str, seq: int) -> str:
+    return f"{generation_id}-{seq}"
+
+
+def parse_event_id(value: str) -> Optional[Tuple[str, int]]:
+    generation_id, _, seq = value.strip().rpartition("-")
+    if not generation_id or not seq.lstrip("-").isdigit():
+        return None
+    return generation_id, int(seq)
+
+
+def sse_frame(data: str, id: Optional[str] = None, event: Optional[str] = None) -> str:
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+class Generation:
+    """
+    One generation's events: (seq, event, data) with consecutive sequence
+    numbers, of which the last `capacity` are kept for late readers.
+    """
+
+    def __init__(self, generation_id: str, capacity: int = BUFFER_EVENTS):
+        self.id = generation_id
+        self.events: Deque[Tuple[int, str, str]] = deque(maxlen=capacity)
+        self.next_seq = 0
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, data: str, event: str = "message") -> None:
+        self.events.append((self.next_seq, event, data))
+        self.next_seq += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def finish(self, event: str = "done", data: str = "{}") -> None:
+        if not self.done:
+            self.publish(data, event)
+            self.done = True
+
+    async def read(self, after: int = -1) -> AsyncIterator[Tuple[int, str, str]]:
+        """Events with a sequence number above `after`, live until the generation is done"""
+        self.subscribers += 1
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+        try:
+            while True:
+                changed = self._changed
+                oldest = self.events[0][0] if self.events else self.next_seq
+                if after + 1 < oldest:
+                    raise StreamGone(f"Events {after + 1}..{oldest - 1} of stream {self.id} are no longer buffered")
+                for seq, event, data in list(self.events):
+                    if seq > after:
+                        after = seq
+                        yield seq, event, data
+                if self.done and after >= self.next_seq - 1:
+                    return
+                if changed is self._changed and not changed.is_set():
+                    await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self._orphan_timer = asyncio.get_running_loop().call_later(ORPHAN_GRACE_SECONDS, self._cancel_if_orphaned)
+
+    def _cancel_if_orphaned(self) -> None:
+        self._orphan_timer = None
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            metrics.incr("sse.orphaned_generations_cancelled")
+            self.task.cancel()
+
+
+class GenerationRegistry:
+    """Live and recently finished generations by id; finished ones expire after `ttl` seconds"""
+
+    def __init__(self, capacity: int = BUFFER_EVENTS, ttl: float = TTL_SECONDS):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._generations: Dict[str, Generation] = {}
+
+    def start(self, lines: AsyncIterable[str]) -> Generation:
+        """Run the NDJSON `lines` of a chat stream as a generation, in a task of its own"""
+        generation = Generation(uuid.uuid4().hex, self.capacity)
+        self._generations[generation.id] = generation
+        generation.task = asyncio.create_task(self._pump(generation, lines))
+        metrics.incr("sse.generations")
+        return generation
+
+    async def _pump(self, generation: Generation, lines: AsyncIterable[str]) -> None:
+        try:
+            async with aclosing(lines):
+                async for line in lines:
+                    generation.publish(line.rstrip("\n"), "progress" if isinstance(line, ProgressLine) else "message")
+            generation.finish()
+        except asyncio.CancelledError:
+            generation.finish("error", dumps_line({"detail": "Generation cancelled"}).rstrip("\n"))
+        except Exception as e:
+            print(f"Error in resumable stream {generation.id}: {e}")
+            generation.finish("error", dumps_line({"detail": str(e)}).rstrip("\n"))
+        finally:
+            asyncio.get_running_loop().call_later(self.ttl, self._generations.pop, generation.id, None)
+
+    def get(self, generation_id: str) -> Optional[Generation]:
+        return self._generations.get(generation_id)
+
+    def resume(self, last_event_id: str) -> Optional[Tuple[Generation, int]]:
+        """The generation and position named by a Last-Event-ID header, if it is still known"""
+        parsed = parse_event_id(last_event_id)
+        if parsed is None:
+            return None
+        generation = self.get(parsed[0])
+        if generation is None:
+            metrics.incr("sse.resume_misses")
+            return None
+        metrics.incr("sse.resumes")
+        return generation, parsed[1]
+
+
+async def sse_stream(generation: Generation, after: int = -1) -> AsyncIterator[str]:
+    """SSE frames of `generation` after position `after`, each with an id to resume from"""
+    yield f"retry: {RETRY_MS}\n\n"
+    try:
+        async with aclosing(generation.read(after)) as events:
+            async for seq, event, data in events:
+                yield sse_frame(data, id=event_id(generation.id, seq), event=None if event == "message" else event)
+    except StreamGone as e:
+        metrics.incr("sse.resume_gaps")
+        yield sse_frame(dumps_line({"detail": str(e)}).rstrip("\n"), event="error")
+
+
+generations = GenerationRegistry()
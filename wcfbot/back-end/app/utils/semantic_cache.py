@@ -0,0 +1,387 @@
+"""
+Semantic answer cache: paraphrases of a cached question get the cached answer
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set
+import numpy as np
+from app.utils.answer_cache import CachedAnswer, normalize_message
+from app.utils.http_client import upstream
+from app.utils.memory_retrieval import HashedNgramVectorizer
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+
+SEMANTIC_CONFIG = get_settings().config.get("Semantic_Cache", {})
+
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Embedder(ABC):
+    """Turns texts into L2-normalised float32 vectors, one row per text"""
+
+    name = "embedder"
+
+    @abstractmethod
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        ...
+
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic local embedder built on the hashed n-gram vectorizer used for
+    memory retrieval. Needs no network, so it suits tests and offline setups,
+    but only catches paraphrases that share most of their words.
+    """
+
+    def __init__(self, dim: int = 2048):
+        self.vectorizer = HashedNgramVectorizer(dim)
+        self.name = f"hashing-{dim}"
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return np.stack([self.vectorizer.transform(text) for text in texts])
+
+
+class PawaEmbedder(Embedder):
+    """Dense multilingual embeddings from the Pawa AI vectors endpoint"""
+
+    def __init__(self, url: str, model: str, timeout: float = 5):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.name = model
+
+    @staticmethod
+    def _parse(response_json: dict) -> List[List[float]]:
+        data = response_json.get("data", response_json)
+        if isinstance(data, dict):
+            data = data.get("embeddings") or data.get("vectors") or data.get("data") or []
+        vectors = []
+        for item in data:
+            if isinstance(item, dict):
+                item = item.get("embedding") or item.get("vector") or []
+            vectors.append(item)
+        return vectors
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        settings = get_settings()
+        response = await upstream.post(
+            self.url,
+            json={"model": self.model, "sentences": list(texts)},
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {settings.api_key}"
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        vectors = self._parse(response.json())
+        if len(vectors) != len(texts) or not vectors or not vectors[0]:
+            raise ValueError("Unexpected embedding response shape")
+        return _normalize_rows(np.array(vectors, dtype=np.float32))
+
+
+@dataclass
+class SemanticMatch:
+    """Outcome of a lookup: the cached answer on a hit, and the query vector either way"""
+    vector: np.ndarray
+    answer: Optional[CachedAnswer] = None
+    score: float = 0.0
+
+
+class SemanticNamespace:
+    """
+    Fixed-capacity vector index for one knowledge base and settings fingerprint.
+
+    Vectors live in an in-memory float32 matrix that is mirrored row by row into
+    `vectors.f32`, a memory-mapped file, and the entries are appended to
+    `entries.jsonl`, so the index survives restarts without being rebuilt.
+    """
+
+    def __init__(self, directory: str, dim: int, capacity: int, embedder_name: str):
+        self.directory = directory
+        self.dim = dim
+        self.capacity = capacity
+        self.embedder_name = embedder_name
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.stored_at = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.entries: List[Optional[Dict]] = [None] * capacity
+        self._lock = threading.Lock()
+        self._log_lines = 0
+        self._vectors: Optional[np.memmap] = None
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, "vectors.f32")
+
+    @property
+    def _entries_path(self) -> str:
+        return os.path.join(self.directory, "entries.jsonl")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.json")
+
+    def open(self) -> None:
+        """Map the persisted copy, loading it when it matches this index's shape and embedder"""
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {"dim": self.dim, "capacity": self.capacity, "embedder": self.embedder_name}
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                reusable = json.load(f) == meta
+        except (OSError, ValueError):
+            reusable = False
+        reusable = reusable and os.path.exists(self._vectors_path)
+
+        if not reusable:
+            for path in (self._vectors_path, self._entries_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            with open(self._meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+        self._vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+" if reusable else "w+",
+            shape=(self.capacity, self.dim),
+        )
+        if reusable:
+            self._load_entries()
+
+    def _load_entries(self) -> None:
+        try:
+            with open(self._entries_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            slot = record.get("slot")
+            if isinstance(slot, int) and 0 <= slot < self.capacity:
+                self.entries[slot] = record
+        self._log_lines = len(lines)
+        for slot, entry in enumerate(self.entries):
+            if entry is not None:
+                self.matrix[slot] = self._vectors[slot]
+                self.stored_at[slot] = entry["stored_at"]
+                self.last_used[slot] = entry["stored_at"]
+
+    def _live(self, ttl: float) -> np.ndarray:
+        return self.stored_at > time.time() - ttl
+
+    def search(self, vector: np.ndarray, ttl: float):
+        """Best live slot and its cosine similarity, or (None, 0.0)"""
+        scores = self.matrix @ vector
+        scores[~self._live(ttl)] = -np.inf
+        slot = int(np.argmax(scores))
+        if not np.isfinite(scores[slot]):
+            return None, 0.0
+        return slot, float(scores[slot])
+
+    def choose_slot(self, ttl: float) -> int:
+        """A free or expired slot, otherwise the least recently used one"""
+        dead = np.flatnonzero(~self._live(ttl))
+        if len(dead):
+            return int(dead[0])
+        metrics.incr("semantic_cache.evictions")
+        return int(np.argmin(self.last_used))
+
+    def store(self, slot: int, vector: np.ndarray, entry: Dict) -> None:
+        self.matrix[slot] = vector
+        self.stored_at[slot] = entry["stored_at"]
+        self.last_used[slot] = entry["stored_at"]
+        self.entries[slot] = entry
+
+    def persist(self, slot: int, vector: np.ndarray, entry: Dict) -> None:
+        """Write one slot to the memory-mapped vectors and the entries log (worker thread)"""
+        with self._lock:
+            self._vectors[slot] = vector
+            self._vectors.flush()
+            with open(self._entries_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._log_lines += 1
+            if self._log_lines > 2 * self.capacity:
+                self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite the entries log with only the current entry of each slot"""
+        live = [entry for entry in self.entries if entry is not None]
+        tmp_path = f"{self._entries_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in live:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._entries_path)
+        self._log_lines = len(live)
+
+    def close(self) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+
+
+class SemanticCache:
+    """
+    Answers keyed by message embeddings. A lookup embeds the message and returns
+    the cached answer of the most similar stored question when their cosine
+    similarity reaches `threshold`. Each knowledge base (plus settings
+    fingerprint) gets its own namespace of at most `capacity` entries, evicted
+    least recently used first; entries expire after `ttl` seconds.
+
+    Callers wait at most `lookup_timeout` seconds for a lookup before going on
+    without it; the lookup keeps running so the answer can still be stored.
+    """
+
+    def __init__(self, embedder: Embedder, directory: str, threshold: float = 0.92, capacity: int = 4096, ttl: float = 24 * 3600, lookup_timeout: float = 0.3):
+        self.embedder = embedder
+        self.directory = directory
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.lookup_timeout = lookup_timeout
+        self._namespaces: Dict[str, SemanticNamespace] = {}
+        self._opening: Dict[str, asyncio.Lock] = {}
+        # Lookups and stores that outlive the request that started them
+        self._tasks: Set[asyncio.Task] = set()
+        # Writes of stored entries to disk, which run in worker threads
+        self._persisting: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def namespace_for(kb_reference_id: Optional[str], fingerprint: str) -> str:
+        kb = _UNSAFE_NAME.sub("_", kb_reference_id or "no-kb")
+        return f"{kb}-{fingerprint[:16]}"
+
+    async def _namespace(self, name: str, dim: int) -> SemanticNamespace:
+        namespace = self._namespaces.get(name)
+        if namespace is not None:
+            return namespace
+        async with self._opening.setdefault(name, asyncio.Lock()):
+            namespace = self._namespaces.get(name)
+            if namespace is None:
+                namespace = SemanticNamespace(os.path.join(self.directory, name), dim, self.capacity, self.embedder.name)
+                await asyncio.to_thread(namespace.open)
+                self._namespaces[name] = namespace
+        return namespace
+
+    async def lookup(self, namespace_name: str, message: str) -> SemanticMatch:
+        vector = (await self.embedder.embed([normalize_message(message)]))[0]
+        namespace = await self._namespace(namespace_name, len(vector))
+        slot, score = namespace.search(vector, self.ttl)
+        metrics.observe("semantic_cache.best_score", score)
+        if slot is None or score < self.threshold:
+            metrics.incr("semantic_cache.misses")
+            return SemanticMatch(vector=vector, score=score)
+
+        metrics.incr("semantic_cache.hits")
+        namespace.last_used[slot] = time.time()
+        entry = namespace.entries[slot]
+        return SemanticMatch(
+            vector=vector,
+            answer=CachedAnswer(content=entry["content"], chunks=tuple(entry["chunks"])),
+            score=score,
+        )
+
+    def _track(self, coro, tasks: Optional[Set[asyncio.Task]] = None) -> asyncio.Task:
+        tasks = self._tasks if tasks is None else tasks
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    async def _lookup_or_none(self, namespace_name: str, message: str) -> Optional[SemanticMatch]:
+        try:
+            return await self.lookup(namespace_name, message)
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {e}")
+            return None
+
+    def start_lookup(self, namespace_name: str, message: str) -> "asyncio.Task[Optional[SemanticMatch]]":
+        """`lookup` as a task that resolves to None when it fails, so the caller can stop waiting for it"""
+        return self._track(self._lookup_or_none(namespace_name, message))
+
+    async def remember(self, namespace_name: str, message: str, lookup: "asyncio.Task[Optional[SemanticMatch]]", content: str, chunks: Optional[List[str]] = None) -> None:
+        """Store an answer under the vector from `lookup`, in the background if it is still running"""
+        if lookup.done():
+            await self._put_after(namespace_name, message, lookup, content, chunks)
+        else:
+            self._track(self._put_after(namespace_name, message, lookup, content, chunks))
+
+    async def _put_after(self, namespace_name: str, message: str, lookup: "asyncio.Task[Optional[SemanticMatch]]", content: str, chunks: Optional[List[str]]) -> None:
+        match = await lookup
+        # A late hit means the question is cached already
+        if match is not None and match.answer is None:
+            await self.put(namespace_name, message, match, content, chunks)
+
+    async def put(self, namespace_name: str, message: str, match: SemanticMatch, content: str, chunks: Optional[List[str]] = None) -> None:
+        if not content.strip():
+            return
+        namespace = await self._namespace(namespace_name, len(match.vector))
+        # A concurrent miss on the same question may have stored it already
+        slot, score = namespace.search(match.vector, self.ttl)
+        if slot is None or score < self.threshold:
+            slot = namespace.choose_slot(self.ttl)
+        entry = {
+            "slot": slot,
+            "message": message,
+            "content": content,
+            "chunks": list(chunks) if chunks else [content],
+            "stored_at": time.time(),
+        }
+        namespace.store(slot, match.vector, entry)
+        # The entry is served from memory right away; the request does not wait for the disk
+        self._track(self._persist(namespace, slot, match.vector, entry), self._persisting)
+
+    @staticmethod
+    async def _persist(namespace: SemanticNamespace, slot: int, vector: np.ndarray, entry: Dict) -> None:
+        try:
+            await asyncio.to_thread(namespace.persist, slot, vector, entry)
+        except OSError as e:
+            print(f"Error persisting semantic cache entry: {e}")
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Writes already handed to a worker thread cannot be cancelled; let them finish
+        await asyncio.gather(*self._persisting, return_exceptions=True)
+        for namespace in self._namespaces.values():
+            namespace.close()
+        self._namespaces.clear()
+
+
+def build_embedder(config: dict) -> Embedder:
+    if config.get("Embedder", "pawa") == "hashing":
+        return HashingEmbedder(config.get("Hashing_Dimensions", 2048))
+    return PawaEmbedder(
+        f"{config.get('Base_URL', 'https://staging.api.pawa-ai.com')}{config.get('Endpoint', '/v1/vectors/embedding')}",
+        config.get("Model", "pawa-embedding-v1-20240701"),
+        timeout=config.get("Embed_Timeout", 5),
+    )
+
+
+SEMANTIC_CACHE_ENABLED = SEMANTIC_CONFIG.get("Enabled", False)
+
+semantic_cache = SemanticCache(
+    build_embedder(SEMANTIC_CONFIG),
+    SEMANTIC_CONFIG.get("Directory", "app/engine/semantic_cache"),
+    threshold=SEMANTIC_CONFIG.get("Threshold", 0.92),
+    capacity=SEMANTIC_CONFIG.get("Max_Entries_Per_KB", 4096),
+    ttl=SEMANTIC_CONFIG.get("TTL_Seconds", 24 * 3600),
+    lookup_timeout=SEMANTIC_CONFIG.get("Lookup_Timeout", 0.3),
+)
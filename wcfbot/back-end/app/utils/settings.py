@@ -0,0 +1,260 @@
+"""
+Typed, immutable settings parsed once from config.yaml and the environment,
+with mtime-checked hot reload.
+
+Only what is read through `get_settings()` when it is used picks up a reload:
+the chat request (model, prompt, sampling, tools, knowledge base), TTS, STT,
+extraction and store settings. Components that copy a config.yaml section into
+a module constant at import, such as Agent_Loop, Semantic_Cache, Memory or
+Uploads, keep the values they started with until the server restarts.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+import yaml
+from dotenv import load_dotenv
+
+CONFIG_PATH = "app/engine/config.yaml"
+ENV_PATH = ".env"
+
+
+def freeze(value: Any) -> Any:
+    """Read-only copy of parsed YAML or JSON: mappings become MappingProxyType, lists tuples"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Plain dicts and lists from a frozen value, to mutate or serialize"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def _env_bool(name: str, default: str = "False") -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+
+def _env_float(name: str, default: Optional[float] = None) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+@dataclass(frozen=True)
+class ChatSettings:
+    url: str
+    model: Optional[str]
+    system_prompt: str
+    temperature: float
+    top_p: float
+    tool_choice: str
+    max_tokens: int
+    frequency_penalty: float
+    presence_penalty: float
+    seed: int
+    kb_reference_id: Optional[str]
+    is_must_use_kb: Optional[bool]
+    memory_enabled: bool
+    tools: Tuple[Mapping[str, Any], ...]
+    # Prebuilt pieces of every chat request, frozen; `thaw` them per request
+    system_message: Mapping[str, Any] = field(repr=False)
+    template: Mapping[str, Any] = field(repr=False)
+
+
+@dataclass(frozen=True)
+class TTSSettings:
+    url: Optional[str]
+    voice: Optional[str]
+    model: Optional[str]
+    max_tokens: Optional[int]
+    temperature: Optional[float]
+    top_p: Optional[float]
+    repetition_penalty: Optional[float]
+
+
+@dataclass(frozen=True)
+class StoreSettings:
+    url: str
+    name: str
+    description: str
+    folder_path: str
+
+
+@dataclass(frozen=True)
+class Settings:
+    api_key: Optional[str]
+    chat: ChatSettings
+    tts: TTSSettings
+    stt_url: Optional[str]
+    extraction_url: str
+    extraction_api_key: Optional[str]
+    store: StoreSettings
+    # Raw config.yaml sections for components that are built once at startup
+    config: Mapping[str, Any] = field(repr=False)
+
+
+def build_tools(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Function tools registered in app/utils/tools.py followed by the built-in Pawa tools"""
+    # Imported here: tool functions read these settings when they run
+    from app.utils.tools import registry
+    tools = registry.schemas()
+    for built_in_tool in config.get("BUILT_IN_TOOLS") or []:
+        tools.append({
+            "type": "pawa_tool",
+            "pawa_tool": built_in_tool["name"]
+        })
+    return tools
+
+
+def _build_chat(config: Dict[str, Any]) -> ChatSettings:
+    system_prompt = os.getenv("PAWA_SYSTEM_PROMPT", "").replace("\\n", "\n")
+    system_message = {
+        "role": "system",
+        "content": [
+            {
+                "type": "text",
+                "text": system_prompt
+            }
+        ]
+    }
+
+    chat = dict(
+        url=f"{config['Chat']['Base_URL']}{config['Chat']['Endpoint']}",
+        model=os.getenv("CHAT_MODEL"),
+        system_prompt=system_prompt,
+        temperature=_env_float("TEMPERATURE", 0.1),
+        top_p=_env_float("TOP_P", 0.95),
+        tool_choice=os.getenv("TOOL_CHOICE", "auto"),
+        max_tokens=_env_int("MAX_TOKENS", 4096),
+        frequency_penalty=_env_float("FREQUENCY_PENALTY", 0.3),
+        presence_penalty=_env_float("PRESENCE_PENALTY", 0.3),
+        seed=_env_int("SEED", 2024),
+        kb_reference_id=os.getenv("KB_REFERENCE_ID"),
+        is_must_use_kb=(
+            os.getenv("IS_MUST_USE_KB").lower() == "true"
+            if os.getenv("IS_MUST_USE_KB") is not None else None
+        ),
+        memory_enabled=_env_bool("IS_MEMORY_ENABLED"),
+        tools=freeze(build_tools(config)),
+    )
+
+    template = {
+        "model": chat["model"],
+        "stream": False,
+        "temperature": chat["temperature"],
+        "top_p": chat["top_p"],
+        "tool_choice": chat["tool_choice"],
+        "max_tokens": chat["max_tokens"],
+        "frequency_penalty": chat["frequency_penalty"],
+        "presence_penalty": chat["presence_penalty"],
+        "seed": chat["seed"],
+    }
+    if chat["tools"]:
+        template["tools"] = chat["tools"]
+    if chat["kb_reference_id"] is not None:
+        template["knowledgeBase"] = {
+            "kbReferenceId": chat["kb_reference_id"],
+            **({"isMust": chat["is_must_use_kb"]} if chat["is_must_use_kb"] is not None else {})
+        }
+
+    return ChatSettings(
+        **chat,
+        system_message=freeze(system_message),
+        template=freeze(template),
+    )
+
+
+def load_settings(config_path: str = CONFIG_PATH) -> Settings:
+    with open(config_path, "r") as file:
+        config = yaml.safe_load(file)
+
+    return Settings(
+        api_key=os.getenv("PAWA_AI_API_KEY"),
+        chat=_build_chat(config),
+        tts=TTSSettings(
+            url=os.getenv("TTS_API_URL"),
+            voice=os.getenv("VOICE"),
+            model=os.getenv("TTS_MODEL"),
+            max_tokens=_env_int("TTS_MAX_TOKEN"),
+            temperature=_env_float("TTS_TEMP"),
+            top_p=_env_float("TTS_TOP_P"),
+            repetition_penalty=_env_float("REP_PENALTY"),
+        ),
+        stt_url=os.getenv("STT_API_URL"),
+        extraction_url=f"{config['Extraction']['Base_URL']}{config['Extraction']['Endpoint']}",
+        extraction_api_key=os.getenv("EXTRACTION_API_KEY"),
+        store=StoreSettings(
+            url=f"{config['STORE']['Base_URL']}{config['STORE']['Endpoint']}",
+            name=config["STORE"]["Name"],
+            description=config["STORE"]["Description"],
+            folder_path=config["STORE"]["FOLDER_PATH"],
+        ),
+        config=freeze(config),
+    )
+
+
+class SettingsManager:
+    """
+    Holds the current Settings and swaps in a freshly parsed copy when
+    config.yaml or .env changes on disk. Modification times are checked at most
+    once every `check_interval` seconds, so `get()` is cheap on the hot path.
+    """
+
+    def __init__(self, config_path: str = CONFIG_PATH, env_path: str = ENV_PATH, check_interval: float = 2.0):
+        self.config_path = config_path
+        self.env_path = env_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        load_dotenv(env_path, override=True)
+        self._mtimes = self._read_mtimes()
+        self._current = load_settings(config_path)
+
+    def _read_mtimes(self) -> Tuple[float, float]:
+        def mtime(path: str) -> float:
+            try:
+                return os.stat(path).st_mtime
+            except OSError:
+                return 0.0
+        return mtime(self.config_path), mtime(self.env_path)
+
+    def get(self) -> Settings:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            mtimes = self._read_mtimes()
+            if mtimes != self._mtimes:
+                self.reload(mtimes)
+        return self._current
+
+    def reload(self, mtimes: Optional[Tuple[float, float]] = None) -> Settings:
+        with self._lock:
+            self._mtimes = mtimes or self._read_mtimes()
+            try:
+                load_dotenv(self.env_path, override=True)
+                settings = load_settings(self.config_path)
+            except Exception as e:
+                print(f"Error reloading settings, keeping the previous ones: {e}")
+                return self._current
+            self._current = settings
+            return settings
+
+
+settings_manager = SettingsManager()
+
+
+def get_settings() -> Settings:
+    return settings_manager.get()
@@ -0,0 +1,148 @@
+"""
+Single-flight coalescing of identical in-flight questions: the first request
+for a key starts one upstream generation, and identical requests that arrive
+while it runs subscribe to its output instead of starting their own
+"""
+import asyncio
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+from fastapi import HTTPException
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+
+SINGLE_FLIGHT_CONFIG = get_settings().config.get("Single_Flight", {})
+
+SINGLE_FLIGHT_ENABLED = SINGLE_FLIGHT_CONFIG.get("Enabled", True)
+
+
+def _subscriber_error(error: BaseException) -> Exception:
+    """A new exception for each subscriber, so they do not all add to one traceback"""
+    if isinstance(error, HTTPException):
+        return HTTPException(status_code=error.status_code, detail=error.detail, headers=error.headers)
+    return RuntimeError(str(error) or type(error).__name__)
+
+
+class Flight:
+    """
+    Fan-out of one generation: every item it publishes is kept for the length
+    of the flight, so a subscriber that joins late still reads it from the
+    start. Subscriptions are reserved when the flight is handed out, before
+    the caller starts reading, and the generation is cancelled once the last
+    one is released.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.items: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.total_subscribers = 0
+        # Set once every subscriber has left; the flight takes no new ones
+        self.abandoned = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, item: str) -> None:
+        self.items.append(item)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if not self.done:
+            self.error = error
+            self.done = True
+            self._changed.set()
+
+    def reserve(self) -> None:
+        self.subscribers += 1
+        self.total_subscribers += 1
+
+    def release(self) -> None:
+        """Give up a reserved subscription, whether or not it was ever read"""
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            metrics.incr("single_flight.abandoned")
+            self.abandoned = True
+            self.task.cancel()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Every item of the flight; raises the generation's error, if it failed"""
+        position = 0
+        while True:
+            changed = self._changed
+            while position < len(self.items):
+                position += 1
+                yield self.items[position - 1]
+            if self.done:
+                if self.error is not None:
+                    raise _subscriber_error(self.error) from self.error
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    """In-flight generations by key; a key is free again as soon as its flight is over"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+
+    def join(self, key: str) -> Optional[Flight]:
+        """
+        The flight already running for `key`, counted as a coalesced request,
+        with a subscription reserved that the caller has to `release`
+        """
+        flight = self._flights.get(key)
+        if flight is None or flight.abandoned:
+            return None
+        flight.reserve()
+        metrics.incr("single_flight.followers")
+        return flight
+
+    def lead(self, key: str, source: Callable[[Flight], AsyncGenerator[str, None]]) -> Flight:
+        """
+        Start a flight for `key` from `source(flight)`, or join the one started
+        by an identical request in the meantime. `source` may also publish to
+        the flight directly, e.g. progress lines. Either way a subscription is
+        reserved, as with `join`.
+        """
+        flight = self.join(key)
+        if flight is not None:
+            return flight
+        flight = Flight(key)
+        flight.reserve()
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(self._pump(flight, source(flight)))
+        metrics.incr("single_flight.leaders")
+        return flight
+
+    async def _pump(self, flight: Flight, items: AsyncGenerator[str, None]) -> None:
+        try:
+            async with aclosing(items):
+                async for item in items:
+                    flight.publish(item)
+            flight.finish()
+        except asyncio.CancelledError:
+            flight.finish(RuntimeError("Generation cancelled"))
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            # An abandoned flight may already have been replaced by a new one
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            metrics.observe("single_flight.subscribers", flight.total_subscribers)
+
+    def stats(self) -> dict:
+        leaders = metrics.counter("single_flight.leaders")
+        followers = metrics.counter("single_flight.followers")
+        requests = leaders + followers
+        return {
+            "in_flight": len(self._flights),
+            "leaders": leaders,
+            "followers": followers,
+            # Share of eligible requests that did not start an upstream generation
+            "coalescing_ratio": followers / requests if requests else 0.0,
+        }
+
+
+in_flight = SingleFlight()
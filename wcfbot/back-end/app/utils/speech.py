@@ -0,0 +1,311 @@
+"""
+Text-to-speech synthesis: single requests, sentence segmentation and an
+ordered, windowed pipeline that synthesizes sentences concurrently
+"""
+import asyncio
+import re
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Tuple, Union
+from fastapi import HTTPException
+from app.utils.audio_cache import audio_cache, audio_key, AUDIO_CACHE_ENABLED, AUDIO_CACHE_WRITE_BUFFER
+from app.utils.http_client import upstream
+from app.utils.metrics import metrics
+from app.utils.settings import Settings, TTSSettings, get_settings
+
+PIPELINE_CONFIG = get_settings().config.get("TTS_Pipeline", {})
+
+PIPELINE_ENABLED = PIPELINE_CONFIG.get("Enabled", True)
+PIPELINE_MIN_TEXT_CHARS = PIPELINE_CONFIG.get("Min_Text_Chars", 200)
+PIPELINE_WINDOW = PIPELINE_CONFIG.get("Window", 3)
+MIN_SEGMENT_CHARS = PIPELINE_CONFIG.get("Min_Segment_Chars", 40)
+MAX_SEGMENT_CHARS = PIPELINE_CONFIG.get("Max_Segment_Chars", 300)
+
+# Abbreviations whose trailing period does not end a sentence, English and Swahili
+# (Bw. = Bwana, Bi. = Bibi, Dkt. = Daktari, Mh. = Mheshimiwa, k.m. = kwa mfano,
+# n.k. = na kadhalika, S.L.P. = Sanduku la Posta, Na. = Namba, Kif. = Kifungu)
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "no", "vs", "etc", "e.g", "i.e",
+    "fig", "art", "sec", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept",
+    "oct", "nov", "dec", "bw", "bi", "dkt", "mh", "mhe", "k.m", "n.k", "s.l.p", "na",
+    "kif", "ibara", "uk", "tsh", "sh",
+}
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')\]»”’]*(?=\s)|\n+")
+_LAST_WORD = re.compile(r"([\w.]+)[.!?…]*$")
+_SOFT_BREAK = re.compile(r"[,;:–—]\s")
+
+
+def _ends_sentence(text: str, end: int) -> bool:
+    """Whether the punctuation ending at `end` closes a sentence rather than an abbreviation or initial"""
+    if text[end - 1] == "\n":
+        return True
+    match = _LAST_WORD.search(text[:end].rstrip("\"')]»”’"))
+    if match is None:
+        return True
+    word = match.group(1).rstrip(".").lower()
+    if word in ABBREVIATIONS:
+        return False
+    # Single-letter initials ("J. Mwakyusa") and numbered items ("1. ")
+    if len(word) == 1 or word.isdigit():
+        return False
+    return True
+
+
+def _soft_cut(text: str, max_chars: int) -> int:
+    """Position of the last comma-like break, or else space, within the first `max_chars`"""
+    window = text[:max_chars]
+    breaks = [m.end() for m in _SOFT_BREAK.finditer(window)]
+    cut = breaks[-1] if breaks else window.rfind(" ") + 1
+    return cut if cut > 0 else max_chars
+
+
+def _split_long(segment: str, max_chars: int) -> List[str]:
+    parts = []
+    while len(segment) > max_chars:
+        cut = _soft_cut(segment, max_chars)
+        parts.append(segment[:cut].strip())
+        segment = segment[cut:].strip()
+    if segment:
+        parts.append(segment)
+    return parts
+
+
+def split_sentences(text: str, min_chars: int = MIN_SEGMENT_CHARS, max_chars: int = MAX_SEGMENT_CHARS) -> List[str]:
+    """
+    Split text into speakable segments at sentence boundaries. Abbreviations,
+    initials and numbered items do not end a sentence; segments shorter than
+    `min_chars` are joined to the next one and longer than `max_chars` are cut
+    at a comma or space.
+    """
+    sentences, start = [], 0
+    for match in _SENTENCE_END.finditer(text):
+        if _ends_sentence(text, match.end()):
+            sentence = text[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+
+    segments: List[str] = []
+    pending = ""
+    for sentence in sentences:
+        pending = f"{pending} {sentence}".strip()
+        if len(pending) >= min_chars:
+            segments.extend(_split_long(pending, max_chars))
+            pending = ""
+    if pending:
+        if segments and len(segments[-1]) + len(pending) < max_chars:
+            segments[-1] = f"{segments[-1]} {pending}"
+        else:
+            segments.append(pending)
+    return segments
+
+
+_MARKDOWN = re.compile(r"\*\*|__|`+|^#{1,6}\s*|^\s*[-*•]\s+|^\s*>\s*|\[([^\]]*)\]\([^)]*\)", re.MULTILINE)
+
+
+def speakable(text: str) -> str:
+    """Text without the markdown symbols a voice would otherwise read out"""
+    return _MARKDOWN.sub(lambda m: m.group(1) or "", text).strip()
+
+
+class SentenceAccumulator:
+    """
+    Cuts a stream of text deltas into speakable segments as soon as each one is
+    complete. A boundary counts once the whitespace after it has arrived, so a
+    period inside "3.5" or "k.m." is never cut on.
+    """
+
+    def __init__(self, min_chars: int = MIN_SEGMENT_CHARS, max_chars: int = MAX_SEGMENT_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self._buffer += delta
+        cut = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() >= self.min_chars and _ends_sentence(self._buffer, match.end()):
+                cut = match.end()
+        if not cut and len(self._buffer) > self.max_chars:
+            # No sentence end in sight; fall back to a comma or space
+            cut = _soft_cut(self._buffer, self.max_chars)
+        if not cut:
+            return []
+        ready, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return self._segments(ready)
+
+    def flush(self) -> List[str]:
+        """Whatever is left once the text stream has ended"""
+        ready, self._buffer = self._buffer, ""
+        return self._segments(ready)
+
+    def _segments(self, text: str) -> List[str]:
+        segments = (speakable(part) for part in split_sentences(text, self.min_chars, self.max_chars))
+        return [segment for segment in segments if segment]
+
+
+def tts_payload(text: str, tts: TTSSettings) -> dict:
+    return {
+        "text": text,
+        "voice": tts.voice,
+        "model": tts.model,
+        "max_tokens": tts.max_tokens,
+        "temperature": tts.temperature,
+        "top_p": tts.top_p,
+        "repetition_penalty": tts.repetition_penalty
+    }
+
+
+async def synthesize(text: str, settings: Settings) -> AsyncIterator[bytes]:
+    """Stream the upstream audio for `text`, raising HTTPException on an error status"""
+    async with upstream.stream(
+        "POST",
+        settings.tts.url,
+        json=tts_payload(text, settings.tts),
+        headers={"Authorization": f"Bearer {settings.api_key}"},
+        timeout=upstream.audio_timeout
+    ) as response:
+        if response.status_code != 200:
+            body = await response.aread()
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"TTS service error: {response.status_code} - {body.decode()}"
+            )
+        async for chunk in response.aiter_bytes():
+            yield chunk
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def tee_to_cache(key: str, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Pass audio chunks through, writing them to the TTS cache entry `key` once they all arrived"""
+    if not AUDIO_CACHE_ENABLED:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk
+        return
+
+    writer = audio_cache.writer(key, AUDIO_CACHE_WRITE_BUFFER)
+    committed = False
+    try:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                await writer.write(chunk)
+                yield chunk
+        await writer.commit()
+        committed = True
+    finally:
+        # Interrupted or failed syntheses never become cache entries
+        if not committed:
+            writer.abort()
+
+
+async def synthesize_cached(text: str, settings: Settings) -> AsyncIterator[bytes]:
+    """Audio for `text` from the TTS cache, or synthesized and cached while it streams"""
+    key = audio_key(text, settings.tts)
+    path = await asyncio.to_thread(audio_cache.lookup, key) if AUDIO_CACHE_ENABLED else None
+    if path is not None:
+        yield await asyncio.to_thread(_read_file, path)
+        return
+    async for chunk in tee_to_cache(key, synthesize(text, settings)):
+        yield chunk
+
+
+_DONE = object()
+
+
+@dataclass
+class _Segment:
+    index: int
+    text: str
+    chunks: "asyncio.Queue" = field(default_factory=asyncio.Queue)
+    task: Optional[asyncio.Task] = None
+
+
+async def _as_async(sentences: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[str]:
+    if hasattr(sentences, "__aiter__"):
+        async for sentence in sentences:
+            yield sentence
+    else:
+        for sentence in sentences:
+            yield sentence
+
+
+async def synthesize_in_order(
+    sentences: Union[Iterable[str], AsyncIterable[str]],
+    settings: Settings,
+    window: int = PIPELINE_WINDOW,
+) -> AsyncIterator[Tuple[int, str, bytes]]:
+    """
+    Synthesize segments concurrently and yield (index, text, audio chunk) strictly
+    in segment order. At most `window` segments are in flight or buffered ahead
+    of the one being streamed, and the current segment streams live as its
+    audio arrives. `sentences` may be an async iterable that is still producing,
+    e.g. sentences cut from a chat stream.
+    """
+    slots = asyncio.Semaphore(max(1, window))
+    ordered: "asyncio.Queue" = asyncio.Queue()
+    segments: List[_Segment] = []
+
+    async def run(segment: _Segment) -> None:
+        try:
+            async for chunk in synthesize_cached(segment.text, settings):
+                segment.chunks.put_nowait(chunk)
+        except Exception as e:
+            segment.chunks.put_nowait(e)
+        finally:
+            segment.chunks.put_nowait(_DONE)
+
+    async def produce() -> None:
+        try:
+            index = 0
+            async for sentence in _as_async(sentences):
+                if not sentence.strip():
+                    continue
+                await slots.acquire()
+                segment = _Segment(index, sentence)
+                segment.task = asyncio.create_task(run(segment))
+                segments.append(segment)
+                ordered.put_nowait(segment)
+                index += 1
+        except Exception as e:
+            ordered.put_nowait(e)
+        finally:
+            ordered.put_nowait(_DONE)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            segment = await ordered.get()
+            if segment is _DONE:
+                break
+            if isinstance(segment, Exception):
+                raise segment
+            while True:
+                chunk = await segment.chunks.get()
+                if chunk is _DONE:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield segment.index, segment.text, chunk
+            metrics.incr("tts.pipeline.segments")
+            slots.release()
+    finally:
+        producer.cancel()
+        for segment in segments:
+            if segment.task is not None and not segment.task.done():
+                segment.task.cancel()
+
+
+def should_pipeline(text: str, requested: Optional[bool] = None) -> bool:
+    """Explicit request flag, otherwise pipeline long texts when the pipeline is enabled"""
+    if requested is not None:
+        return requested
+    return PIPELINE_ENABLED and len(text) >= PIPELINE_MIN_TEXT_CHARS
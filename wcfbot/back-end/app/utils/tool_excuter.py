@@ -1,55 +1,130 @@
 """
 Tool execution handler for Pawa AI chat system
 """
+import asyncio
+import functools
 import json
-from app.utils.tools import get_current_datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional, Tuple
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+from app.utils.tools import registry
+
+TOOL_CONFIG = get_settings().config.get("Tool_Runtime", {})
+
+DEFAULT_TIMEOUT = TOOL_CONFIG.get("Default_Timeout", 10)
+
+# Sync tools run here so they never block the event loop
+_tool_threads = ThreadPoolExecutor(max_workers=TOOL_CONFIG.get("Thread_Workers", 4), thread_name_prefix="tool")
+
+
+class ToolResultCache:
+    """Results of deterministic tools by name and arguments, least recently used evicted first"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tool_name: str, parameters: dict) -> str:
+        return f"{tool_name}:{json.dumps(parameters, sort_keys=True, default=str)}"
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, result = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key: str, result: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+tool_results_cache = ToolResultCache(TOOL_CONFIG.get("Cache_Max_Entries", 512))
+
+
+def parse_arguments(parameters) -> dict:
+    if isinstance(parameters, str):
+        try:
+            parameters = json.loads(parameters) if parameters else {}
+        except json.JSONDecodeError:
+            parameters = {}
+    return parameters if isinstance(parameters, dict) else {}
+
+
+async def _run_tool(spec, parameters: dict) -> Any:
+    if spec.is_async:
+        return await spec.function(**parameters)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_tool_threads, functools.partial(spec.function, **parameters))
 
-AVAILABLE_TOOLS = {
-    "get_current_datetime": get_current_datetime
-}
 
 async def execute_tool_call(tool_name: str, parameters: dict) -> dict:
     """Execute a tool call and return the result"""
-    if tool_name not in AVAILABLE_TOOLS:
+    spec = registry.get(tool_name)
+    if spec is None:
         return {"error": f"Tool '{tool_name}' not found"}
-    
+
+    parameters = parse_arguments(parameters)
+    cache_key = ToolResultCache.key(tool_name, parameters) if spec.cache_ttl else None
+    if cache_key is not None:
+        cached = tool_results_cache.get(cache_key)
+        if cached is not None:
+            metrics.incr(f"tools.{tool_name}.cache_hits")
+            return {"success": True, "result": cached}
+
+    timeout = spec.timeout if spec.timeout is not None else DEFAULT_TIMEOUT
+    started = time.perf_counter()
     try:
-        tool_function = AVAILABLE_TOOLS[tool_name]
-        
-        if isinstance(parameters, str):
-            try:
-                parameters = json.loads(parameters) if parameters else {}
-            except json.JSONDecodeError:
-                parameters = {}
-        elif not parameters:
-            parameters = {}
-            
-        result = tool_function(**parameters)
-        return {"success": True, "result": result}
+        # A timed-out sync tool keeps its worker thread until it returns, but
+        # the conversation no longer waits for it
+        result = await asyncio.wait_for(_run_tool(spec, parameters), timeout=timeout)
+    except asyncio.TimeoutError:
+        metrics.incr(f"tools.{tool_name}.timeouts")
+        return {"error": f"Tool '{tool_name}' timed out after {timeout}s"}
     except Exception as e:
+        metrics.incr(f"tools.{tool_name}.errors")
         return {"error": f"Error executing tool '{tool_name}': {str(e)}"}
+    finally:
+        metrics.observe(f"tools.{tool_name}.ms", (time.perf_counter() - started) * 1000)
+
+    if cache_key is not None and not (isinstance(result, dict) and "error" in result):
+        tool_results_cache.put(cache_key, result, spec.cache_ttl)
+    return {"success": True, "result": result}
+
 
 async def handle_tool_calls(tool_calls: list, complete_message: dict) -> dict:
-    """Handle tool calls and create a follow-up request"""
-    tool_results = []
-    
+    """Run the tool calls concurrently and append them and their results to the conversation"""
+    calls = []
     for i, tool_call in enumerate(tool_calls):
         tool_name = tool_call.get("function", {}).get("name")
         parameters = tool_call.get("function", {}).get("arguments", {})
-        
+
         tool_call_id = tool_call.get("id", f"call_{i}_{tool_name}")
-        
+
         tool_call["id"] = tool_call_id
-        
-        if isinstance(parameters, str):
-            try:
-                parameters = json.loads(parameters) if parameters else {}
-            except json.JSONDecodeError:
-                parameters = {}
-        
-        result = await execute_tool_call(tool_name, parameters)
-        
-        tool_results.append({
+        calls.append((tool_call_id, tool_name, parameters))
+
+    # Calls from one model turn are independent of each other
+    results = await asyncio.gather(*(
+        execute_tool_call(tool_name, parameters) for _, tool_name, parameters in calls
+    ))
+
+    tool_results = [
+        {
             "role": "tool",
             "tool_call_id": tool_call_id,
             "content": [
@@ -58,7 +133,9 @@ async def handle_tool_calls(tool_calls: list, complete_message: dict) -> dict:
                     "text": json.dumps(result)
                 }
             ]
-        })
+        }
+        for (tool_call_id, _, _), result in zip(calls, results)
+    ]
 
     complete_message["messages"].append({
         "role": "assistant",
@@ -73,4 +150,4 @@ async def handle_tool_calls(tool_calls: list, complete_message: dict) -> dict:
     
     complete_message["messages"].extend(tool_results)
     
-    return complete_message
\ No newline at end of file
+    return complete_message
@@ -0,0 +1,147 @@
+"""
+Registry of the function tools the model can call, with their JSON schemas
+generated from signatures and docstrings
+"""
+import inspect
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Union, get_args, get_origin, get_type_hints
+
+_JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+
+_ARG_LINE = re.compile(r"^\s*(\w+)\s*(?:\([^)]*\))?\s*:\s*(.+)$")
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    name: str
+    function: Callable[..., Any]
+    description: str
+    parameters: Dict[str, Any]
+    is_async: bool
+    # Seconds before the call is abandoned; None uses the runtime default
+    timeout: Optional[float] = None
+    # Seconds a result is reused for identical arguments; 0 disables caching
+    cache_ttl: float = 0
+
+    def schema(self) -> Dict[str, Any]:
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "strict": True,
+                "parameters": self.parameters,
+            },
+        }
+
+
+def _json_type(annotation: Any) -> Dict[str, Any]:
+    origin = get_origin(annotation)
+    if origin is Union:
+        # Optional[X] is described as X
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _json_type(args[0]) if len(args) == 1 else {}
+    if origin in (list, List):
+        args = get_args(annotation)
+        return {"type": "array", **({"items": _json_type(args[0])} if args else {})}
+    if annotation in _JSON_TYPES:
+        return {"type": _JSON_TYPES[annotation]}
+    return {}
+
+
+def _parse_docstring(doc: str) -> tuple:
+    """Summary paragraph and per-argument descriptions from a Google-style docstring"""
+    doc = inspect.cleandoc(doc or "")
+    summary, _, rest = doc.partition("\n\n")
+    arguments, in_args = {}, False
+    for line in rest.splitlines():
+        if line.strip() in ("Args:", "Arguments:", "Parameters:"):
+            in_args = True
+            continue
+        if in_args:
+            if line and not line.startswith(" "):
+                break
+            match = _ARG_LINE.match(line)
+            if match:
+                arguments[match.group(1)] = match.group(2).strip()
+    return " ".join(summary.split()), arguments
+
+
+def build_parameters(function: Callable[..., Any]) -> Dict[str, Any]:
+    """JSON schema of `function`'s keyword arguments; those without a default are required"""
+    hints = get_type_hints(function)
+    _, descriptions = _parse_docstring(function.__doc__)
+    properties, required = {}, []
+    for name, parameter in inspect.signature(function).parameters.items():
+        if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            continue
+        schema = _json_type(hints.get(name, Any))
+        if name in descriptions:
+            schema = {"description": descriptions[name], **schema}
+        properties[name] = schema
+        if parameter.default is parameter.empty:
+            required.append(name)
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": required,
+        "additionalProperties": False,
+    }
+
+
+class ToolRegistry:
+    """Tools registered with the `tool` decorator, in registration order"""
+
+    def __init__(self):
+        self._tools: Dict[str, ToolSpec] = {}
+
+    def tool(
+        self,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cache_ttl: float = 0,
+    ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """
+        Register a sync or async function as a tool. The schema comes from the
+        signature and type hints, the description from the docstring summary
+        and argument descriptions from its Args section. Set `cache_ttl` only on
+        deterministic tools, whose result depends on the arguments alone.
+        """
+        def register(function: Callable[..., Any]) -> Callable[..., Any]:
+            summary, _ = _parse_docstring(function.__doc__)
+            spec = ToolSpec(
+                name=name or function.__name__,
+                function=function,
+                description=description or summary,
+                parameters=build_parameters(function),
+                is_async=inspect.iscoroutinefunction(function),
+                timeout=timeout,
+                cache_ttl=cache_ttl,
+            )
+            if spec.name in self._tools:
+                raise ValueError(f"Tool '{spec.name}' is already registered")
+            self._tools[spec.name] = spec
+            return function
+        return register
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        return self._tools.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    def schemas(self) -> List[Dict[str, Any]]:
+        return [spec.schema() for spec in self._tools.values()]
+
+
+registry = ToolRegistry()
+tool = registry.tool
@@ -1,11 +1,14 @@
 from datetime import datetime
+from app.utils.tool_registry import registry, tool
 
+
+@tool()
 def get_current_datetime(date_format: str = "%Y-%m-%d %H:%M:%S") -> dict:
     """
-    Returns the current date and time in the specified format.
+    Returns the current date and time in a specified format.
     
     Args:
-        date_format (str): The format string for the date and time. Defaults to '%Y-%m-%d %H:%M:%S'.
+        date_format (str): The format string to use for formatting the current date and time. Default is '%Y-%m-%d %H:%M:%S'.
     
     Returns:
         dict: A dictionary containing the formatted datetime string.
@@ -21,4 +24,25 @@ def get_current_datetime(date_format: str = "%Y-%m-%d %H:%M:%S") -> dict:
         return {
             "error": f"Invalid date format: {str(e)}",
             "iso_datetime": now.isoformat()
-        }
\ No newline at end of file
+        }
+
+
+@tool(cache_ttl=3600)
+def convert_usd_to_tsh(amount_usd: float) -> dict:
+    """
+    Converts an amount in USD to Tanzanian Shillings.
+
+    Args:
+        amount_usd (float): Amount in USD
+
+    Returns:
+        dict: The amount in TSH and the exchange rate used.
+    """
+    # Imported here: settings import this module while they are being built
+    from app.utils.settings import get_settings
+    rate = float(get_settings().config.get("Tool_Runtime", {}).get("USD_TSH_Rate", 2500))
+    return {
+        "amount_usd": amount_usd,
+        "amount_tsh": round(amount_usd * rate, 2),
+        "rate": rate
+    }
@@ -0,0 +1,254 @@
+"""
+Long-audio speech-to-text: silence-based segmentation, concurrent transcription
+of the segments and stitching of their transcripts
+"""
+import asyncio
+import io
+import re
+import wave
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional
+import httpx
+import numpy as np
+from app.utils.http_client import upstream
+from app.utils.metrics import metrics
+from app.utils.settings import get_settings
+
+LONG_AUDIO_CONFIG = get_settings().config.get("STT_Long_Audio", {})
+
+FRAME_MS = LONG_AUDIO_CONFIG.get("Frame_MS", 30)
+MIN_SILENCE_MS = LONG_AUDIO_CONFIG.get("Min_Silence_MS", 300)
+SILENCE_DB = LONG_AUDIO_CONFIG.get("Silence_DB_Below_Peak", 35)
+TARGET_SEGMENT_S = LONG_AUDIO_CONFIG.get("Target_Segment_Seconds", 30)
+MAX_SEGMENT_S = LONG_AUDIO_CONFIG.get("Max_Segment_Seconds", 55)
+OVERLAP_MS = LONG_AUDIO_CONFIG.get("Overlap_MS", 500)
+MAX_CONCURRENCY = LONG_AUDIO_CONFIG.get("Max_Concurrency", 4)
+SEGMENT_TIMEOUT = LONG_AUDIO_CONFIG.get("Segment_Timeout", 60)
+SEGMENT_RETRIES = LONG_AUDIO_CONFIG.get("Segment_Retries", 1)
+
+_stt_slots = asyncio.Semaphore(MAX_CONCURRENCY)
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class UnsupportedAudio(ValueError):
+    pass
+
+
+@dataclass
+class PCMAudio:
+    """Decoded PCM: float32 samples in [-1, 1], shape (frames, channels)"""
+    samples: np.ndarray
+    sample_rate: int
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sample_rate
+
+
+@dataclass
+class AudioSegment:
+    index: int
+    start: float
+    end: float
+    wav: bytes
+
+
+def decode_wav(source: BinaryIO) -> PCMAudio:
+    """Decode 8/16/24/32-bit integer PCM WAV with vectorized NumPy"""
+    try:
+        with wave.open(source, "rb") as reader:
+            channels = reader.getnchannels()
+            width = reader.getsampwidth()
+            sample_rate = reader.getframerate()
+            raw = reader.readframes(reader.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise UnsupportedAudio(f"Not a PCM WAV file: {e}")
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        bytes3 = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        ints = (bytes3[:, 0].astype(np.int32) | (bytes3[:, 1].astype(np.int32) << 8) | (bytes3[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / float(1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / float(1 << 31)
+    else:
+        raise UnsupportedAudio(f"Unsupported sample width: {width} bytes")
+    return PCMAudio(samples.reshape(-1, channels), sample_rate)
+
+
+def wav_duration(source: BinaryIO) -> Optional[float]:
+    """Duration from the WAV header alone, or None if `source` is not a WAV file"""
+    try:
+        with wave.open(source, "rb") as reader:
+            return reader.getnframes() / reader.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return None
+    finally:
+        source.seek(0)
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    """16-bit PCM WAV bytes for float32 samples of shape (frames,) or (frames, channels)"""
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as writer:
+        writer.setnchannels(samples.shape[1])
+        writer.setsampwidth(2)
+        writer.setframerate(sample_rate)
+        writer.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def frame_energy_db(audio: PCMAudio, frame_ms: int = FRAME_MS) -> np.ndarray:
+    """RMS energy in dB of consecutive `frame_ms` frames, averaged over channels"""
+    frame = max(1, int(audio.sample_rate * frame_ms / 1000))
+    mono = audio.samples.mean(axis=1)
+    count = len(mono) // frame
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = mono[:count * frame].reshape(count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-10))
+
+
+def silence_midpoints(
+    audio: PCMAudio,
+    frame_ms: int = FRAME_MS,
+    min_silence_ms: int = MIN_SILENCE_MS,
+    db_below_peak: float = SILENCE_DB,
+) -> np.ndarray:
+    """Times (seconds) at the middle of every run of silence at least `min_silence_ms` long"""
+    energy = frame_energy_db(audio, frame_ms)
+    if len(energy) == 0:
+        return np.zeros(0)
+    silent = energy < (np.percentile(energy, 99) - db_below_peak)
+    # Run boundaries from the diff of the padded mask
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    long_enough = (ends - starts) * frame_ms >= min_silence_ms
+    return (starts[long_enough] + ends[long_enough]) / 2.0 * frame_ms / 1000.0
+
+
+def plan_cuts(duration: float, silences: np.ndarray, target: float = TARGET_SEGMENT_S, maximum: float = MAX_SEGMENT_S) -> List[float]:
+    """
+    Cut points (seconds): from each segment start, the silence closest to
+    `target` seconds later without exceeding `maximum`, or a hard cut at
+    `maximum` when there is no silence in range.
+    """
+    cuts, start = [], 0.0
+    while duration - start > maximum:
+        candidates = silences[(silences > start + target / 3) & (silences <= start + maximum)]
+        if len(candidates):
+            cut = float(candidates[np.argmin(np.abs(candidates - (start + target)))])
+        else:
+            cut = start + maximum
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def split_audio(audio: PCMAudio, overlap_ms: int = OVERLAP_MS) -> List[AudioSegment]:
+    """Split at silences into WAV segments extended by `overlap_ms` on each side"""
+    cuts = plan_cuts(audio.duration, silence_midpoints(audio))
+    bounds = [0.0] + cuts + [audio.duration]
+    overlap = overlap_ms / 1000.0
+    segments = []
+    for index, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        padded_start = max(0.0, start - overlap)
+        padded_end = min(audio.duration, end + overlap)
+        samples = audio.samples[int(padded_start * audio.sample_rate):int(padded_end * audio.sample_rate)]
+        segments.append(AudioSegment(index, round(start, 3), round(end, 3), encode_wav(samples, audio.sample_rate)))
+    return segments
+
+
+def _normalized_words(text: str) -> List[str]:
+    return [word.lower() for word in _WORD.findall(text)]
+
+
+def stitch(previous: str, following: str, max_overlap_words: int = 12) -> str:
+    """
+    Append `following` to `previous`, dropping the words at its start that
+    repeat the end of `previous` because the segments' audio overlapped.
+    """
+    if not previous:
+        return following.strip()
+    words = following.split()
+    tail = _normalized_words(" ".join(previous.split()[-max_overlap_words:]))
+    for size in range(min(max_overlap_words, len(words)), 0, -1):
+        head = _normalized_words(" ".join(words[:size]))
+        if head and len(head) <= len(tail) and tail[-len(head):] == head:
+            words = words[size:]
+            break
+    rest = " ".join(words)
+    return f"{previous.rstrip()} {rest}".strip() if rest else previous
+
+
+def transcript_text(response_json) -> str:
+    """Transcript text from an STT response, whichever envelope it uses"""
+    if isinstance(response_json, str):
+        return response_json
+    if isinstance(response_json, dict):
+        for key in ("text", "transcription", "transcript"):
+            if isinstance(response_json.get(key), str):
+                return response_json[key]
+        data = response_json.get("data")
+        if data is not None:
+            return transcript_text(data)
+    if isinstance(response_json, list) and response_json:
+        return " ".join(transcript_text(item) for item in response_json)
+    return ""
+
+
+async def transcribe_segment(segment: AudioSegment, form: Dict[str, str], filename: str) -> dict:
+    """Transcribe one segment, under the concurrency cap, with a per-segment timeout and retry"""
+    settings = get_settings()
+    files = {key: (None, value) for key, value in form.items()}
+    files["file"] = (f"{filename}.part{segment.index}.wav", segment.wav, "audio/wav")
+    error = None
+    for attempt in range(SEGMENT_RETRIES + 1):
+        try:
+            async with _stt_slots:
+                response = await asyncio.wait_for(
+                    upstream.post(settings.stt_url, files=files, headers={"Authorization": f"Bearer {settings.api_key}"}),
+                    timeout=SEGMENT_TIMEOUT,
+                )
+            response.raise_for_status()
+            return {"segment": segment.index, "start": segment.start, "end": segment.end, "text": transcript_text(response.json()).strip()}
+        except (asyncio.TimeoutError, httpx.TransportError) as e:
+            error = f"{type(e).__name__}: {e}"
+        except httpx.HTTPStatusError as e:
+            error = f"STT service returned {e.response.status_code}"
+            if e.response.status_code < 500:
+                break
+    metrics.incr("stt.segment_errors")
+    return {"segment": segment.index, "start": segment.start, "end": segment.end, "text": "", "error": error}
+
+
+async def transcribe_long(audio: PCMAudio, form: Dict[str, str], filename: str) -> AsyncIterator[dict]:
+    """
+    Split `audio`, transcribe the segments concurrently and yield each segment's
+    result in order as soon as it and all earlier ones are done, then a final
+    result with the stitched transcript.
+    """
+    segments = await asyncio.to_thread(split_audio, audio)
+    metrics.observe("stt.long_audio.segments", len(segments))
+    tasks = [asyncio.create_task(transcribe_segment(segment, form, filename)) for segment in segments]
+    text, errors = "", []
+    try:
+        for task in tasks:
+            result = await task
+            if "error" in result:
+                errors.append({"segment": result["segment"], "detail": result["error"]})
+            text = stitch(text, result["text"])
+            yield {"type": "partial", **result}
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield {"type": "final", "text": text, "duration": round(audio.duration, 3), "segments": len(segments), "errors": errors}
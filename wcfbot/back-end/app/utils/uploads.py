@@ -0,0 +1,142 @@
+"""
+Chunked, size-limited spooling of uploaded files
+"""
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from tempfile import SpooledTemporaryFile
+from typing import Iterable, List, Optional, Union
+from fastapi import HTTPException, UploadFile, status
+from app.utils.settings import get_settings
+
+UPLOADS_CONFIG = get_settings().config.get("Uploads", {})
+
+CHUNK_SIZE = int(UPLOADS_CONFIG.get("Chunk_Size_KB", 64) * 1024)
+SPOOL_THRESHOLD = int(UPLOADS_CONFIG.get("Spool_Threshold_KB", 1024) * 1024)
+MAX_FILE_BYTES = int(UPLOADS_CONFIG.get("Max_File_MB", 5) * 1024 * 1024)
+MAX_AUDIO_BYTES = int(UPLOADS_CONFIG.get("Max_Audio_MB", 25) * 1024 * 1024)
+
+
+@dataclass
+class SpooledUpload:
+    """
+    An upload copied into a temporary file we own: kept in memory up to the
+    spool threshold and on disk above it, so it outlives the request form and
+    never has to be held in RAM as a whole.
+    """
+    filename: Optional[str]
+    content_type: Optional[str]
+    size: int
+    sha256: str
+    file: SpooledTemporaryFile
+
+    @property
+    def in_memory(self) -> bool:
+        return self.size <= SPOOL_THRESHOLD
+
+    def body(self) -> Union[bytes, SpooledTemporaryFile]:
+        """
+        Upload body for an httpx multipart field: small files as bytes, larger
+        ones as the on-disk file object, which httpx streams in chunks.
+        """
+        self.file.seek(0)
+        if self.in_memory:
+            return self.file.read()
+        return self.file
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _too_large(upload: UploadFile, max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File {upload.filename} is too large. Maximum size is {max_bytes // (1024 * 1024)}MB."
+    )
+
+
+def _hash_file(file: SpooledTemporaryFile) -> str:
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+async def _adopt_upload(upload: UploadFile) -> SpooledUpload:
+    """
+    Take over the temporary file Starlette already spooled the upload into,
+    instead of copying it again. The form closes its files when the endpoint
+    returns, before a streaming response has read them, so the upload is left
+    with an empty stand-in.
+    """
+    file = upload.file
+    sha256 = await asyncio.to_thread(_hash_file, file)
+    upload.file = SpooledTemporaryFile(max_size=0)
+    return SpooledUpload(
+        filename=upload.filename,
+        content_type=upload.content_type,
+        size=upload.size,
+        sha256=sha256,
+        file=file,
+    )
+
+
+async def spool_upload(upload: UploadFile, max_bytes: int = MAX_FILE_BYTES) -> SpooledUpload:
+    """
+    Copy an upload chunk by chunk into a SpooledUpload, hashing it on the way and
+    rejecting it as soon as it grows past `max_bytes`. Uploads over the spool
+    threshold are already in a temporary file of Starlette's, which is reused.
+    """
+    if upload.size is not None:
+        if upload.size > max_bytes:
+            raise _too_large(upload, max_bytes)
+        if upload.size > SPOOL_THRESHOLD and isinstance(upload.file, SpooledTemporaryFile):
+            return await _adopt_upload(upload)
+
+    spool = SpooledTemporaryFile(max_size=SPOOL_THRESHOLD)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        await upload.seek(0)
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large(upload, max_bytes)
+            digest.update(chunk)
+            if size > SPOOL_THRESHOLD:
+                await asyncio.to_thread(spool.write, chunk)
+            else:
+                spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return SpooledUpload(
+        filename=upload.filename,
+        content_type=upload.content_type,
+        size=size,
+        sha256=digest.hexdigest(),
+        file=spool,
+    )
+
+
+async def spool_uploads(uploads: Iterable[UploadFile], max_bytes: int = MAX_FILE_BYTES) -> List[SpooledUpload]:
+    spooled: List[SpooledUpload] = []
+    try:
+        for upload in uploads:
+            spooled.append(await spool_upload(upload, max_bytes))
+    except BaseException:
+        close_uploads(spooled)
+        raise
+    return spooled
+
+
+def close_uploads(uploads: Optional[Iterable[SpooledUpload]]) -> None:
+    for upload in uploads or []:
+        upload.close()
@@ -0,0 +1,74 @@
+"""
+Benchmark: memory retrieval latency and memoryChat size against history length.
+
+Run from the back-end directory:
+
+    python -m benchmarks.bench_memory_retrieval
+"""
+import json
+import random
+import time
+from app.utils.conversation_store import Turn, turns_to_memory
+from app.utils.memory_retrieval import HashedNgramVectorizer, SessionIndex
+
+HISTORY_LENGTHS = [100, 1_000, 5_000, 20_000]
+QUERIES = 200
+TOP_K = 3
+RECENT_TURNS = 4
+
+TOPICS = [
+    "fidia ya ajali kazini",
+    "usajili wa mwajiri",
+    "michango ya kila mwezi",
+    "fomu ya madai ya fidia",
+    "ugonjwa unaotokana na kazi",
+    "malipo ya pensheni kwa wategemezi",
+    "ukaguzi wa mahali pa kazi",
+    "rufaa dhidi ya uamuzi wa WCF",
+]
+
+
+def make_turn(i: int, rng: random.Random) -> Turn:
+    topic = rng.choice(TOPICS)
+    return Turn(
+        id=i,
+        session_id="bench",
+        user=f"Naomba maelezo kuhusu {topic}, swali namba {i}.",
+        assistant=f"Kuhusu {topic}: tafadhali wasilisha nyaraka husika kwa ofisi ya WCF iliyo karibu. ({i})",
+        created_at=0.0,
+    )
+
+
+def main() -> None:
+    rng = random.Random(2024)
+    vectorizer = HashedNgramVectorizer()
+    print(f"{'history':>8} {'search p50 ms':>14} {'search p99 ms':>14} {'all turns KB':>13} {'retrieved KB':>13}")
+
+    for length in HISTORY_LENGTHS:
+        index = SessionIndex(vectorizer.dim, max_turns=length + 1)
+        turns = []
+        for i in range(length):
+            turn = make_turn(i, rng)
+            turns.append(turn)
+            index.add(turn, vectorizer.transform(f"{turn.user}\n{turn.assistant}"))
+
+        timings = []
+        selected = []
+        for _ in range(QUERIES):
+            query = f"nitapataje {rng.choice(TOPICS)}?"
+            start = time.perf_counter()
+            relevant = index.search(vectorizer.transform(query), TOP_K, RECENT_TURNS, 0.2)
+            timings.append((time.perf_counter() - start) * 1000)
+            selected = relevant + turns[-RECENT_TURNS:]
+
+        timings.sort()
+        all_kb = len(json.dumps(turns_to_memory(turns), ensure_ascii=False).encode()) / 1024
+        retrieved_kb = len(json.dumps(turns_to_memory(selected), ensure_ascii=False).encode()) / 1024
+        print(
+            f"{length:>8} {timings[len(timings) // 2]:>14.3f} {timings[int(len(timings) * 0.99)]:>14.3f} "
+            f"{all_kb:>13.1f} {retrieved_kb:>13.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
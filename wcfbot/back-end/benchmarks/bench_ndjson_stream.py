@@ -0,0 +1,97 @@
+"""
+Benchmark: decoding of upstream chat streams and frames written to the client.
+
+Decoding compares the previous per-line json.loads with NDJSONDecoder fed
+network-sized chunks (orjson when installed). Framing replays a token stream
+with realistic inter-token gaps with and without delta coalescing.
+
+Run from the back-end directory:
+
+    python -m benchmarks.bench_ndjson_stream
+"""
+import asyncio
+import json
+import random
+import time
+from app.utils import ndjson
+from app.utils.ndjson import NDJSONDecoder, coalesce
+
+LINES = 50_000
+TOKENS = 600
+WORDS = ["fidia", "ya", "ajali", "kazini", "mwajiri", "anapaswa", "kuwasilisha", "fomu", "WCF", "ndani", "siku", "saba", "."]
+
+
+def make_stream(rng: random.Random) -> bytes:
+    lines = []
+    for _ in range(LINES):
+        content = " " + rng.choice(WORDS)
+        lines.append(json.dumps({
+            "data": {"request": [{"finish_reason": None, "message": {"role": "assistant", "content": content}}]}
+        }))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def network_chunks(data: bytes, rng: random.Random):
+    position = 0
+    while position < len(data):
+        size = rng.randint(64, 4096)
+        yield data[position:position + size]
+        position += size
+
+
+def bench_decode(data: bytes, chunks) -> None:
+    start = time.perf_counter()
+    count = 0
+    for line in data.decode("utf-8").splitlines():
+        if line.strip():
+            json.loads(line.strip())
+            count += 1
+    baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoder = NDJSONDecoder("bench")
+    decoded = 0
+    for chunk in chunks:
+        decoded += len(decoder.feed(chunk))
+    decoded += len(decoder.flush())
+    incremental = time.perf_counter() - start
+
+    assert decoded == count == LINES
+    codec = "orjson" if ndjson.orjson is not None else "json"
+    print(f"{'decoder':>26} {'lines/sec':>12}")
+    print(f"{'json.loads per line':>26} {LINES / baseline:>12,.0f}")
+    print(f"{'NDJSONDecoder (' + codec + ')':>26} {LINES / incremental:>12,.0f}")
+
+
+async def token_stream(rng: random.Random):
+    # Bursty generation: most tokens a few ms apart, occasional longer pauses
+    for _ in range(TOKENS):
+        await asyncio.sleep(rng.choice([0.001, 0.002, 0.004, 0.004, 0.008, 0.03]))
+        yield " " + rng.choice(WORDS)
+
+
+async def bench_frames() -> None:
+    print(f"\n{'window ms':>10} {'frames':>8} {'bytes/frame':>12} {'first frame ms':>15} {'total ms':>9}")
+    for window in (0, 10, 25, 50):
+        rng = random.Random(2024)
+        deltas = token_stream(rng) if window == 0 else coalesce(token_stream(rng), window_ms=window)
+        start = time.perf_counter()
+        first, frames, size = None, 0, 0
+        async for delta in deltas:
+            if first is None:
+                first = time.perf_counter() - start
+            frames += 1
+            size += len(ndjson.dumps_line({"message": {"role": "assistant", "content": delta}}))
+        total = time.perf_counter() - start
+        print(f"{window:>10} {frames:>8} {size / frames:>12.0f} {first * 1000:>15.1f} {total * 1000:>9.0f}")
+
+
+def main() -> None:
+    rng = random.Random(2024)
+    data = make_stream(rng)
+    bench_decode(data, list(network_chunks(data, rng)))
+    asyncio.run(bench_frames())
+
+
+if __name__ == "__main__":
+    main()
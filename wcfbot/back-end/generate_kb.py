@@ -1,68 +1,306 @@
+"""
+Incremental knowledge-base sync.
+
+Hashes every document in STORE.FOLDER_PATH, compares the hashes with a local
+manifest and uploads only new or changed files, in batches sent a few at a time
+with retry. The first batch creates the knowledge base and prints its
+kbReferenceId, unless KB_REFERENCE_ID already names one; later batches and
+later runs add documents to it. The manifest tracks each folder separately,
+so syncing one folder leaves the record of another untouched.
+
+The tool only ever adds documents. A changed file is uploaded as a new document
+and its previous version, like a file deleted locally, stays in the knowledge
+base until it is removed there.
+
+    python generate_kb.py [--folder DIR] [--force] [--dry-run]
+"""
 import os
 import json
-import httpx
-import base64
-import json
+import time
 import httpx
 import asyncio
-from fastapi import HTTPException, status
-import yaml
+import argparse
+import hashlib
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from app.utils.http_client import upstream
+from app.utils.settings import get_settings
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
 
-with open("app/engine/config.yaml", "r") as file:
-    config = yaml.safe_load(file)
+settings = get_settings()
+FOLDER_PATH = settings.store.folder_path
+KB_NAME = settings.store.name
+KB_DESCRIPTION = settings.store.description
+url = settings.store.url
+
+SYNC_CONFIG = settings.config["STORE"].get("Sync", {})
+MANIFEST_PATH = SYNC_CONFIG.get("Manifest_Path", "app/engine/kb_manifest.json")
+DOCUMENTS_URL = f"{settings.config['STORE']['Base_URL']}{SYNC_CONFIG.get('Documents_Endpoint', '/v1/store/knowledge-base/documents')}"
+BATCH_SIZE = SYNC_CONFIG.get("Batch_Size", 20)
+BATCH_MAX_BYTES = int(SYNC_CONFIG.get("Batch_Max_MB", 50) * 1024 * 1024)
+MAX_CONCURRENCY = SYNC_CONFIG.get("Max_Concurrency", 4)
+MAX_RETRIES = SYNC_CONFIG.get("Max_Retries", 3)
+RETRY_BACKOFF = SYNC_CONFIG.get("Retry_Backoff", 2.0)
+HASH_CHUNK_SIZE = 1024 * 1024
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UploadError(Exception):
+    pass
+
 
-BASE_UL = config["STORE"]["Base_URL"]
-ENDPOINT = config["STORE"]["Endpoint"]
-FOLDER_PATH = config["STORE"]["FOLDER_PATH"]
-KB_NAME = config["STORE"]["Name"]
-KB_DESCRIPTION = config["STORE"]["Description"]
-url = f"{BASE_UL}{ENDPOINT}"
+@dataclass
+class Document:
+    path: str
+    name: str
+    size: int
+    mtime: float
+    sha256: str
 
-async def send_documents():
-    files_to_upload = []
 
-    for filename in os.listdir(FOLDER_PATH):
-        filepath = os.path.join(FOLDER_PATH, filename)
-        if os.path.isfile(filepath):
-            files_to_upload.append(("knowledgeBase", (filename, open(filepath, "rb"))))
+def folder_key(folder: str) -> str:
+    return os.path.realpath(folder)
 
-    data = {
-        "name": KB_NAME,
-        "description": KB_DESCRIPTION,
-    }
 
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """
+    The knowledge base and, per resolved folder path, the files uploaded from
+    it. A manifest from before folders were tracked is taken to describe
+    STORE.FOLDER_PATH.
+    """
     try:
-        async with httpx.AsyncClient(timeout=300) as client:
-            response = await client.post(url=url, 
-                                         headers={
-                                             "accept": "application/json",
-                                             "Authorization": f"Bearer {os.getenv('PAWA_AI_API_KEY')}"}, 
-                                         data=data, 
-                                         files=files_to_upload)
-            
-    except httpx.RequestError:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Failed to connect to the Pawa AI backend."
-        )
-        
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"kbReferenceId": None, "folders": {}}
+    manifest.setdefault("kbReferenceId", None)
+    manifest.setdefault("folders", {})
+    legacy = manifest.pop("files", None)
+    if legacy:
+        manifest["folders"].setdefault(folder_key(FOLDER_PATH), legacy)
+    return manifest
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_folder(folder: str, known: Dict[str, dict], force: bool = False) -> List[Document]:
+    """
+    Every file in `folder`. Files whose size and mtime match the manifest reuse
+    the recorded hash, so an unchanged folder is scanned without reading it.
+    """
+    documents = []
+    for filename in sorted(os.listdir(folder)):
+        filepath = os.path.join(folder, filename)
+        if not os.path.isfile(filepath):
+            continue
+        stat = os.stat(filepath)
+        entry = known.get(filename)
+        if not force and entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            sha256 = entry["sha256"]
+        else:
+            sha256 = hash_file(filepath)
+        documents.append(Document(filepath, filename, stat.st_size, stat.st_mtime, sha256))
+    return documents
+
+
+def make_batches(documents: List[Document]) -> List[List[Document]]:
+    """Split documents into batches of at most BATCH_SIZE files and BATCH_MAX_BYTES"""
+    batches, batch, batch_bytes = [], [], 0
+    for document in documents:
+        if batch and (len(batch) >= BATCH_SIZE or batch_bytes + document.size > BATCH_MAX_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(document)
+        batch_bytes += document.size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def find_kb_reference_id(payload) -> Optional[str]:
+    """The kbReferenceId anywhere in a store response"""
+    if isinstance(payload, dict):
+        if payload.get("kbReferenceId"):
+            return payload["kbReferenceId"]
+        payload = list(payload.values())
+    if isinstance(payload, list):
+        for item in payload:
+            found = find_kb_reference_id(item)
+            if found:
+                return found
+    return None
+
+
+async def upload_batch(batch: List[Document], kb_reference_id: Optional[str]) -> dict:
+    """
+    POST one batch, opening its files only for the duration of the request so
+    httpx streams them from disk. Without a kbReferenceId the batch creates the
+    knowledge base. Connection errors and retryable statuses are retried with
+    exponential backoff.
+    """
+    if kb_reference_id is None:
+        target = url
+        data = {"name": KB_NAME, "description": KB_DESCRIPTION}
+    else:
+        target = DOCUMENTS_URL
+        data = {"kbReferenceId": kb_reference_id}
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with ExitStack() as stack:
+                files = [
+                    ("knowledgeBase", (document.name, stack.enter_context(open(document.path, "rb"))))
+                    for document in batch
+                ]
+                response = await upstream.post(
+                    target,
+                    headers={
+                        "accept": "application/json",
+                        "Authorization": f"Bearer {settings.api_key}"},
+                    data=data,
+                    files=files)
+        except httpx.RequestError as e:
+            error = f"Failed to connect to the Pawa AI backend: {e}"
+        else:
+            if response.status_code == 200:
+                try:
+                    return response.json()
+                except ValueError:
+                    raise UploadError("Invalid JSON returned from Pawa AI")
+            error = f"{response.status_code}: {response.text[:200]}"
+            if response.status_code not in RETRYABLE_STATUS:
+                raise UploadError(error)
+
+        if attempt < MAX_RETRIES:
+            delay = RETRY_BACKOFF ** attempt
+            print(f"Batch upload failed ({error}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    raise UploadError(error)
+
+
+def record_batch(files: Dict[str, dict], batch: List[Document], elapsed: float) -> int:
+    """Record an uploaded batch in the folder's manifest entries; returns its size in bytes"""
+    batch_bytes = sum(document.size for document in batch)
+    throughput = batch_bytes / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+    for document in batch:
+        files[document.name] = {
+            "sha256": document.sha256,
+            "size": document.size,
+            "mtime": document.mtime,
+            "uploaded_at": time.time(),
+        }
+        print(f"  uploaded {document.name}: {document.size / 1024:.1f} KB in batch of {len(batch)}, {elapsed:.2f}s, {throughput:.2f} MB/s")
+    return batch_bytes
+
+
+async def send_documents(folder: str = FOLDER_PATH, force: bool = False, dry_run: bool = False):
+    started = time.perf_counter()
+    manifest = load_manifest()
+    if manifest["kbReferenceId"] is None and settings.chat.kb_reference_id:
+        # The knowledge base the chat already uses; add to it instead of creating another
+        manifest["kbReferenceId"] = settings.chat.kb_reference_id
+        print(f"Using the configured knowledge base, kbReferenceId: {manifest['kbReferenceId']}")
+    files = manifest["folders"].setdefault(folder_key(folder), {})
+    documents = await asyncio.to_thread(scan_folder, folder, files, force)
+
+    changed = [
+        document for document in documents
+        if force or files.get(document.name, {}).get("sha256") != document.sha256
+    ]
+    removed = set(files) - {document.name for document in documents}
+    replaced = [document.name for document in changed if document.name in files]
+    print(f"Scanned {len(documents)} files in {time.perf_counter() - started:.2f}s: "
+          f"{len(changed) - len(replaced)} new, {len(replaced)} changed, {len(removed)} removed locally")
+    for name in sorted(removed):
+        print(f"  {name} is no longer in {folder}; it stays in the knowledge base until removed there")
+        del files[name]
+    for name in replaced:
+        print(f"  {name} changed; the new version is added and the previous one stays in the knowledge base until removed there")
+    if dry_run:
+        for document in changed:
+            print(f"  would upload {document.name} ({document.size / 1024:.1f} KB)")
+
+    if dry_run or not changed:
+        if not dry_run:
+            save_manifest(manifest)
+        print("Nothing to upload" if not changed else "Dry run, nothing uploaded")
+        return manifest
+
+    batches = make_batches(changed)
+    uploaded = failed = uploaded_bytes = 0
     try:
-        response_json = response.json()
-    except ValueError:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="Invalid JSON returned from Pawa AI"
-        )
-
-    if response.status_code != 200:
-        raise HTTPException(
-            status_code=response.status_code,
-            detail=response_json.get("detail", "An error occurred")
-        )
-    print("Documents uploaded successfully:", response_json)
-    
+        if manifest["kbReferenceId"] is None:
+            # The first batch creates the knowledge base the others are added to
+            first = batches.pop(0)
+            batch_started = time.perf_counter()
+            try:
+                response_json = await upload_batch(first, None)
+                manifest["kbReferenceId"] = find_kb_reference_id(response_json)
+                if manifest["kbReferenceId"] is None:
+                    raise UploadError(f"No kbReferenceId in response: {response_json}")
+            except UploadError as e:
+                # Without a knowledge base the remaining batches have nowhere to go
+                failed += len(first) + sum(len(batch) for batch in batches)
+                batches = []
+                print(f"Creating the knowledge base failed: {e}")
+            else:
+                uploaded_bytes += record_batch(files, first, time.perf_counter() - batch_started)
+                save_manifest(manifest)
+                uploaded += len(first)
+                print(f"Created knowledge base, kbReferenceId: {manifest['kbReferenceId']}")
+
+        slots = asyncio.Semaphore(MAX_CONCURRENCY)
+
+        async def run(batch: List[Document]):
+            async with slots:
+                batch_started = time.perf_counter()
+                try:
+                    await upload_batch(batch, manifest["kbReferenceId"])
+                except UploadError as e:
+                    return batch, None, e
+                return batch, time.perf_counter() - batch_started, None
+
+        for finished in asyncio.as_completed([run(batch) for batch in batches]):
+            batch, elapsed, error = await finished
+            if error is not None:
+                failed += len(batch)
+                print(f"Batch of {len(batch)} files failed: {error}")
+                continue
+            uploaded_bytes += record_batch(files, batch, elapsed)
+            uploaded += len(batch)
+            # Saved after every batch so an interrupted sync resumes where it stopped
+            save_manifest(manifest)
+        save_manifest(manifest)
+    finally:
+        await upstream.aclose()
+
+    elapsed = time.perf_counter() - started
+    print(f"Uploaded {uploaded} files ({uploaded_bytes / (1024 * 1024):.1f} MB) in {elapsed:.2f}s, {failed} failed")
+    print(f"kbReferenceId: {manifest['kbReferenceId']}")
+    return manifest
+
+
 if __name__ == "__main__":
-    asyncio.run(send_documents())
+    parser = argparse.ArgumentParser(description="Sync the documents folder to the Pawa AI knowledge base")
+    parser.add_argument("--folder", default=FOLDER_PATH, help="Documents folder (default: STORE.FOLDER_PATH)")
+    parser.add_argument("--force", action="store_true", help="Re-hash and re-upload every file")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be uploaded")
+    args = parser.parse_args()
+    asyncio.run(send_documents(args.folder, force=args.force, dry_run=args.dry_run))
@@ -1,5 +1,6 @@
 import os
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
@@ -7,13 +8,38 @@ from fastapi.exceptions import RequestValidationError as ValidationError
 import uvicorn
 from app.api.routers.chat import chat_router
 from app.api.routers.audio import audio_router
+from app.api.routers.metrics import metrics_router
+from app.api.middleware import UploadLimitMiddleware
+from app.utils.http_client import upstream
+from app.utils.conversation_store import conversation_store
+from app.utils.memory_writer import memory_writer
+from app.utils.semantic_cache import semantic_cache
+from app.utils import audio_normalize
+from app.utils.settings import get_settings
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
 logger = logging.getLogger("uvicorn")
 logger.info("Running Pawa API BP Server For WCF")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = get_settings()
+    upstream.start([
+        settings.tts.url,
+        settings.stt_url,
+        settings.chat.url,
+        settings.extraction_url,
+    ])
+    await memory_writer.start()
+    yield
+    await memory_writer.stop()
+    await upstream.aclose()
+    conversation_store.close()
+    await semantic_cache.close()
+    audio_normalize.shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
 @app.exception_handler(ValidationError)
 async def validation_exception_handler(request: Request, exc: ValidationError):
     errors = [{"field": err['loc'][0], "message": err['msg']} for err in exc.errors()]
@@ -22,6 +48,14 @@ async def validation_exception_handler(request: Request, exc: ValidationError):
         content={"details": errors},
     )
     
+# Added before CORS so that CORS wraps it and its 413 responses carry CORS headers
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        prefix: int(size_mb * 1024 * 1024)
+        for prefix, size_mb in get_settings().config.get("Uploads", {}).get("Max_Request_MB", {}).items()
+    })
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -35,6 +69,7 @@ async def redirect_to_docs():
 
 app.include_router(chat_router, prefix="/v1/chat")
 app.include_router(audio_router, prefix="/v1/audio")
+app.include_router(metrics_router, prefix="/v1/metrics")
 
 if __name__ == "__main__":
     app_host = os.getenv("APP_HOST", "0.0.0.0")
@@ -0,0 +1,365 @@
+"""
+Document preprocessing before knowledge-base upload.
+
+Normalizes the text documents in STORE.FOLDER_PATH, splits them into
+overlapping word chunks, drops near-duplicate chunks found with MinHash/LSH and
+writes the deduplicated corpus plus a stats report. The documents written hold
+each kept word once; the overlap only serves the near-duplicate matching. Parsing, chunking and
+MinHash signatures run in a process pool; LSH bucketing runs in the parent in
+a fixed order, so the output is the same on every run.
+
+    python preprocess_kb.py [--folder DIR] [--output DIR] [--workers N]
+    python generate_kb.py --folder <output>/documents
+"""
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import argparse
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.utils.settings import get_settings
+
+settings = get_settings()
+PREPROCESS_CONFIG = settings.config["STORE"].get("Preprocess", {})
+
+FOLDER_PATH = settings.store.folder_path
+OUTPUT_PATH = PREPROCESS_CONFIG.get("Output_Path", "./data_clean")
+TEXT_EXTENSIONS = set(PREPROCESS_CONFIG.get("Text_Extensions", [".txt", ".md", ".csv", ".json", ".html", ".htm"]))
+CHUNK_WORDS = PREPROCESS_CONFIG.get("Chunk_Words", 300)
+CHUNK_OVERLAP = PREPROCESS_CONFIG.get("Chunk_Overlap", 50)
+MIN_CHUNK_WORDS = PREPROCESS_CONFIG.get("Min_Chunk_Words", 20)
+SHINGLE_WORDS = PREPROCESS_CONFIG.get("Shingle_Words", 5)
+NUM_PERM = PREPROCESS_CONFIG.get("Num_Perm", 128)
+BANDS = PREPROCESS_CONFIG.get("Bands", 16)
+THRESHOLD = PREPROCESS_CONFIG.get("Threshold", 0.85)
+WORKERS = PREPROCESS_CONFIG.get("Workers", 0) or os.cpu_count() or 1
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(2024)
+# Permutations h -> (a * h + b) mod p, fixed by the seed so signatures are stable across runs
+PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+
+_HTML_TAG = re.compile(r"<[^>]+>")
+_HYPHEN_BREAK = re.compile(r"(\w)-\n(\w)")
+_CONTROL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_INLINE_SPACE = re.compile(r"[ \t ]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_text(text: str, extension: str = ".txt") -> str:
+    """NFKC, no markup or control characters, re-joined hyphenated line breaks, collapsed whitespace"""
+    text = unicodedata.normalize("NFKC", text).replace("\r\n", "\n").replace("\r", "\n")
+    if extension in (".html", ".htm"):
+        text = _HTML_TAG.sub(" ", text)
+    text = _CONTROL.sub("", text)
+    text = _HYPHEN_BREAK.sub(r"\1\2", text)
+    text = _INLINE_SPACE.sub(" ", text)
+    paragraphs = [" ".join(paragraph.split()) for paragraph in _BLANK_LINES.split(text)]
+    return "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
+
+
+def chunk_text(text: str, chunk_words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> List[Tuple[str, int]]:
+    """
+    Overlapping chunks of about `chunk_words` words, each with the number of
+    leading words it repeats from the chunk before it. Paragraphs are packed
+    whole while they fit; longer ones are split on word boundaries.
+    """
+    words_per_paragraph = [paragraph.split() for paragraph in text.split("\n\n")]
+    chunks: List[Tuple[str, int]] = []
+    current: List[str] = []
+    carried = 0
+    for words in words_per_paragraph:
+        if current and len(current) + len(words) > chunk_words:
+            chunks.append((" ".join(current), carried))
+            current = current[-overlap:] if overlap else []
+            carried = len(current)
+        current.extend(words)
+        while len(current) > chunk_words:
+            chunks.append((" ".join(current[:chunk_words]), carried))
+            current = current[chunk_words - overlap:]
+            carried = min(overlap, len(current))
+    if current and (not chunks or len(current) > carried):
+        chunks.append((" ".join(current), carried))
+    return chunks
+
+
+def minhash(text: str, shingle_words: int = SHINGLE_WORDS) -> np.ndarray:
+    """MinHash signature over the word shingles of `text`, lower-cased"""
+    words = _WORD.findall(text.lower())
+    if len(words) < shingle_words:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + shingle_words]) for i in range(len(words) - shingle_words + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (np.outer(hashes, PERM_A) + PERM_B) % _MERSENNE_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+@dataclass
+class Chunk:
+    document: str
+    index: int
+    text: str
+    signature: np.ndarray = field(repr=False)
+    # Leading words repeated from the previous chunk of the same document
+    overlap: int = 0
+
+
+@dataclass
+class FileResult:
+    name: str
+    size: int
+    sha256: str
+    kind: str  # "text", "binary" or "error"
+    chunks: List[Chunk] = field(default_factory=list)
+    error: Optional[str] = None
+    # Shorter than Min_Chunk_Words as a whole, so kept as a single chunk
+    short: bool = False
+
+
+def process_file(path: str, root: str) -> FileResult:
+    """Worker: read one file and, for text documents, normalize, chunk and sign it"""
+    name = os.path.relpath(path, root)
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except OSError as e:
+        return FileResult(name, 0, "", "error", error=str(e))
+
+    sha256 = hashlib.sha256(raw).hexdigest()
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in TEXT_EXTENSIONS:
+        return FileResult(name, len(raw), sha256, "binary")
+
+    text = normalize_text(raw.decode("utf-8", errors="replace"), extension)
+    chunks = [
+        Chunk(name, index, chunk, minhash(chunk), overlap)
+        for index, (chunk, overlap) in enumerate(chunk_text(text))
+        if len(chunk.split()) >= MIN_CHUNK_WORDS
+    ]
+    if not chunks and text:
+        # A short notice is still a document; keep it whole
+        whole = " ".join(text.split())
+        return FileResult(name, len(raw), sha256, "text", [Chunk(name, 0, whole, minhash(whole))], short=True)
+    return FileResult(name, len(raw), sha256, "text", chunks)
+
+
+def _process_batch(args: Tuple[List[str], str]) -> List[FileResult]:
+    paths, root = args
+    return [process_file(path, root) for path in paths]
+
+
+class LSHIndex:
+    """
+    Banded LSH over MinHash signatures. A chunk is a near duplicate when it
+    shares a band bucket with a kept chunk and their signatures agree on at
+    least `threshold` of the permutations (the estimated Jaccard similarity).
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS, threshold: float = THRESHOLD):
+        if num_perm % bands:
+            raise ValueError("Num_Perm must be a multiple of Bands")
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.threshold = threshold
+        self.buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(bands)]
+        self.signatures: List[np.ndarray] = []
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[b * self.rows:(b + 1) * self.rows].tobytes() for b in range(self.bands)]
+
+    def find(self, signature: np.ndarray) -> Optional[Tuple[int, float]]:
+        """Kept chunk this signature nearly duplicates, with the estimated similarity"""
+        seen = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            for candidate in self.buckets[band].get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = float(np.mean(self.signatures[candidate] == signature))
+                if similarity >= self.threshold:
+                    return candidate, similarity
+        return None
+
+    def add(self, signature: np.ndarray) -> int:
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for band, key in enumerate(self._band_keys(signature)):
+            self.buckets[band][key].append(position)
+        return position
+
+
+def output_name(name: str, used: set, extension: Optional[str] = None) -> str:
+    """
+    Flat file name for the documents folder, which generate_kb.py reads without
+    recursing. The source extension stays in the name, and a name already in
+    `used` gets a numeric suffix, so no two sources write the same file.
+    """
+    if extension is not None and not name.endswith(extension):
+        name = f"{name}{extension}"
+    name = name.replace(os.sep, "__")
+    stem, suffix = os.path.splitext(name)
+    candidate, counter = name, 2
+    while candidate in used:
+        candidate = f"{stem}-{counter}{suffix}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def document_body(chunks: List[Chunk]) -> str:
+    """
+    Kept chunks of one document. A chunk that follows the kept chunk before it
+    continues it without the words it repeats; a gap left by a dropped chunk
+    starts a new paragraph.
+    """
+    body = ""
+    previous = None
+    for chunk in chunks:
+        if previous is not None and chunk.index == previous + 1:
+            rest = " ".join(chunk.text.split()[chunk.overlap:])
+            if rest:
+                body += " " + rest
+        else:
+            body += ("\n\n" if body else "") + chunk.text
+        previous = chunk.index
+    return body
+
+
+def list_files(folder: str) -> List[str]:
+    paths = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def preprocess(folder: str = FOLDER_PATH, output: str = OUTPUT_PATH, workers: int = WORKERS) -> dict:
+    timings = {}
+    started = time.perf_counter()
+    paths = list_files(folder)
+
+    # Hand each worker many files at once to keep pickling overhead low
+    batch_size = max(1, min(64, len(paths) // (workers * 4) or 1))
+    batches = [(paths[i:i + batch_size], folder) for i in range(0, len(paths), batch_size)]
+    results: List[FileResult] = []
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for batch in pool.map(_process_batch, batches):
+                results.extend(batch)
+    else:
+        for batch in batches:
+            results.extend(_process_batch(batch))
+    results.sort(key=lambda result: result.name)
+    timings["parse_chunk_sign_s"] = round(time.perf_counter() - started, 3)
+
+    dedup_started = time.perf_counter()
+    index = LSHIndex()
+    kept_positions: Dict[int, Chunk] = {}
+    kept: Dict[str, List[Chunk]] = defaultdict(list)
+    duplicates = []
+    seen_binary: Dict[str, str] = {}
+    binary_kept, binary_duplicates = [], []
+    for result in results:
+        if result.kind == "binary":
+            # Only exact duplicates can be detected without parsing these formats
+            if result.sha256 in seen_binary:
+                binary_duplicates.append({"file": result.name, "duplicate_of": seen_binary[result.sha256]})
+            else:
+                seen_binary[result.sha256] = result.name
+                binary_kept.append(result)
+            continue
+        for chunk in result.chunks:
+            match = index.find(chunk.signature)
+            if match is not None:
+                original = kept_positions[match[0]]
+                duplicates.append({
+                    "chunk": f"{chunk.document}#{chunk.index}",
+                    "duplicate_of": f"{original.document}#{original.index}",
+                    "similarity": round(match[1], 3),
+                })
+                continue
+            kept_positions[index.add(chunk.signature)] = chunk
+            kept[chunk.document].append(chunk)
+    timings["dedup_s"] = round(time.perf_counter() - dedup_started, 3)
+
+    write_started = time.perf_counter()
+    documents_dir = os.path.join(output, "documents")
+    os.makedirs(documents_dir, exist_ok=True)
+    bytes_out = 0
+    used_names: set = set()
+    with open(os.path.join(output, "chunks.jsonl"), "w", encoding="utf-8") as corpus:
+        for document, chunks in kept.items():
+            body = document_body(chunks)
+            target = os.path.join(documents_dir, output_name(document, used_names, ".txt"))
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(body)
+            bytes_out += len(body.encode("utf-8"))
+            for chunk in chunks:
+                corpus.write(json.dumps({"document": document, "chunk": chunk.index, "text": chunk.text}, ensure_ascii=False) + "\n")
+    for result in binary_kept:
+        target = os.path.join(documents_dir, output_name(result.name, used_names))
+        with open(os.path.join(folder, result.name), "rb") as src, open(target, "wb") as dst:
+            while True:
+                block = src.read(1024 * 1024)
+                if not block:
+                    break
+                dst.write(block)
+        bytes_out += result.size
+    timings["write_s"] = round(time.perf_counter() - write_started, 3)
+    timings["total_s"] = round(time.perf_counter() - started, 3)
+
+    text_results = [result for result in results if result.kind == "text"]
+    total_chunks = sum(len(result.chunks) for result in text_results)
+    stats = {
+        "workers": workers,
+        "files": len(results),
+        "text_files": len(text_results),
+        "binary_files": len(results) - len(text_results) - sum(result.kind == "error" for result in results),
+        "errors": [{"file": result.name, "error": result.error} for result in results if result.kind == "error"],
+        "bytes_in": sum(result.size for result in results),
+        "bytes_out": bytes_out,
+        "chunks": total_chunks,
+        "chunks_kept": total_chunks - len(duplicates),
+        "chunks_dropped": len(duplicates),
+        "documents_written": len(kept) + len(binary_kept),
+        "documents_fully_duplicate": sum(1 for result in text_results if result.chunks and result.name not in kept),
+        "documents_short_kept_whole": sum(1 for result in text_results if result.short),
+        "documents_empty": [result.name for result in text_results if not result.chunks],
+        "binary_exact_duplicates": binary_duplicates,
+        "params": {
+            "chunk_words": CHUNK_WORDS,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "shingle_words": SHINGLE_WORDS,
+            "num_perm": NUM_PERM,
+            "bands": BANDS,
+            "threshold": THRESHOLD,
+        },
+        "timings": timings,
+        "near_duplicates": duplicates,
+    }
+    with open(os.path.join(output, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2, ensure_ascii=False)
+
+    print(f"Processed {stats['files']} files with {workers} workers in {timings['total_s']}s")
+    print(f"Chunks: {stats['chunks']} total, {stats['chunks_kept']} kept, {stats['chunks_dropped']} near-duplicates dropped")
+    print(f"Bytes: {stats['bytes_in']} in, {stats['bytes_out']} out; report in {os.path.join(output, 'stats.json')}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalize, chunk and deduplicate documents before knowledge-base upload")
+    parser.add_argument("--folder", default=FOLDER_PATH, help="Source documents folder (default: STORE.FOLDER_PATH)")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Output folder (default: STORE.Preprocess.Output_Path)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+    preprocess(args.folder, args.output, args.workers)
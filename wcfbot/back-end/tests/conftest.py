@@ -0,0 +1,7 @@
+import os
+from pathlib import Path
+
+# Settings read app/engine/config.yaml relative to the back-end directory
+os.chdir(Path(__file__).resolve().parent.parent)
+os.environ.setdefault("TTS_API_URL", "http://tts.local/v1/tts")
+os.environ.setdefault("STT_API_URL", "http://stt.local/v1/stt")
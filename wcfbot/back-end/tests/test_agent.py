@@ -0,0 +1,129 @@
+import asyncio
+import json
+from contextlib import aclosing
+import httpx
+import pytest
+from app.engine import agent
+from app.engine.agent import BUDGET_MESSAGE, AgentRun, agent_complete, agent_stream
+
+
+def line(content="", finish_reason=None, tool_calls=None, tokens=None):
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    data = {"data": {"request": [{"finish_reason": finish_reason, "message": message}]}}
+    if tokens is not None:
+        data["usage"] = {"total_tokens": tokens}
+    return data
+
+
+def tool_call(name="convert_usd_to_tsh"):
+    return line(finish_reason="tool_calls", tool_calls=[{"id": "c1", "function": {"name": name, "arguments": "{}"}}], tokens=50)
+
+
+def fake_upstream(monkeypatch, rounds, streaming=True):
+    """Answers the chat API with one entry of `rounds` per call and records the payloads"""
+    payloads = []
+
+    def handler(request):
+        payloads.append(json.loads(request.content))
+        lines = rounds[min(len(payloads), len(rounds)) - 1]
+        if streaming:
+            body = "".join(json.dumps(data) + "\n" for data in lines)
+            return httpx.Response(200, content=body.encode())
+        return httpx.Response(200, json=lines[-1])
+
+    monkeypatch.setattr(agent, "upstream", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return payloads
+
+
+@pytest.fixture
+def tools_run(monkeypatch):
+    """Tool rounds append a tool result without running real tools"""
+    calls = []
+
+    async def handle_tool_calls(tool_calls, complete_message):
+        calls.append([call["function"]["name"] for call in tool_calls])
+        complete_message["messages"].append({"role": "tool", "tool_call_id": tool_calls[0]["id"], "content": "42"})
+        return complete_message
+
+    monkeypatch.setattr(agent, "handle_tool_calls", handle_tool_calls)
+    return calls
+
+
+def stream(complete_message, run):
+    async def collect():
+        async with aclosing(agent_stream(complete_message, run)) as contents:
+            return [content async for content in contents]
+    return asyncio.run(collect())
+
+
+def test_tool_round_is_followed_by_the_answer(monkeypatch, tools_run):
+    payloads = fake_upstream(monkeypatch, [
+        [tool_call()],
+        [line("Ni "), line("TSH 2500.", finish_reason="stop", tokens=80)],
+    ])
+    run = AgentRun()
+
+    assert stream({"messages": [{"role": "user", "content": "1 USD?"}]}, run) == ["Ni ", "TSH 2500."]
+    assert tools_run == [["convert_usd_to_tsh"]]
+    assert run.stop_reason == "stop" and run.tool_rounds == 1 and run.tokens == 130
+    assert "tool_choice" not in payloads[0]
+    assert payloads[1]["messages"][-1]["role"] == "tool"
+    assert [entry["tool_calls"] for entry in run.timeline()["rounds"]] == [["convert_usd_to_tsh"], []]
+
+
+def test_round_limit_switches_tools_off_and_ends_with_the_budget_message(monkeypatch, tools_run):
+    payloads = fake_upstream(monkeypatch, [[tool_call()]])
+    run = AgentRun(max_tool_rounds=1)
+
+    assert stream({"messages": []}, run) == [BUDGET_MESSAGE]
+    assert payloads[1]["tool_choice"] == "none"
+    assert run.stop_reason == "tool_rounds"
+    assert tools_run == [["convert_usd_to_tsh"]]
+
+
+def test_token_budget_makes_the_next_round_answer_without_tools(monkeypatch, tools_run):
+    payloads = fake_upstream(monkeypatch, [[tool_call()], [line("Jibu.", finish_reason="stop", tokens=10)]])
+    run = AgentRun(max_tokens=40)
+
+    assert stream({"messages": []}, run) == ["Jibu."]
+    assert payloads[1]["tool_choice"] == "none"
+    assert run.stop_reason == "stop" and run.tokens == 60
+
+
+def test_slow_tools_end_the_run_at_the_latency_budget(monkeypatch):
+    fake_upstream(monkeypatch, [[tool_call()]])
+
+    async def handle_tool_calls(tool_calls, complete_message):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(agent, "handle_tool_calls", handle_tool_calls)
+    run = AgentRun(max_seconds=0.1)
+
+    assert stream({"messages": []}, run) == [BUDGET_MESSAGE]
+    assert run.stop_reason == "latency_budget"
+    assert run.rounds[0].tool_ms < 1000
+
+
+def test_non_streaming_run_returns_the_final_round(monkeypatch, tools_run):
+    payloads = fake_upstream(monkeypatch, [[tool_call()], [line("Jibu.", finish_reason="stop", tokens=10)]], streaming=False)
+    run = AgentRun()
+
+    response = asyncio.run(agent_complete({"messages": []}, run))
+
+    assert response["data"]["request"][0]["message"]["content"] == "Jibu."
+    assert len(payloads) == 2 and run.stop_reason == "stop" and run.tokens == 60
+
+
+def test_non_streaming_round_limit_replaces_the_tool_request(monkeypatch, tools_run):
+    fake_upstream(monkeypatch, [[tool_call()]], streaming=False)
+    run = AgentRun(max_tool_rounds=1)
+
+    response = asyncio.run(agent_complete({"messages": []}, run))
+
+    assert response["data"]["request"][0] == {
+        "finish_reason": "stop",
+        "message": {"role": "assistant", "content": BUDGET_MESSAGE, "tool_calls": tool_call()["data"]["request"][0]["message"]["tool_calls"]},
+    }
+    assert run.stop_reason == "tool_rounds"
@@ -0,0 +1,92 @@
+import asyncio
+import dataclasses
+import json
+import app.engine as engine
+from app.api.models.user_request import UserRequest
+from app.utils import answer_cache as answer_cache_module
+from app.utils.answer_cache import AnswerCache, answer_key, is_cacheable, normalize_message, settings_fingerprint
+from app.utils.settings import get_settings
+
+
+def test_normalization_ignores_case_spacing_and_trailing_punctuation():
+    assert normalize_message("  Je, WCF  inalipa\tfidia?? ") == "je, wcf inalipa fidia"
+    # NFKC folds compatibility forms such as full-width letters
+    assert normalize_message("ＷＣＦ") == "wcf"
+    assert normalize_message("fidia ni nini") != normalize_message("fidia ni nani")
+
+
+def test_key_depends_on_the_message_and_the_answer_settings():
+    chat = get_settings().chat
+    assert answer_key("Fidia ni nini?", chat) == answer_key("fidia ni nini", chat)
+    assert answer_key("Fidia ni nini?", chat) != answer_key("Fidia ni nini?", dataclasses.replace(chat, temperature=0.9))
+    assert settings_fingerprint(chat) != settings_fingerprint(dataclasses.replace(chat, kb_reference_id="other-kb"))
+
+
+def test_only_requests_without_files_or_memory_are_cacheable():
+    assert is_cacheable({"messages": []}, has_files=False)
+    assert is_cacheable({"messages": [], "memoryChat": []}, has_files=False)
+    assert not is_cacheable({"messages": []}, has_files=True)
+    assert not is_cacheable({"messages": [], "memoryChat": [{"role": "user"}]}, has_files=False)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a").content == "A"
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a").content == "A" and cache.get("c").content == "C"
+
+
+def test_entries_expire_and_blank_answers_are_not_stored(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache_module.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(ttl=60)
+    cache.put("a", "A", ["A"])
+    cache.put("blank", "  \n")
+
+    now[0] += 30
+    assert cache.get("a").chunks == ("A",)
+    now[0] += 31
+    assert cache.get("a") is None
+    assert cache.get("blank") is None
+
+
+def test_answer_is_served_from_the_cache_the_second_time(monkeypatch):
+    monkeypatch.setattr(engine, "answer_cache", AnswerCache())
+    monkeypatch.setattr(engine, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(engine, "SEMANTIC_CACHE_ENABLED", False)
+    request = UserRequest(message="Ofisi ziko wapi?", session_id="s1")
+    complete_message = {"messages": []}
+
+    async def scenario():
+        cached, ticket = await engine.lookup_answer(complete_message, request, False)
+        assert cached is None and ticket is not None
+        await engine.remember_answer(ticket, "Dodoma na Dar es Salaam.", ["Dodoma ", "na Dar es Salaam."])
+        repeated = UserRequest(message="ofisi ziko wapi", session_id="s2")
+        return await engine.lookup_answer(complete_message, repeated, False)
+
+    cached, ticket = asyncio.run(scenario())
+    assert ticket is None
+    assert cached.chunks == ("Dodoma ", "na Dar es Salaam.")
+
+
+def test_replay_streams_the_original_chunks_and_writes_memory(monkeypatch):
+    written = []
+
+    class Writer:
+        def enqueue(self, session_id, user, assistant):
+            written.append((session_id, user, assistant))
+
+    monkeypatch.setattr(engine, "memory_writer", Writer())
+    answer = answer_cache_module.CachedAnswer(content="Ndiyo, inalipa.", chunks=("Ndiyo, ", "inalipa."))
+    request = UserRequest(message="Inalipa?", session_id="s1")
+
+    async def scenario():
+        return [json.loads(line) async for line in engine.replay_cached_answer(answer, request)]
+
+    lines = asyncio.run(scenario())
+    assert [line["message"]["content"] for line in lines] == ["Ndiyo, ", "inalipa."]
+    assert written == [("s1", "Inalipa?", "Ndiyo, inalipa.")]
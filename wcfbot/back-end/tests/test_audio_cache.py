@@ -0,0 +1,110 @@
+import asyncio
+import dataclasses
+import os
+from contextlib import aclosing
+import pytest
+from fastapi.testclient import TestClient
+from app.api.routers import audio as audio_router
+from app.utils import speech
+from app.utils.audio_cache import AudioCache, audio_key
+from app.utils.settings import get_settings
+from main import app
+
+
+async def write_entry(cache, key, data, buffer_bytes=4):
+    writer = cache.writer(key, buffer_bytes)
+    await writer.write(data)
+    await writer.commit()
+
+
+def part_files(directory):
+    return [name for _, _, names in os.walk(directory) for name in names if name.endswith(".part")]
+
+
+def test_key_changes_with_text_and_voice():
+    tts = get_settings().tts
+    assert audio_key("Habari", tts) == audio_key("Habari", tts)
+    assert audio_key("Habari", tts) != audio_key("Habari yako", tts)
+    assert audio_key("Habari", tts) != audio_key("Habari", dataclasses.replace(tts, voice="other-voice"))
+
+
+def test_committed_entry_is_found_and_least_recently_used_is_evicted(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=20)
+
+    async def scenario():
+        await write_entry(cache, "a" * 64, b"0123456789")
+        await write_entry(cache, "b" * 64, b"0123456789")
+        cache.lookup("a" * 64)
+        await write_entry(cache, "c" * 64, b"0123456789")
+
+    asyncio.run(scenario())
+    assert cache.lookup("b" * 64) is None
+    with open(cache.lookup("a" * 64), "rb") as f:
+        assert f.read() == b"0123456789"
+    assert cache.lookup("c" * 64) is not None
+
+
+def test_index_is_rebuilt_from_disk_and_stale_parts_removed(tmp_path):
+    asyncio.run(write_entry(AudioCache(str(tmp_path)), "d" * 64, b"audio"))
+    stale = tmp_path / "ee" / f"{'e' * 64}.mp3.0123.part"
+    stale.parent.mkdir()
+    stale.write_bytes(b"half")
+
+    cache = AudioCache(str(tmp_path))
+    assert cache.lookup("d" * 64) is not None
+    assert not stale.exists()
+
+
+def test_interrupted_synthesis_leaves_no_entry_or_part_file(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path))
+    monkeypatch.setattr(speech, "audio_cache", cache)
+    monkeypatch.setattr(speech, "AUDIO_CACHE_ENABLED", True)
+    monkeypatch.setattr(speech, "AUDIO_CACHE_WRITE_BUFFER", 1)
+
+    async def failing():
+        yield b"first"
+        raise RuntimeError("upstream closed")
+
+    async def complete():
+        yield b"first"
+        yield b"second"
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with aclosing(speech.tee_to_cache("f" * 64, failing())) as chunks:
+                async for _ in chunks:
+                    pass
+        # A client that stops reading half way
+        async with aclosing(speech.tee_to_cache("g" * 64, complete())) as chunks:
+            async for _ in chunks:
+                break
+        async with aclosing(speech.tee_to_cache("h" * 64, complete())) as chunks:
+            return [chunk async for chunk in chunks]
+
+    assert asyncio.run(scenario()) == [b"first", b"second"]
+    assert cache.lookup("f" * 64) is None and cache.lookup("g" * 64) is None
+    with open(cache.lookup("h" * 64), "rb") as f:
+        assert f.read() == b"firstsecond"
+    assert part_files(tmp_path) == []
+
+
+def test_cached_audio_is_served_with_etag_and_revalidated(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path))
+    monkeypatch.setattr(audio_router, "audio_cache", cache)
+    key = "a" * 64
+    asyncio.run(write_entry(cache, key, b"ID3 audio"))
+    client = TestClient(app)
+    # The audio router declares full paths and is also mounted under /v1/audio
+    url = "/v1/audio/v1/audio/text-to-speech"
+
+    response = client.get(f"{url}/{key}")
+    assert response.status_code == 200
+    assert response.content == b"ID3 audio"
+    assert response.headers["etag"] == f'"{key}"'
+
+    revalidated = client.get(f"{url}/{key}", headers={"If-None-Match": f'"{key}"'})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+    assert client.get(f"{url}/{'b' * 64}").status_code == 404
+    assert client.get(f"{url}/not-a-key").status_code == 404
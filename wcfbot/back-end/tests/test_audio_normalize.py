@@ -0,0 +1,30 @@
+import io
+import numpy as np
+from app.utils.audio_normalize import is_wav, normalize_wav
+from app.utils.transcription import decode_wav, encode_wav
+
+
+def stereo_tone(rate=44100, seconds=4):
+    t = np.arange(rate * seconds) / rate
+    tone = 0.5 * np.sin(2 * np.pi * 440 * t)
+    tone[:rate] = 0
+    return np.stack([tone, tone * 0.8], 1).astype(np.float32)
+
+
+def test_only_riff_wave_headers_are_wav():
+    wav = io.BytesIO(encode_wav(stereo_tone(), 44100))
+    wav.seek(100)
+    assert is_wav(wav)
+    assert wav.tell() == 0
+    assert not is_wav(io.BytesIO(b"ID3\x04\x00\x00\x00\x00\x00\x00\x00\x00"))
+    assert not is_wav(io.BytesIO(b"RIFF"))
+
+
+def test_normalized_wav_is_mono_16k_and_trimmed():
+    data = encode_wav(stereo_tone(), 44100)
+    encoded, report = normalize_wav(data)
+    audio = decode_wav(io.BytesIO(encoded))
+    assert audio.sample_rate == 16000
+    assert audio.samples.shape[1] == 1
+    assert report["duration_out"] < report["duration_in"]
+    assert report["bytes_out"] < report["bytes_in"]
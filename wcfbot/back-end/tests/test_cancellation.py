@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+import app.engine as engine
+from app.api.models.user_request import UserRequest
+from app.api.streaming import CancellableStreamingResponse
+from app.engine import agent
+from app.utils.cancellation import GenerationSizes, record_cancelled
+from app.utils.metrics import metrics
+
+
+def serve(response, disconnect_after_chunks=None):
+    """Run an ASGI response; the client disconnects once it has received `disconnect_after_chunks` chunks"""
+    sent = []
+    received_enough = asyncio.Event()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            sent.append(message["body"])
+            if disconnect_after_chunks is not None and len(sent) >= disconnect_after_chunks:
+                received_enough.set()
+
+    async def receive():
+        if disconnect_after_chunks is None:
+            await asyncio.Event().wait()
+        await received_enough.wait()
+        return {"type": "http.disconnect"}
+
+    async def scenario():
+        await asyncio.wait_for(response({"type": "http", "asgi": {"version": "3.0"}}, receive, send), 2)
+
+    asyncio.run(scenario())
+    return sent
+
+
+def endless_upstream(first):
+    state = {"closed": False}
+
+    async def generate():
+        try:
+            yield first
+            # The upstream would keep generating; only a cancel gets us out
+            await asyncio.sleep(60)
+            yield "never"
+        finally:
+            state["closed"] = True
+
+    return generate, state
+
+
+def test_disconnect_closes_the_body_while_it_waits():
+    generate, state = endless_upstream("first chunk")
+    before = metrics.counter("http.stream_disconnects")
+
+    sent = serve(CancellableStreamingResponse(generate()), disconnect_after_chunks=1)
+
+    assert sent == [b"first chunk"]
+    assert state["closed"]
+    assert metrics.counter("http.stream_disconnects") == before + 1
+
+
+def test_complete_stream_is_not_counted_as_a_disconnect():
+    async def generate():
+        yield "a"
+        yield "b"
+
+    before = metrics.counter("http.stream_disconnects")
+    assert serve(CancellableStreamingResponse(generate())) == [b"a", b"b"]
+    assert metrics.counter("http.stream_disconnects") == before
+
+
+@pytest.mark.parametrize("partial, persisted", [("Fidia hulipwa ndani ya siku thelathini baada ya", True), ("Fidia", False)])
+def test_chat_stream_stops_upstream_and_keeps_a_long_enough_partial(monkeypatch, partial, persisted):
+    generate, state = endless_upstream(partial)
+    monkeypatch.setattr(engine, "agent_stream", lambda complete_message, run: generate())
+    monkeypatch.setattr(engine, "COALESCE_ENABLED", False)
+    written = []
+
+    class Writer:
+        def enqueue(self, session_id, user, assistant):
+            written.append((session_id, user, assistant))
+
+    monkeypatch.setattr(engine, "memory_writer", Writer())
+    request = UserRequest(message="Fidia hulipwa lini?", session_id="s1")
+
+    serve(CancellableStreamingResponse(engine.inference_pawa_chat_stream({"messages": []}, request)), disconnect_after_chunks=1)
+
+    assert state["closed"]
+    assert written == ([("s1", "Fidia hulipwa lini?", partial)] if persisted else [])
+    run = agent.recent_timelines[-1]
+    assert run.stop_reason == "client_disconnect"
+    assert run.partial_memory is persisted
+
+
+def test_saved_output_is_estimated_from_completed_generations():
+    sizes = GenerationSizes()
+    sizes.completed("tts", 1000, 100)
+    sizes.completed("tts", 3000, 100)
+    assert sizes.expected("tts", 50) == 1000
+    assert sizes.expected("chat") == 0.0
+
+
+def test_cancelled_generation_counts_what_it_did_not_produce(monkeypatch):
+    from app.utils import cancellation
+    sizes = GenerationSizes()
+    sizes.completed("chat", 400)
+    monkeypatch.setattr(cancellation, "generation_sizes", sizes)
+
+    assert record_cancelled("chat", "tokens", 100) == 300
+    assert record_cancelled("chat", "tokens", 500) == 0
@@ -0,0 +1,52 @@
+import asyncio
+from app.utils.context_budget import SUMMARY_PREFIX, SUMMARY_QUESTION, ContextBudgeter, RollingSummary, turn_tokens
+from app.utils.conversation_store import ConversationStore
+
+
+def make_session(tmp_path, count):
+    store = ConversationStore(str(tmp_path / "memory.db"))
+    store.append_turns([("s1", f"swali {i}", f"jibu {i}.", float(i)) for i in range(count)])
+    return store, store.recent_turns("s1", count)
+
+
+def texts(memory):
+    return [(entry["role"], entry["content"][0]["text"]) for entry in memory]
+
+
+def test_older_turns_are_summarized_as_a_user_assistant_turn(tmp_path):
+    store, turns = make_session(tmp_path, 10)
+    budgeter = ContextBudgeter(store, max_tokens=3 * turn_tokens(turns[-1]))
+
+    memory = texts(asyncio.run(budgeter.build("s1", turns)))
+
+    assert [role for role, _ in memory] == ["user", "assistant"] * 4
+    assert memory[0] == ("user", SUMMARY_QUESTION)
+    assert memory[1][1].startswith(SUMMARY_PREFIX)
+    assert "swali 6" in memory[1][1] and "swali 7" not in memory[1][1]
+    assert [text for role, text in memory[2:] if role == "user"] == ["swali 7", "swali 8", "swali 9"]
+
+
+def test_summary_is_trimmed_when_the_window_grows(tmp_path):
+    store, turns = make_session(tmp_path, 10)
+    budgeter = ContextBudgeter(store, max_tokens=3 * turn_tokens(turns[-1]))
+
+    async def scenario():
+        await budgeter.build("s1", turns)
+        budgeter.max_tokens = 6 * turn_tokens(turns[-1])
+        return await budgeter.build("s1", turns)
+
+    memory = texts(asyncio.run(scenario()))
+    summary = memory[1][1]
+    kept = [text for role, text in memory[2:] if role == "user"]
+
+    assert kept == [f"swali {i}" for i in range(4, 10)]
+    # Each turn appears once, either verbatim or in the summary
+    assert all(f"swali {i}" in summary for i in range(4))
+    assert not any(f"swali {i} " in summary for i in range(4, 10))
+    assert budgeter._summaries["s1"].upto_id == turns[3].id
+
+
+def test_plain_text_summary_from_before_line_ids_is_loaded():
+    summary = RollingSummary.loads(7, "Mtumiaji: a | Msaidizi: b\nMtumiaji: c | Msaidizi: d")
+    assert summary.lines == [(7, "Mtumiaji: a | Msaidizi: b"), (7, "Mtumiaji: c | Msaidizi: d")]
+    assert RollingSummary.loads(7, summary.dumps()) == summary
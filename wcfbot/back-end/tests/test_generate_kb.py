@@ -0,0 +1,74 @@
+import asyncio
+import dataclasses
+import functools
+import generate_kb
+from generate_kb import UploadError
+
+
+def use_manifest(monkeypatch, path):
+    monkeypatch.setattr(generate_kb, "load_manifest", functools.partial(generate_kb.load_manifest, path=str(path)))
+    monkeypatch.setattr(generate_kb, "save_manifest", functools.partial(generate_kb.save_manifest, path=str(path)))
+    settings = generate_kb.settings
+    monkeypatch.setattr(generate_kb, "settings", dataclasses.replace(settings, chat=dataclasses.replace(settings.chat, kb_reference_id=None)))
+
+
+def folder_with(tmp_path, name, files):
+    folder = tmp_path / name
+    folder.mkdir()
+    for filename, text in files.items():
+        (folder / filename).write_text(text)
+    return str(folder)
+
+
+def test_syncing_another_folder_keeps_the_first_folders_record(tmp_path, monkeypatch):
+    use_manifest(monkeypatch, tmp_path / "manifest.json")
+    uploads = []
+
+    async def upload_batch(batch, kb_reference_id):
+        uploads.extend(document.name for document in batch)
+        return {"data": {"kbReferenceId": "kb-1"}}
+
+    monkeypatch.setattr(generate_kb, "upload_batch", upload_batch)
+    first = folder_with(tmp_path, "first", {"a.txt": "alpha"})
+    second = folder_with(tmp_path, "second", {"b.txt": "beta"})
+
+    asyncio.run(generate_kb.send_documents(first))
+    asyncio.run(generate_kb.send_documents(second))
+    manifest = asyncio.run(generate_kb.send_documents(first))
+
+    assert uploads == ["a.txt", "b.txt"]
+    assert set(manifest["folders"]) == {generate_kb.folder_key(first), generate_kb.folder_key(second)}
+
+
+def test_failed_first_batch_is_reported_as_failed(tmp_path, monkeypatch, capsys):
+    use_manifest(monkeypatch, tmp_path / "manifest.json")
+    monkeypatch.setattr(generate_kb, "BATCH_SIZE", 1)
+
+    async def upload_batch(batch, kb_reference_id):
+        raise UploadError("503: unavailable")
+
+    monkeypatch.setattr(generate_kb, "upload_batch", upload_batch)
+    folder = folder_with(tmp_path, "docs", {"a.txt": "alpha", "b.txt": "beta"})
+
+    manifest = asyncio.run(generate_kb.send_documents(folder))
+
+    assert manifest["kbReferenceId"] is None
+    assert manifest["folders"][generate_kb.folder_key(folder)] == {}
+    assert "Uploaded 0 files (0.0 MB)" in capsys.readouterr().out
+
+
+def test_only_uploaded_bytes_are_counted(tmp_path, monkeypatch, capsys):
+    use_manifest(monkeypatch, tmp_path / "manifest.json")
+    monkeypatch.setattr(generate_kb, "BATCH_SIZE", 1)
+
+    async def upload_batch(batch, kb_reference_id):
+        if batch[0].name == "big.txt":
+            raise UploadError("400: rejected")
+        return {"kbReferenceId": "kb-1"}
+
+    monkeypatch.setattr(generate_kb, "upload_batch", upload_batch)
+    folder = folder_with(tmp_path, "docs", {"a.txt": "x" * 1024, "big.txt": "y" * 3 * 1024 * 1024})
+
+    asyncio.run(generate_kb.send_documents(folder))
+
+    assert "Uploaded 1 files (0.0 MB)" in capsys.readouterr().out
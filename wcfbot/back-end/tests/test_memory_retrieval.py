@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import pytest
+from app.utils.conversation_store import ConversationStore
+from app.utils.memory_retrieval import MemoryRetriever
+from app.utils.memory_writer import MemoryWriter
+
+
+def make_retriever(tmp_path):
+    store = ConversationStore(str(tmp_path / "memory.db"))
+    writer = MemoryWriter(store, flush_interval=0.01)
+    retriever = MemoryRetriever(store, writer, dim=512, top_k=2, min_score=0.1)
+    writer.add_listener(retriever.on_turn)
+    return store, writer, retriever
+
+
+def test_relevant_past_turn_is_found_and_newest_excluded(tmp_path):
+    store, writer, retriever = make_retriever(tmp_path)
+
+    async def scenario():
+        writer.enqueue("s1", "fidia ya ajali kazini", "Fidia hulipwa na WCF")
+        writer.enqueue("s1", "office hours", "8 to 4")
+        writer.enqueue("s1", "fidia ya ajali", "newest")
+        return await retriever.search("s1", "fidia ya ajali", exclude_last=1)
+
+    assert [turn.assistant for turn in asyncio.run(scenario())] == ["Fidia hulipwa na WCF"]
+
+
+@pytest.mark.parametrize("flushed", [False, True])
+def test_turn_enqueued_while_the_index_builds_is_indexed_once(tmp_path, flushed):
+    store, writer, retriever = make_retriever(tmp_path)
+    reading, release = threading.Event(), threading.Event()
+    recent_turns = store.recent_turns
+
+    def slow_recent_turns(session_id, limit):
+        reading.set()
+        release.wait(1)
+        return recent_turns(session_id, limit)
+
+    store.recent_turns = slow_recent_turns
+
+    async def scenario():
+        writer.enqueue("s1", "first question", "first answer")
+        search = asyncio.create_task(retriever.search("s1", "second question", exclude_last=0))
+        await asyncio.to_thread(reading.wait, 1)
+        writer.enqueue("s1", "second question", "second answer")
+        if flushed:
+            # Committed before the store is read, so the build sees it as stored too
+            await writer.start()
+            await writer.stop()
+        release.set()
+        await search
+        return [turn.user for turn in retriever._indexes["s1"].turns]
+
+    assert asyncio.run(scenario()) == ["first question", "second question"]
+
+
+def test_concurrent_first_searches_share_one_build(tmp_path):
+    store, writer, retriever = make_retriever(tmp_path)
+    builds = []
+    build = retriever._build
+
+    def counted_build(session_id, pending):
+        builds.append(session_id)
+        return build(session_id, pending)
+
+    retriever._build = counted_build
+
+    async def scenario():
+        writer.enqueue("s1", "habari", "nzuri")
+        await asyncio.gather(*(retriever.search("s1", "habari", exclude_last=0) for _ in range(5)))
+
+    asyncio.run(scenario())
+    assert builds == ["s1"]
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from app.utils.conversation_store import ConversationStore
+from app.utils.memory_writer import MemoryWriter
+
+
+def make_writer(tmp_path, **kwargs):
+    store = ConversationStore(str(tmp_path / "memory.db"), synchronous="FULL")
+    return store, MemoryWriter(store, **kwargs)
+
+
+def test_buffered_turns_are_visible_before_and_after_flush(tmp_path):
+    store, writer = make_writer(tmp_path, flush_interval=0.01)
+
+    async def scenario():
+        writer.enqueue("s1", "habari", "nzuri")
+        before = [turn.user for turn in await writer.recent_turns("s1", 10)]
+        await writer.start()
+        await writer.stop()
+        after = [turn.user for turn in await writer.recent_turns("s1", 10)]
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before == after == ["habari"]
+    assert [turn.user for turn in store.recent_turns("s1", 10)] == ["habari"]
+
+
+def test_turn_is_not_duplicated_while_its_batch_commits(tmp_path):
+    store, writer = make_writer(tmp_path, flush_interval=0.01)
+    committed, release = threading.Event(), threading.Event()
+    append_turns = store.append_turns
+
+    def slow_append(batch):
+        # Committed, but the writer has not heard back yet
+        append_turns(batch)
+        committed.set()
+        release.wait(5)
+
+    store.append_turns = slow_append
+
+    async def scenario():
+        writer.enqueue("s1", "habari", "nzuri")
+        await writer.start()
+        await asyncio.to_thread(committed.wait, 5)
+        during = [turn.user for turn in await writer.recent_turns("s1", 10)]
+        release.set()
+        await writer.stop()
+        return during
+
+    assert asyncio.run(scenario()) == ["habari"]
+
+
+def test_reads_do_not_wait_for_the_writer_lock(tmp_path):
+    store, writer = make_writer(tmp_path)
+    store.append_turns([("s1", "habari", "nzuri", 1.0)])
+
+    async def scenario():
+        # A flush holds the write lock through commit and fsync
+        with store._lock:
+            return await asyncio.wait_for(writer.recent_turns("s1", 10), timeout=2)
+
+    assert [turn.user for turn in asyncio.run(scenario())] == ["habari"]
+
+
+def test_failed_flush_keeps_turns_buffered(tmp_path):
+    store, writer = make_writer(tmp_path, flush_interval=0.01)
+
+    def failing(batch):
+        raise OSError("disk full")
+
+    store.append_turns = failing
+
+    async def scenario():
+        writer.enqueue("s1", "habari", "nzuri")
+        await writer.start()
+        await asyncio.sleep(0.05)
+        pending = writer.pending_turns("s1")
+        writer._task.cancel()
+        return pending
+
+    assert [turn.user for turn in asyncio.run(scenario())] == ["habari"]
@@ -0,0 +1,46 @@
+import asyncio
+from contextlib import aclosing
+from app.utils.ndjson import NDJSONDecoder, coalesce
+
+
+async def tokens(log, count=100, delay=0.002):
+    try:
+        for i in range(count):
+            await asyncio.sleep(delay)
+            yield f"t{i} "
+    finally:
+        await asyncio.sleep(0.01)
+        log.append("source closed")
+
+
+def test_decoder_handles_lines_split_across_chunks():
+    decoder = NDJSONDecoder("test")
+    objects = decoder.feed(b'{"a": 1}\n{"b"') + decoder.feed(b': 2}\nnot json\n{"c": 3}')
+    objects += decoder.flush()
+    assert objects == [{"a": 1}, {"b": 2}, {"c": 3}]
+    assert decoder.malformed == 1
+
+
+def test_coalesce_keeps_every_delta_in_order():
+    async def scenario():
+        log = []
+        return [delta async for delta in coalesce(tokens(log), window_ms=10)], log
+
+    deltas, log = asyncio.run(scenario())
+    assert "".join(deltas).split() == [f"t{i}" for i in range(100)]
+    assert len(deltas) < 100
+    assert log == ["source closed"]
+
+
+def test_closing_coalesce_closes_the_source_first():
+    async def scenario():
+        log = []
+        async with aclosing(coalesce(tokens(log), window_ms=1)) as deltas:
+            async for delta in deltas:
+                log.append(delta)
+                if len(log) == 3:
+                    break
+        log.append("coalesce closed")
+        return log
+
+    assert asyncio.run(scenario())[-2:] == ["source closed", "coalesce closed"]
@@ -0,0 +1,47 @@
+import os
+import random
+import preprocess_kb
+
+
+def words(n, seed):
+    rng = random.Random(seed)
+    return " ".join(f"w{rng.randint(0, 100000)}" for _ in range(n))
+
+
+def test_output_has_no_repeated_overlap(tmp_path):
+    source = tmp_path / "data"
+    source.mkdir()
+    text = words(700, 1)
+    (source / "long.txt").write_text(text, encoding="utf-8")
+
+    stats = preprocess_kb.preprocess(str(source), str(tmp_path / "out"), workers=1)
+
+    written = (tmp_path / "out" / "documents" / "long.txt").read_text(encoding="utf-8")
+    assert written.split() == text.split()
+    assert stats["bytes_out"] <= stats["bytes_in"]
+
+
+def test_short_documents_are_kept_whole(tmp_path):
+    source = tmp_path / "data"
+    source.mkdir()
+    (source / "notice.txt").write_text("Ofisi itafungwa tarehe 9 Desemba kwa sikukuu ya Uhuru.", encoding="utf-8")
+    (source / "empty.txt").write_text("  \n", encoding="utf-8")
+
+    stats = preprocess_kb.preprocess(str(source), str(tmp_path / "out"), workers=1)
+
+    written = (tmp_path / "out" / "documents" / "notice.txt").read_text(encoding="utf-8")
+    assert written.startswith("Ofisi itafungwa")
+    assert stats["documents_short_kept_whole"] == 1
+    assert stats["documents_empty"] == ["empty.txt"]
+
+
+def test_sources_with_the_same_stem_do_not_overwrite_each_other(tmp_path):
+    source = tmp_path / "data"
+    source.mkdir()
+    (source / "a.md").write_text(words(100, 2), encoding="utf-8")
+    (source / "a.txt").write_text(words(100, 3), encoding="utf-8")
+
+    stats = preprocess_kb.preprocess(str(source), str(tmp_path / "out"), workers=1)
+
+    assert sorted(os.listdir(tmp_path / "out" / "documents")) == ["a.md.txt", "a.txt"]
+    assert stats["documents_written"] == 2
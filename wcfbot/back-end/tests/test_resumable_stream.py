@@ -0,0 +1,95 @@
+import asyncio
+from contextlib import aclosing
+import pytest
+from app.utils import resumable_stream
+from app.utils.resumable_stream import Generation, GenerationRegistry, StreamGone, event_id, parse_event_id
+
+
+async def collect(generation, after=-1):
+    async with aclosing(generation.read(after)) as events:
+        return [(seq, data) async for seq, _, data in events]
+
+
+def test_reader_resumes_after_its_last_event():
+    async def scenario():
+        generation = Generation("g", capacity=8)
+        for data in ("a", "b", "c"):
+            generation.publish(data)
+        generation.finish(data="end")
+        return await collect(generation, after=1)
+
+    assert asyncio.run(scenario()) == [(2, "c"), (3, "end")]
+
+
+def test_resuming_past_the_ring_buffer_raises_stream_gone():
+    async def scenario():
+        generation = Generation("g", capacity=2)
+        for data in ("a", "b", "c", "d"):
+            generation.publish(data)
+        generation.finish()
+        # Events 1 and 2 were dropped to make room
+        return await collect(generation, after=0)
+
+    with pytest.raises(StreamGone):
+        asyncio.run(scenario())
+
+
+def test_live_reader_sees_events_published_while_waiting():
+    async def scenario():
+        generation = Generation("g", capacity=8)
+        reader = asyncio.create_task(collect(generation))
+        for data in ("a", "b"):
+            await asyncio.sleep(0.01)
+            generation.publish(data)
+        generation.finish(data="end")
+        return await reader
+
+    assert asyncio.run(scenario()) == [(0, "a"), (1, "b"), (2, "end")]
+
+
+def test_generation_without_readers_is_cancelled_after_the_grace_period(monkeypatch):
+    monkeypatch.setattr(resumable_stream, "ORPHAN_GRACE_SECONDS", 0.02)
+
+    async def lines():
+        yield "first\n"
+        await asyncio.sleep(10)
+        yield "never\n"
+
+    async def scenario():
+        registry = GenerationRegistry(capacity=8, ttl=60)
+        generation = registry.start(lines())
+        async with aclosing(generation.read()) as events:
+            async for _ in events:
+                break
+        await asyncio.wait_for(generation.task, 1)
+        return generation
+
+    generation = asyncio.run(scenario())
+    assert generation.done
+    assert generation.events[-1][1] == "error"
+
+
+def test_reconnecting_reader_keeps_the_generation_running(monkeypatch):
+    monkeypatch.setattr(resumable_stream, "ORPHAN_GRACE_SECONDS", 0.05)
+
+    async def lines():
+        for data in ("a", "b", "c"):
+            await asyncio.sleep(0.02)
+            yield data + "\n"
+
+    async def scenario():
+        registry = GenerationRegistry(capacity=8, ttl=60)
+        generation = registry.start(lines())
+        async with aclosing(generation.read()) as events:
+            async for seq, _, _ in events:
+                last = seq
+                break
+        resumed, after = registry.resume(event_id(generation.id, last))
+        return await collect(resumed, after)
+
+    assert asyncio.run(scenario()) == [(1, "b"), (2, "c"), (3, "{}")]
+
+
+def test_parse_event_id_round_trips():
+    assert parse_event_id(event_id("abc123", 7)) == ("abc123", 7)
+    assert parse_event_id("garbage") is None
@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+import numpy as np
+import pytest
+from app.utils.semantic_cache import Embedder, HashingEmbedder, SemanticCache, SemanticNamespace
+
+
+class SlowEmbedder(HashingEmbedder):
+    """Hashing embeddings that take `delay` seconds, like a slow embedding endpoint"""
+
+    def __init__(self, delay):
+        super().__init__(256)
+        self.delay = delay
+
+    async def embed(self, texts):
+        await asyncio.sleep(self.delay)
+        return await super().embed(texts)
+
+
+def make_cache(directory, embedder=None, **options):
+    options = {"threshold": 0.8, "capacity": 2, "ttl": 3600, **options}
+    return SemanticCache(embedder or HashingEmbedder(256), str(directory), **options)
+
+
+async def store(cache, message, content):
+    match = await cache.lookup("kb", message)
+    await cache.put("kb", message, match, content)
+
+
+def test_paraphrase_above_threshold_hits_and_unrelated_question_misses(tmp_path):
+    async def scenario():
+        cache = make_cache(tmp_path)
+        await store(cache, "How do I register a new employer with WCF?", "Use the employer portal.")
+
+        hit = await cache.lookup("kb", "how do I register a new employer with WCF")
+        miss = await cache.lookup("kb", "What benefits are paid after a workplace injury?")
+        await cache.close()
+        return hit, miss
+
+    hit, miss = asyncio.run(scenario())
+    assert hit.answer is not None and hit.answer.content == "Use the employer portal."
+    assert hit.score >= 0.8
+    assert miss.answer is None and miss.score < 0.8
+
+
+def test_namespaces_do_not_share_answers(tmp_path):
+    async def scenario():
+        cache = make_cache(tmp_path)
+        await store(cache, "Where is the head office?", "Dodoma.")
+        match = await cache.lookup("other-kb", "Where is the head office?")
+        await cache.close()
+        return match
+
+    assert asyncio.run(scenario()).answer is None
+
+
+def test_full_namespace_evicts_least_recently_used(tmp_path):
+    async def scenario():
+        cache = make_cache(tmp_path)
+        await store(cache, "first question about contributions", "one")
+        await store(cache, "second question about claims", "two")
+        # Using the first entry makes the second the least recently used
+        assert (await cache.lookup("kb", "first question about contributions")).answer is not None
+        await store(cache, "third question about inspections", "three")
+
+        found = {}
+        for message in ("first question about contributions", "second question about claims", "third question about inspections"):
+            match = await cache.lookup("kb", message)
+            found[message] = match.answer.content if match.answer else None
+        await cache.close()
+        return found
+
+    assert asyncio.run(scenario()) == {
+        "first question about contributions": "one",
+        "second question about claims": None,
+        "third question about inspections": "three",
+    }
+
+
+def test_entries_persist_across_instances_with_the_same_embedder(tmp_path):
+    async def write():
+        cache = make_cache(tmp_path)
+        await store(cache, "How are assessments appealed?", "Write to the Director General.")
+        await cache.close()
+
+    async def read(embedder):
+        cache = make_cache(tmp_path, embedder=embedder)
+        match = await cache.lookup("kb", "How are assessments appealed?")
+        await cache.close()
+        return match
+
+    asyncio.run(write())
+    assert asyncio.run(read(HashingEmbedder(256))).answer.content == "Write to the Director General."
+    # A different embedder cannot reuse the stored vectors
+    assert asyncio.run(read(HashingEmbedder(128))).answer is None
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    async def scenario():
+        cache = make_cache(tmp_path, ttl=60)
+        await store(cache, "What is the contribution rate?", "0.5 percent.")
+        cache._namespaces["kb"].stored_at[:] = time.time() - 120
+        match = await cache.lookup("kb", "What is the contribution rate?")
+        await cache.close()
+        return match
+
+    assert asyncio.run(scenario()).answer is None
+
+
+def test_slow_lookup_fails_open_and_stores_the_answer_when_it_finishes(tmp_path):
+    async def scenario():
+        cache = make_cache(tmp_path, embedder=SlowEmbedder(0.2), lookup_timeout=0.02)
+        lookup = cache.start_lookup("kb", "Who pays the contributions?")
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(lookup), cache.lookup_timeout)
+        except asyncio.TimeoutError:
+            pass
+        waited = time.monotonic() - started
+
+        await cache.remember("kb", "Who pays the contributions?", lookup, "The employer.")
+        assert not lookup.done()
+        await asyncio.gather(*cache._tasks)
+        match = await cache.lookup("kb", "Who pays the contributions?")
+        await cache.close()
+        return waited, match
+
+    waited, match = asyncio.run(scenario())
+    assert waited < 0.15
+    assert match.answer.content == "The employer."
+
+
+def test_failed_lookup_resolves_to_none(tmp_path):
+    class BrokenEmbedder(HashingEmbedder):
+        async def embed(self, texts):
+            raise ValueError("embedding endpoint unavailable")
+
+    async def scenario():
+        cache = make_cache(tmp_path, embedder=BrokenEmbedder(256))
+        result = await cache.start_lookup("kb", "anything")
+        await cache.close()
+        return result
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_hashing_embedder_is_deterministic():
+    async def scenario():
+        return await HashingEmbedder(256).embed(["same text"]), await HashingEmbedder(256).embed(["same text"])
+
+    first, second = asyncio.run(scenario())
+    assert np.array_equal(first, second)
+
+
+def test_put_serves_the_entry_before_it_reaches_disk(tmp_path, monkeypatch):
+    released = threading.Event()
+    persist = SemanticNamespace.persist
+
+    def slow_persist(self, slot, vector, entry):
+        released.wait(1)
+        persist(self, slot, vector, entry)
+
+    monkeypatch.setattr(SemanticNamespace, "persist", slow_persist)
+
+    async def scenario():
+        cache = make_cache(tmp_path)
+        started = time.monotonic()
+        await store(cache, "When is the annual return due?", "By 31 July.")
+        stored_in = time.monotonic() - started
+        served = await cache.lookup("kb", "When is the annual return due?")
+        released.set()
+        await cache.close()
+        return stored_in, served
+
+    stored_in, served = asyncio.run(scenario())
+    assert stored_in < 0.5
+    assert served.answer.content == "By 31 July."
+    # close waited for the write
+    assert len((tmp_path / "kb" / "entries.jsonl").read_text().splitlines()) == 1
+
+
+def test_embedder_needs_an_embed_method():
+    with pytest.raises(TypeError):
+        Embedder()
@@ -0,0 +1,40 @@
+import json
+import pytest
+from app.utils.settings import freeze, get_settings, thaw
+
+
+def test_request_pieces_cannot_be_mutated():
+    chat = get_settings().chat
+    with pytest.raises(TypeError):
+        chat.template["stream"] = True
+    with pytest.raises(TypeError):
+        chat.system_message["content"][0]["text"] = "changed"
+    if chat.tools:
+        with pytest.raises(TypeError):
+            chat.tools[0]["type"] = "changed"
+
+
+def test_thawed_copies_do_not_share_nested_values():
+    chat = get_settings().chat
+    request = thaw(chat.template)
+    request.setdefault("tools", []).append({"type": "extra"})
+    request["messages"] = [thaw(chat.system_message)]
+    request["messages"][0]["content"][0]["text"] = "changed"
+    json.dumps(request)
+
+    assert thaw(chat.template).get("tools", []) == thaw(chat.tools)
+    assert thaw(chat.system_message)["content"][0]["text"] == chat.system_prompt
+
+
+def test_freeze_and_thaw_round_trip():
+    value = {"a": [1, {"b": [2, 3]}], "c": "d"}
+    frozen = freeze(value)
+    assert isinstance(frozen["a"], tuple)
+    with pytest.raises(TypeError):
+        frozen["a"][1]["b"] = []
+    assert thaw(frozen) == value
+
+
+def test_config_sections_are_read_only():
+    with pytest.raises(TypeError):
+        get_settings().config["Chat"]["Base_URL"] = "http://elsewhere"
@@ -0,0 +1,113 @@
+import asyncio
+from contextlib import aclosing
+import pytest
+from fastapi import HTTPException
+from app.utils.single_flight import SingleFlight
+
+
+def source(items, fail=None, delay=0.005):
+    async def generate(flight):
+        for item in items:
+            await asyncio.sleep(delay)
+            yield item
+        if fail is not None:
+            raise fail
+    return generate
+
+
+async def read(flight, limit=None):
+    out = []
+    try:
+        async with aclosing(flight.subscribe()) as items:
+            async for item in items:
+                out.append(item)
+                if limit is not None and len(out) >= limit:
+                    break
+    finally:
+        flight.release()
+    return out
+
+
+def test_identical_requests_share_one_generation():
+    async def scenario():
+        flights = SingleFlight()
+        started = []
+
+        def counted(flight):
+            started.append(flight)
+            return source(["a", "b", "c"])(flight)
+
+        leader = flights.lead("k", counted)
+        followers = [flights.lead("k", counted) for _ in range(3)]
+        results = await asyncio.gather(read(leader), *(read(f) for f in followers))
+        return started, results, flights.stats()
+
+    started, results, stats = asyncio.run(scenario())
+    assert len(started) == 1
+    assert all(result == ["a", "b", "c"] for result in results)
+    assert stats["in_flight"] == 0
+
+
+def test_late_subscriber_replays_from_the_start():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.lead("k", source(["a", "b", "c"], delay=0.01))
+        first = asyncio.create_task(read(leader))
+        await asyncio.sleep(0.025)
+        late = flights.join("k")
+        return await first, await read(late)
+
+    first, late = asyncio.run(scenario())
+    assert first == late == ["a", "b", "c"]
+
+
+def test_reserved_subscription_keeps_flight_alive_until_read():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.lead("k", source(["c0", "c1", "c2"]))
+        follower = flights.join("k")
+        # The follower leaves before the leader has started reading
+        assert await read(follower, limit=1) == ["c0"]
+        return await read(leader)
+
+    assert asyncio.run(scenario()) == ["c0", "c1", "c2"]
+
+
+def test_flight_is_cancelled_when_every_subscriber_leaves():
+    async def scenario():
+        flights = SingleFlight()
+        produced = []
+
+        async def generate(flight):
+            for i in range(100):
+                await asyncio.sleep(0.005)
+                produced.append(i)
+                yield str(i)
+
+        flight = flights.lead("k", generate)
+        await read(flight, limit=2)
+        await asyncio.sleep(0.05)
+        return flight, produced, flights.join("k")
+
+    flight, produced, rejoined = asyncio.run(scenario())
+    assert flight.abandoned and flight.done
+    assert len(produced) < 10
+    assert rejoined is None
+
+
+def test_each_subscriber_gets_its_own_error():
+    async def scenario():
+        flights = SingleFlight()
+        leader = flights.lead("k", source(["a"], fail=HTTPException(status_code=502, detail="down")))
+        follower = flights.join("k")
+        errors = []
+        for flight in (leader, follower):
+            with pytest.raises(HTTPException) as raised:
+                await read(flight)
+            errors.append(raised.value)
+        return errors
+
+    first, second = asyncio.run(scenario())
+    assert first is not second
+    assert first.status_code == second.status_code == 502
+    assert isinstance(first.__cause__, HTTPException)
@@ -0,0 +1,105 @@
+import asyncio
+from contextlib import aclosing
+import pytest
+from app.utils import speech
+from app.utils.settings import get_settings
+from app.utils.speech import SentenceAccumulator, speakable, split_sentences, synthesize_in_order
+
+
+def test_swahili_abbreviations_and_initials_do_not_end_a_sentence():
+    text = (
+        "Bw. Juma alifika ofisini. Dkt. Asha alimpokea, k.m. kwa barua ya S.L.P. 123 Dodoma. "
+        "J. Mwakyusa alisaini fomu Na. 5 jana! Je, umeipata?"
+    )
+    assert split_sentences(text, min_chars=1, max_chars=300) == [
+        "Bw. Juma alifika ofisini.",
+        "Dkt. Asha alimpokea, k.m. kwa barua ya S.L.P. 123 Dodoma.",
+        "J. Mwakyusa alisaini fomu Na. 5 jana!",
+        "Je, umeipata?",
+    ]
+
+
+def test_short_sentences_are_joined_and_long_ones_cut_at_a_comma():
+    assert split_sentences("Ndiyo. Sawa. Asante sana kwa kuuliza swali hilo.", min_chars=20, max_chars=300) == [
+        "Ndiyo. Sawa. Asante sana kwa kuuliza swali hilo.",
+    ]
+    long = "Mfanyakazi anastahili fidia, " + "matibabu ya bure " * 10 + "na posho."
+    segments = split_sentences(long, min_chars=1, max_chars=60)
+    assert segments[0] == "Mfanyakazi anastahili fidia,"
+    assert all(len(segment) <= 60 for segment in segments)
+    assert " ".join(segments) == long
+
+
+def test_accumulator_waits_for_the_space_after_a_period():
+    accumulator = SentenceAccumulator(min_chars=1, max_chars=300)
+    assert accumulator.feed("Kiwango ni 3") == []
+    assert accumulator.feed(".5 asilimia") == []
+    assert accumulator.feed(". Kwa **maelezo**") == ["Kiwango ni 3.5 asilimia."]
+    assert accumulator.flush() == ["Kwa maelezo"]
+
+
+def test_speakable_drops_markdown():
+    assert speakable("## Kichwa\n- **Fidia** ya [WCF](https://wcf.go.tz)") == "Kichwa\nFidia ya WCF"
+
+
+def fake_synthesis(monkeypatch, delays, fail=None):
+    running, peak = [0], [0]
+
+    async def synthesize_cached(text, settings):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        try:
+            await asyncio.sleep(delays[text])
+            if text == fail:
+                raise RuntimeError(f"TTS failed for {text}")
+            yield f"{text}-1".encode()
+            yield f"{text}-2".encode()
+        finally:
+            running[0] -= 1
+
+    monkeypatch.setattr(speech, "synthesize_cached", synthesize_cached)
+    return peak
+
+
+def test_segments_are_yielded_in_order_within_the_window(monkeypatch):
+    # Later segments finish first
+    peak = fake_synthesis(monkeypatch, {"a": 0.05, "b": 0.01, "c": 0.02, "d": 0.0})
+
+    async def scenario():
+        async with aclosing(synthesize_in_order(["a", "b", " ", "c", "d"], get_settings(), window=2)) as chunks:
+            return [(index, chunk) async for index, _, chunk in chunks]
+
+    assert asyncio.run(scenario()) == [
+        (0, b"a-1"), (0, b"a-2"), (1, b"b-1"), (1, b"b-2"),
+        (2, b"c-1"), (2, b"c-2"), (3, b"d-1"), (3, b"d-2"),
+    ]
+    assert peak[0] <= 2
+
+
+def test_failed_segment_raises_in_order_and_stops_the_rest(monkeypatch):
+    fake_synthesis(monkeypatch, {"a": 0.0, "b": 0.01, "c": 0.0}, fail="b")
+
+    async def scenario():
+        received = []
+        with pytest.raises(RuntimeError, match="TTS failed for b"):
+            async with aclosing(synthesize_in_order(["a", "b", "c"], get_settings(), window=3)) as chunks:
+                async for index, _, chunk in chunks:
+                    received.append(chunk)
+        return received
+
+    assert asyncio.run(scenario()) == [b"a-1", b"a-2"]
+
+
+def test_closing_early_cancels_segments_in_flight(monkeypatch):
+    fake_synthesis(monkeypatch, {"a": 0.0, "b": 10, "c": 10})
+    tasks_before = set()
+
+    async def scenario():
+        tasks_before.update(asyncio.all_tasks())
+        async with aclosing(synthesize_in_order(["a", "b", "c"], get_settings(), window=3)) as chunks:
+            async for _ in chunks:
+                break
+        await asyncio.sleep(0)
+        return [task for task in asyncio.all_tasks() - tasks_before if not task.done()]
+
+    assert asyncio.run(scenario()) == []
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import time
+from typing import List, Optional
+import pytest
+from app.utils import tool_excuter
+from app.utils.tool_excuter import ToolResultCache, execute_tool_call, handle_tool_calls, parse_arguments
+from app.utils.tool_registry import ToolRegistry
+
+
+def test_schema_is_generated_from_signature_and_docstring():
+    tools = ToolRegistry()
+
+    @tools.tool()
+    def lookup_claim(claim_id: str, years: Optional[int] = None, tags: List[str] = None) -> dict:
+        """
+        Looks up a compensation claim.
+
+        Args:
+            claim_id (str): Claim number printed on the form
+            years: How many years back to search
+        """
+
+    assert tools.schemas() == [{
+        "type": "function",
+        "function": {
+            "name": "lookup_claim",
+            "description": "Looks up a compensation claim.",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "claim_id": {"description": "Claim number printed on the form", "type": "string"},
+                    "years": {"description": "How many years back to search", "type": "integer"},
+                    "tags": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["claim_id"],
+                "additionalProperties": False,
+            },
+        },
+    }]
+    assert tools.get("lookup_claim").is_async is False
+
+
+def test_duplicate_tool_names_are_rejected():
+    tools = ToolRegistry()
+
+    @tools.tool(name="same")
+    async def first():
+        """First"""
+
+    with pytest.raises(ValueError):
+        @tools.tool(name="same")
+        def second():
+            """Second"""
+
+
+@pytest.fixture
+def tools(monkeypatch):
+    registry = ToolRegistry()
+    monkeypatch.setattr(tool_excuter, "registry", registry)
+    monkeypatch.setattr(tool_excuter, "tool_results_cache", ToolResultCache())
+    return registry
+
+
+def test_slow_tool_times_out_and_failing_tool_reports_its_error(tools):
+    @tools.tool(timeout=0.05)
+    async def slow() -> dict:
+        """Never answers in time"""
+        await asyncio.sleep(5)
+
+    @tools.tool()
+    def broken() -> dict:
+        """Always fails"""
+        raise RuntimeError("database down")
+
+    assert asyncio.run(execute_tool_call("slow", {})) == {"error": "Tool 'slow' timed out after 0.05s"}
+    assert asyncio.run(execute_tool_call("broken", "{}")) == {"error": "Error executing tool 'broken': database down"}
+    assert asyncio.run(execute_tool_call("missing", {})) == {"error": "Tool 'missing' not found"}
+
+
+def test_deterministic_results_are_cached_until_they_expire(tools):
+    calls = []
+
+    @tools.tool(cache_ttl=0.1)
+    def convert(amount: float) -> dict:
+        """Converts an amount"""
+        calls.append(amount)
+        return {"amount": amount * 2}
+
+    async def scenario():
+        first = await execute_tool_call("convert", '{"amount": 5}')
+        second = await execute_tool_call("convert", {"amount": 5})
+        other = await execute_tool_call("convert", {"amount": 6})
+        await asyncio.sleep(0.15)
+        expired = await execute_tool_call("convert", {"amount": 5})
+        return first, second, other, expired
+
+    first, second, _, expired = asyncio.run(scenario())
+    assert first == second == expired == {"success": True, "result": {"amount": 10}}
+    assert calls == [5, 6, 5]
+
+
+def test_uncached_tools_run_every_time(tools):
+    calls = []
+
+    @tools.tool()
+    def now() -> dict:
+        """Current time"""
+        calls.append(1)
+        return {"t": len(calls)}
+
+    asyncio.run(execute_tool_call("now", {}))
+    asyncio.run(execute_tool_call("now", {}))
+    assert len(calls) == 2
+
+
+def test_tool_calls_of_one_turn_run_concurrently(tools):
+    @tools.tool()
+    async def wait_async(seconds: float) -> dict:
+        """Waits on the event loop"""
+        await asyncio.sleep(seconds)
+        return {"waited": seconds}
+
+    @tools.tool()
+    def wait_sync(seconds: float) -> dict:
+        """Waits in a worker thread"""
+        time.sleep(seconds)
+        return {"waited": seconds}
+
+    tool_calls = [
+        {"id": "a", "function": {"name": "wait_async", "arguments": '{"seconds": 0.2}'}},
+        {"function": {"name": "wait_sync", "arguments": '{"seconds": 0.2}'}},
+    ]
+    complete_message = {"messages": [{"role": "user", "content": []}]}
+
+    started = time.perf_counter()
+    asyncio.run(handle_tool_calls(tool_calls, complete_message))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.35
+    messages = complete_message["messages"]
+    assert messages[1]["role"] == "assistant"
+    assert [call["id"] for call in messages[1]["tool_calls"]] == ["a", "call_1_wait_sync"]
+    assert [(message["tool_call_id"], json.loads(message["content"][0]["text"])) for message in messages[2:]] == [
+        ("a", {"success": True, "result": {"waited": 0.2}}),
+        ("call_1_wait_sync", {"success": True, "result": {"waited": 0.2}}),
+    ]
+
+
+def test_arguments_are_parsed_leniently():
+    assert parse_arguments('{"a": 1}') == {"a": 1}
+    assert parse_arguments("") == {}
+    assert parse_arguments("{not json") == {}
+    assert parse_arguments('["a"]') == {}
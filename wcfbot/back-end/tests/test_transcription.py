@@ -0,0 +1,151 @@
+import asyncio
+import io
+import wave
+import httpx
+import numpy as np
+import pytest
+from app.utils import transcription
+from app.utils.transcription import (
+    AudioSegment,
+    PCMAudio,
+    UnsupportedAudio,
+    decode_wav,
+    encode_wav,
+    plan_cuts,
+    silence_midpoints,
+    split_audio,
+    stitch,
+    transcript_text,
+)
+
+RATE = 8000
+
+
+def speech_with_pauses(seconds_of_speech, pause_s=0.5):
+    """A 440 Hz tone for each entry of `seconds_of_speech`, separated by silence"""
+    parts = []
+    for seconds in seconds_of_speech:
+        t = np.arange(int(seconds * RATE)) / RATE
+        parts.append(0.5 * np.sin(2 * np.pi * 440 * t))
+        parts.append(np.zeros(int(pause_s * RATE)))
+    return PCMAudio(np.concatenate(parts[:-1]).astype(np.float32)[:, None], RATE)
+
+
+def test_cut_at_the_silence_closest_to_the_target():
+    silences = np.array([10.0, 28.0, 33.0, 50.0, 70.0])
+    assert plan_cuts(100.0, silences, target=30, maximum=55) == [28.0, 50.0]
+    assert plan_cuts(40.0, silences, target=30, maximum=55) == []
+
+
+def test_hard_cut_at_the_maximum_without_silence():
+    assert plan_cuts(120.0, np.array([]), target=30, maximum=55) == [55.0, 110.0]
+
+
+def test_silences_are_found_between_tones():
+    midpoints = silence_midpoints(speech_with_pauses([1.0, 1.0, 1.0]), frame_ms=30, min_silence_ms=300)
+    assert len(midpoints) == 2
+    assert midpoints[0] == pytest.approx(1.25, abs=0.05)
+    assert midpoints[1] == pytest.approx(2.75, abs=0.05)
+
+
+def test_segments_overlap_their_neighbours(monkeypatch):
+    audio = speech_with_pauses([1.0, 1.0, 1.0])
+    monkeypatch.setattr(transcription, "plan_cuts", lambda duration, silences: [1.25, 2.75])
+
+    segments = split_audio(audio, overlap_ms=200)
+
+    assert [(segment.start, segment.end) for segment in segments] == [(0.0, 1.25), (1.25, 2.75), (2.75, 4.0)]
+    durations = [decode_wav(io.BytesIO(segment.wav)).duration for segment in segments]
+    assert durations == pytest.approx([1.45, 1.9, 1.45], abs=0.01)
+
+
+def test_wav_round_trip_and_8_bit_decoding():
+    samples = np.array([[0.0], [0.5], [-0.5]], dtype=np.float32)
+    assert decode_wav(io.BytesIO(encode_wav(samples, RATE))).samples == pytest.approx(samples, abs=1e-4)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as writer:
+        writer.setnchannels(1)
+        writer.setsampwidth(1)
+        writer.setframerate(RATE)
+        writer.writeframes(bytes([128, 192, 64]))
+    buffer.seek(0)
+    assert decode_wav(buffer).samples[:, 0] == pytest.approx([0.0, 0.5, -0.5])
+
+    with pytest.raises(UnsupportedAudio):
+        decode_wav(io.BytesIO(b"ID3 not a wav"))
+
+
+def test_stitch_drops_words_repeated_by_the_overlap():
+    assert stitch("Habari za asubuhi, karibu", "Karibu ofisini kwetu.") == "Habari za asubuhi, karibu ofisini kwetu."
+    assert stitch("Fomu ya madai", "ya madai ijazwe leo") == "Fomu ya madai ijazwe leo"
+    assert stitch("Fomu ya madai", "Ijazwe leo") == "Fomu ya madai Ijazwe leo"
+    assert stitch("", " Mwanzo ") == "Mwanzo"
+    assert stitch("Mwisho wa sentensi", "sentensi") == "Mwisho wa sentensi"
+
+
+def test_transcript_text_accepts_each_envelope():
+    assert transcript_text({"text": "a"}) == "a"
+    assert transcript_text({"data": {"transcription": "b"}}) == "b"
+    assert transcript_text({"data": [{"transcript": "c"}, {"text": "d"}]}) == "c d"
+    assert transcript_text("e") == "e"
+    assert transcript_text({"other": 1}) == ""
+
+
+def test_long_audio_is_reported_in_order_and_stitched(monkeypatch):
+    segments = [AudioSegment(i, float(i), float(i + 1), b"") for i in range(3)]
+    monkeypatch.setattr(transcription, "split_audio", lambda audio: segments)
+    texts = {0: "Habari za leo", 1: "za leo ni nzuri", 2: "asante"}
+    delays = {0: 0.03, 1: 0.0, 2: 0.01}
+
+    async def transcribe_segment(segment, form, filename):
+        await asyncio.sleep(delays[segment.index])
+        if segment.index == 2:
+            return {"segment": 2, "start": 2.0, "end": 3.0, "text": "", "error": "TimeoutError: "}
+        return {"segment": segment.index, "start": segment.start, "end": segment.end, "text": texts[segment.index]}
+
+    monkeypatch.setattr(transcription, "transcribe_segment", transcribe_segment)
+
+    async def scenario():
+        audio = PCMAudio(np.zeros((3 * RATE, 1), dtype=np.float32), RATE)
+        return [result async for result in transcription.transcribe_long(audio, {}, "call")]
+
+    results = asyncio.run(scenario())
+    assert [result["segment"] for result in results[:-1]] == [0, 1, 2]
+    assert results[-1]["text"] == "Habari za leo ni nzuri"
+    assert results[-1]["errors"] == [{"segment": 2, "detail": "TimeoutError: "}]
+
+
+def test_segment_is_retried_after_a_transport_error(monkeypatch):
+    calls = []
+
+    async def post(url, files=None, headers=None):
+        calls.append(files["file"][0])
+        if len(calls) == 1:
+            raise httpx.ConnectError("reset")
+        return httpx.Response(200, json={"text": " sawa "}, request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(transcription.upstream, "post", post)
+    monkeypatch.setattr(transcription, "SEGMENT_RETRIES", 1)
+    segment = AudioSegment(4, 120.0, 150.0, b"RIFF")
+
+    result = asyncio.run(transcription.transcribe_segment(segment, {"prompt": "x"}, "call"))
+
+    assert result == {"segment": 4, "start": 120.0, "end": 150.0, "text": "sawa"}
+    assert calls == ["call.part4.wav", "call.part4.wav"]
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    calls = []
+
+    async def post(url, files=None, headers=None):
+        calls.append(url)
+        return httpx.Response(400, json={"detail": "bad"}, request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(transcription.upstream, "post", post)
+    monkeypatch.setattr(transcription, "SEGMENT_RETRIES", 2)
+
+    result = asyncio.run(transcription.transcribe_segment(AudioSegment(0, 0.0, 1.0, b""), {}, "call"))
+
+    assert result["error"] == "STT service returned 400"
+    assert len(calls) == 1
@@ -0,0 +1,56 @@
+import asyncio
+import hashlib
+from tempfile import SpooledTemporaryFile
+import pytest
+from fastapi import HTTPException, UploadFile
+from fastapi.testclient import TestClient
+from app.utils.uploads import SPOOL_THRESHOLD, spool_upload
+from main import app
+
+
+def make_upload(data: bytes, name: str = "a.pdf") -> UploadFile:
+    file = SpooledTemporaryFile(max_size=1024 * 1024)
+    file.write(data)
+    file.seek(0)
+    return UploadFile(file=file, size=len(data), filename=name)
+
+
+def test_large_upload_reuses_starlettes_spool():
+    data = b"x" * (SPOOL_THRESHOLD + 1)
+    upload = make_upload(data)
+    original = upload.file
+
+    spooled = asyncio.run(spool_upload(upload, max_bytes=len(data)))
+    # The form closing its files must not close the adopted one
+    asyncio.run(upload.close())
+
+    assert spooled.file is original
+    assert spooled.sha256 == hashlib.sha256(data).hexdigest()
+    assert spooled.body().read() == data
+    spooled.close()
+
+
+def test_small_upload_is_copied_into_memory():
+    data = b"habari"
+    spooled = asyncio.run(spool_upload(make_upload(data)))
+    assert spooled.in_memory
+    assert spooled.body() == data
+    assert spooled.sha256 == hashlib.sha256(data).hexdigest()
+
+
+def test_upload_over_the_limit_is_rejected():
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(spool_upload(make_upload(b"x" * 2048), max_bytes=1024))
+    assert raised.value.status_code == 413
+
+
+def test_oversized_request_is_rejected_with_cors_headers():
+    client = TestClient(app)
+    response = client.post(
+        "/v1/chat/request",
+        content=b"",
+        headers={"Origin": "http://localhost:3000", "Content-Length": str(17 * 1024 * 1024)},
+    )
+
+    assert response.status_code == 413
+    assert response.headers.get("access-control-allow-origin") in ("*", "http://localhost:3000")